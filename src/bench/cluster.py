@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks the whole protocol stack on in-process clusters (see
+simulate.py) : election (yo-yo), topology gathering (shout), ring
+construction, then messages between random nodes and a file transfer on the
+ring, over generated topologies of increasing size and density.
+Each case runs in a fresh process, and reports for each phase the wall time
+of the slowest node, and the messages and bytes sent by all nodes, as well
+as the peak memory of the process. Results are saved as JSON, so that two
+commits can be compared.
+Run from /src/ with `python -m bench.cluster [results.json [n ...]]`, and
+compare two results with `python -m bench.cluster compare old.json new.json`
+"""
+
+import os
+import sys
+import json
+import time
+import math
+import random
+import shutil
+import platform
+import resource
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing
+
+from lib.config import *
+from lib.constants import *
+from simulate import simulate
+
+DEFAULT_SIZES = [50, 100, 200, 400]
+# average degrees of the generated graphs
+DEGREES = [4, 8]
+FAMILIES = [ERDOS_RENYI, BARABASI_ALBERT]
+SEED = 1
+NB_RING_MSGS = 200
+FILE_SIZE = 4 * 1024 * 1024
+# a phase not over after PHASE_TIMEOUT seconds fails the case
+PHASE_TIMEOUT = 120
+
+# mailboxes of the messages of each phase
+PHASE_MAILBOXES = {
+    "election": (YO_PHASE, OY_PHASE),
+    "shout": (SHOUT,),
+    "ring": (BROADCAST,),
+    "ring messages": (RING, RING_INTERACTIVE),
+    "file transfer": (RING, RING_INTERACTIVE, RING_BULK),
+}
+
+
+# _________________________________________________________________________
+# _______________________ MEASURES ________________________________________
+
+def sent(nodes, mailboxes):
+    """
+    Returns:
+        (messages, bytes) sent by all nodes in mailboxes
+    """
+    return (sum(x.metrics.sent.get(box, 0)
+                for x in nodes for box in mailboxes),
+            sum(x.metrics.sent_bytes.get(box, 0)
+                for x in nodes for box in mailboxes))
+
+
+def nb_opened(nodes, msg_type):
+    return sum(x.metrics.ring.get((msg_type, "open"), 0) for x in nodes)
+
+
+def run_ring(nodes, done):
+    """
+    Runs the main loops of all nodes, one round after the other, until
+    done() is true.
+    Returns:
+        float, the time it took
+    """
+    start = time.perf_counter()
+    while not done():
+        if time.perf_counter() - start > PHASE_TIMEOUT:
+            raise RuntimeError("ring phase timed out")
+        for x in nodes:
+            x.get_msg_non_blocking()
+            x.send_file_chunks()
+            x.flush_outbox()
+    return time.perf_counter() - start
+
+
+def phase_result(nodes, phase, seconds):
+    messages, nb_bytes = sent(nodes, PHASE_MAILBOXES[phase])
+    return {"seconds": seconds, "messages": messages, "bytes": nb_bytes}
+
+
+def run_case(family, n, degree, seed=SEED):
+    """
+    Sets up a cluster, then sends NB_RING_MSGS messages between random
+    nodes, and a file of FILE_SIZE bytes between two nodes.
+    Returns:
+        dict, the measures of each phase
+    """
+    random.seed(seed)
+    nodes = simulate(n, n * degree // 2, family, seed)
+    m = sum(len(x.neighbors_ids) for x in nodes) // 2
+    result = {"family": family, "n": n, "m": m, "seed": seed, "phases": {}}
+    for phase in ("election", "shout", "ring"):
+        result["phases"][phase] = phase_result(
+            nodes, phase, max(x.metrics.phases[phase] for x in nodes)
+        )
+    # the yo-yo bound : O(m log n) messages
+    result["phases"]["election"]["per_m_log_n"] = \
+        result["phases"]["election"]["messages"] / (m * math.log2(n))
+
+    for _ in range(NB_RING_MSGS):
+        a, b = random.sample(nodes, 2)
+        a.send_on_ring(RING_MSG, "benchmark", b.my_id)
+    seconds = run_ring(
+        nodes, lambda: nb_opened(nodes, RING_MSG) == NB_RING_MSGS
+    )
+    result["phases"]["ring messages"] = \
+        phase_result(nodes, "ring messages", seconds)
+
+    # the file is unlinked once opened by the sender : the receiver, in the
+    # same working directory, writes a new file
+    base = sent(nodes, PHASE_MAILBOXES["file transfer"])
+    with open("bench_file.bin", 'wb') as f:
+        f.write(os.urandom(FILE_SIZE))
+    nodes[0].ring_send_file("bench_file.bin", nodes[-1].my_id)
+    os.unlink("bench_file.bin")
+    nb_chunks = FILE_SIZE // FILE_CHUNK_SIZE + 1
+    seconds = run_ring(
+        nodes, lambda: nb_opened(nodes, RING_FILE) == nb_chunks
+    )
+    transfer = phase_result(nodes, "file transfer", seconds)
+    transfer["messages"] -= base[0]
+    transfer["bytes"] -= base[1]
+    result["phases"]["file transfer"] = transfer
+    return result
+
+
+def case_process(family, n, degree, results):
+    """
+    Runs a case in its own working directory, output silenced, and puts
+    the result (or the error) in the results queue
+    """
+    workdir = tempfile.mkdtemp(prefix="bench_cluster_")
+    os.chdir(workdir)
+    try:
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                result = run_case(family, n, degree)
+        # ru_maxrss is in KB on Linux
+        result["max_rss_mb"] = \
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        results.put(result)
+    except Exception as e:
+        results.put({"family": family, "n": n, "error": repr(e)})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_suite(sizes):
+    """
+    Runs all cases, each in a new process.
+    Returns:
+        list, the results of the cases
+    """
+    results = multiprocessing.Queue()
+    all_results = []
+    for family in FAMILIES:
+        for degree in DEGREES:
+            for n in sizes:
+                p = multiprocessing.Process(
+                    target=case_process, args=(family, n, degree, results)
+                )
+                p.start()
+                result = results.get()
+                p.join()
+                result["degree"] = degree
+                print_result(result)
+                all_results.append(result)
+    return all_results
+
+
+# _________________________________________________________________________
+# _______________________ REPORTS _________________________________________
+
+def case_name(result):
+    return "%s n=%s d=%s" % (result["family"], result["n"],
+                             result.get("degree"))
+
+
+def print_result(result):
+    if "error" in result:
+        print("%s : %s" % (case_name(result), result["error"]))
+        return
+    print("%s (m=%s, %.0f MB)"
+          % (case_name(result), result["m"], result["max_rss_mb"]))
+    for phase, r in result["phases"].items():
+        print("    %-14s %9.3fs %10d msgs %12d bytes"
+              % (phase, r["seconds"], r["messages"], r["bytes"]))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path):
+    """
+    Prints the ratio new / old of the time and messages of each phase of
+    the cases found in both results
+    """
+    with open(old_path) as f:
+        old = {case_name(r): r for r in json.load(f)["results"]
+               if "error" not in r}
+    with open(new_path) as f:
+        new = [r for r in json.load(f)["results"] if "error" not in r]
+    print("%-32s %-14s %10s %10s" % ("case", "phase", "time", "messages"))
+    for r in new:
+        if case_name(r) not in old:
+            continue
+        for phase, measures in r["phases"].items():
+            before = old[case_name(r)]["phases"].get(phase)
+            if before:
+                print("%-32s %-14s %9.2fx %9.2fx" % (
+                    case_name(r), phase,
+                    measures["seconds"] / max(before["seconds"], 1e-9),
+                    measures["messages"] / max(before["messages"], 1)
+                ))
+
+
+def main(argv):
+    if len(argv) == 4 and argv[1] == "compare":
+        compare(argv[2], argv[3])
+        return
+    path = argv[1] if len(argv) > 1 else "bench_cluster.json"
+    sizes = [int(n) for n in argv[2:]] or DEFAULT_SIZES
+    results = run_suite(sizes)
+    with open(path, 'w') as f:
+        json.dump({
+            "commit": git_commit(),
+            "time": time.time(),
+            "python": platform.python_version(),
+            "config": {"codec": CODEC, "coalesce": COALESCE,
+                       "use_fingers": USE_FINGERS,
+                       "ring_construction": RING_CONSTRUCTION},
+            "results": results
+        }, f, indent=1)
+    print("Results saved in %s" % path)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compares the JSON and binary codecs on typical protocol messages : encoding
+and decoding time, and size on the wire.
+Run from /src/ with `python -m bench.codec [nb_nodes]`
+"""
+
+import sys
+import base64
+import timeit
+
+from lib.constants import *
+from lib.codec import JsonCodec, BinaryCodec, pack_adjacency
+
+DEFAULT_NB_NODES = 100
+NB_RUNS = 2000
+
+
+def sample_messages(n):
+    """
+    Returns a dictionary {name: message} of messages shaped like the ones
+    exchanged by the protocols, on a network of n nodes with ids 1..n
+    """
+    ids = list(range(1, n+1))
+    subtree = {u: ids[u:u+4] for u in ids}
+    compact = b''.join(pack_adjacency(u, subtree[u]) for u in subtree)
+    return {
+        "yo": [421, 17],
+        "oy": [421, NO, PRUNE_OUR_LINK],
+        "shout flux": [FLUX, 421, None],
+        "shout answer": [ANSWER, 421, YES],
+        "shout reflux": [REFLUX, 421, subtree],
+        "reflux compact": [REFLUX, 421, base64.b64encode(compact).decode()],
+        "ring msg": {
+            TYPE: RING_MSG,
+            BODY: "hello mister 471",
+            RECEIVER: 471,
+            DIRECTION: RIGHT,
+            ROUTE: ids[:5],
+            SENDER: 421,
+            FILENAME: None,
+            SEQ: None,
+            LAST: True
+        },
+        "ring broadcast": [ids[i:i+3] for i in range(n)],
+    }
+
+
+def bench_codec(codec, msg, nb_runs=NB_RUNS):
+    """
+    Returns:
+        (bytes per message, encoding time in us, decoding time in us)
+    """
+    body = codec.encode(msg)
+    size = len(body.encode() if isinstance(body, str) else body)
+    enc = timeit.timeit(lambda: codec.encode(msg), number=nb_runs)
+    dec = timeit.timeit(lambda: codec.decode(body), number=nb_runs)
+    return size, 1e6 * enc / nb_runs, 1e6 * dec / nb_runs
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else DEFAULT_NB_NODES
+    codecs = [("json", JsonCodec()), ("binary", BinaryCodec())]
+    print("%-16s %-8s %10s %12s %12s"
+          % ("message", "codec", "bytes", "encode (us)", "decode (us)"))
+    for name, msg in sample_messages(n).items():
+        for codec_name, codec in codecs:
+            size, enc, dec = bench_codec(codec, msg)
+            print("%-16s %-8s %10d %12.2f %12.2f"
+                  % (name, codec_name, size, enc, dec))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
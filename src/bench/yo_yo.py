@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Measures the local cost of yo-yo rounds on a single node of high degree (a
+hub), the messaging being left out : the hub's neighbors answer at once,
+with their own id in the yo- phase and YES in the -yo phase.
+Run from /src/ with `python -m bench.yo_yo [degree ...]`
+"""
+
+import sys
+import time
+from collections import deque
+
+from lib.constants import *
+from lib.yo_yo import yo_phase, oy_phase, get_role, EdgeStates
+from lib.yo_yo import in_edges, out_edges
+
+DEFAULT_DEGREES = [100, 1000, 10000]
+NB_ROUNDS = 20
+
+
+class HubNode:
+    """
+    Stands for a PikaNode whose neighbors answer right away
+    """
+    def __init__(self, degree):
+        self.my_id = degree // 2
+        self.neighbors_ids = [v for v in range(degree + 1) if v != self.my_id]
+        self.nb_sent = 0
+        self.senders = {YO_PHASE: deque(), OY_PHASE: deque()}
+
+    def send_msg(self, msg, receiver_id, mailbox=None):
+        self.nb_sent += 1
+
+    def recv_msg(self, mailbox, callback):
+        senders = self.senders[mailbox]
+        if not senders:     # first message of the phase
+            senders.extend(
+                in_edges(self) if mailbox == YO_PHASE else out_edges(self)
+            )
+        v = senders.popleft()
+        if mailbox == YO_PHASE:
+            callback([v, v])
+        else:
+            callback([v, YES, DONT_PRUNE_OUR_LINK])
+
+    def yoyo_recv_id_callback(self, msg):
+        sender, packet = msg
+        self.id_received[sender] = packet
+
+    def oy_oy_callback(self, msg):
+        sender, packet, prune_or_not = msg
+        if packet == NO:
+            self.edges_to_flip.add(sender)
+        self.yes_no_received[sender] = packet
+
+
+def bench_rounds(degree, nb_rounds=NB_ROUNDS):
+    """
+    Returns:
+        (time per round in ms, number of messages sent per round)
+    """
+    node = HubNode(degree)
+    node.edges = EdgeStates(
+        {v: IN if v < node.my_id else OUT for v in node.neighbors_ids}
+    )
+    get_role(node)
+    start = time.perf_counter()
+    for _ in range(nb_rounds):
+        yo_phase(node)
+        oy_phase(node)
+    elapsed = time.perf_counter() - start
+    return 1e3 * elapsed / nb_rounds, node.nb_sent / nb_rounds
+
+
+def main(argv):
+    degrees = [int(d) for d in argv[1:]] or DEFAULT_DEGREES
+    print("%10s %14s %14s" % ("degree", "round (ms)", "msgs / round"))
+    for degree in degrees:
+        ms, nb_sent = bench_rounds(degree)
+        print("%10d %14.2f %14d" % (degree, ms, nb_sent))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,18 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Runs a whole network on this machine, headless : the main launcher, and the
+PikaNodes spread over a pool of worker processes, several nodes (threads)
+per process. The nodes of a worker share a few broker connections, each
+node on its own channel (see ConnectionPool in lib/transport.py). Nodes talk
+through the broker, so TRANSPORT must be "amqp" ; simulate.py runs a network
+without RabbitMQ.
+    + the main launcher declares its queue before any node starts, then
+      collects the nodes' ids and sends them their neighbors
+    + each node writes its output to its own log file
+    + workers report each node once its ring is set up, and the runner
+      prints when the whole network is ready
+    + Ctrl-C (or SIGTERM) stops the main loops of all nodes, which delete
+      their queues and close their connections. Nodes still in their setup
+      stop waiting, delete their queues too, and are reported as failed.
+      The launcher then deletes the queues left by the nodes
+Run from /src/ with the arguments of main.py :
+`python launch_multiple_nodes.py [n] [s] [family] [seed]` or
+`python launch_multiple_nodes.py edges.txt`
+"""
+
+import os
 import sys
-import subprocess
+import time
+import queue
+import signal
+import threading
+import traceback
+import multiprocessing
+
+from lib.config import *
+from lib.constants import *
+from lib.ids import random_id
+from lib.pika_node import PikaNode, NodeStopped
+from lib.transport import ConnectionPool
+from main import make_launcher
+
+LOG_DIR = "logs"
+# worker processes, one per core if None
+NB_PROCESSES = None
+# broker connections of each worker, unless SHARED_CONNECTIONS is set
+WORKER_CONNECTIONS = 2
+# seconds given to the nodes to close their connections
+SHUTDOWN_TIMEOUT = 10
+
+# events sent by the workers
+READY = "ready"
+FAILED = "failed"
+EXITED = "exited"
+
+
+# _________________________________________________________________________
+# _______________________ NODE LOGS _______________________________________
+
+class NodeOutput(threading.local):
+    """
+    Stands for sys.stdout in the workers : each node thread writes to its
+    own log file, other threads to the real stdout
+    """
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.file = None
+
+    def target(self):
+        return self.file if self.file is not None else self.stdout
+
+    def write(self, data):
+        return self.target().write(data)
+
+    def flush(self):
+        self.target().flush()
+
+
+# _________________________________________________________________________
+# _______________________ WORKERS _________________________________________
+
+def run_node(node, log_dir, events):
+    """
+    Sets up the network on node, then runs its main loop until it is
+    stopped. A node which fails or is stopped during its setup deletes its
+    queues, and is reported as failed. Runs in a thread of a worker
+    """
+    path = os.path.join(log_dir, "node_%s.log" % node.my_id)
+    with open(path, 'w', buffering=1) as log:
+        sys.stdout.file = log
+        try:
+            node.setup_network()
+        except SystemExit:      # exit_program already closed the node
+            events.put((FAILED, node.my_id))
+            return
+        except Exception as e:
+            if isinstance(e, NodeStopped):
+                print(e)
+            else:
+                traceback.print_exc(file=log)
+            events.put((FAILED, node.my_id))
+            try:
+                node.close()
+            except Exception:
+                traceback.print_exc(file=log)
+            return
+        events.put((READY, node.my_id))
+        try:
+            node.polling_main_loop()
+        except SystemExit:      # exit_program ends the thread
+            pass
+        events.put((EXITED, node.my_id))
+
+
+def run_worker(nb_nodes, log_dir, events, stop):
+    """
+    Runs nb_nodes PikaNodes as threads of this process, until stop is set.
+    Args:
+        nb_nodes: int, the number of nodes of this worker
+        log_dir: str, the directory of the nodes' log files
+        events: multiprocessing.Queue, where (event, node id) are reported
+        stop: multiprocessing.Event, set by the runner to stop the nodes
+    """
+    # Ctrl-C reaches the whole process group : the runner decides
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sys.stdout = NodeOutput(sys.stdout)
+    threading.stack_size(NODE_STACK_SIZE)
+
+    pool = ConnectionPool(SHARED_CONNECTIONS or WORKER_CONNECTIONS)
+    nodes = [PikaNode(random_id(), pool.transport(), interactive=False,
+                      verbose=True)
+             for _ in range(nb_nodes)]
+    threads = [threading.Thread(target=run_node,
+                                args=(node, log_dir, events), daemon=True)
+               for node in nodes]
+    for t in threads:
+        t.start()
+    stop.wait()
+    for node in nodes:
+        node.stop()
+    deadline = time.time() + SHUTDOWN_TIMEOUT
+    for t in threads:
+        t.join(max(0, deadline - time.time()))
+    pool.close()
+
+
+def start_workers(n, log_dir, events, stop, nb_processes=NB_PROCESSES):
+    """
+    Spreads n nodes evenly over the worker processes.
+    Returns:
+        list, the started processes
+    """
+    nb_processes = min(nb_processes or os.cpu_count() or 1, n)
+    workers = []
+    for i in range(nb_processes):
+        nb_nodes = n // nb_processes + (i < n % nb_processes)
+        p = multiprocessing.Process(target=run_worker,
+                                    args=(nb_nodes, log_dir, events, stop))
+        p.start()
+        workers.append(p)
+    return workers
+
+
+# _________________________________________________________________________
+# _______________________ RUNNER __________________________________________
+
+def wait_events(events, workers, n, kinds):
+    """
+    Waits until n events of the given kinds came, or all workers are gone.
+    Returns:
+        dict, the number of events of each kind
+    """
+    counts = {kind: 0 for kind in (READY, FAILED, EXITED)}
+    while sum(counts[kind] for kind in kinds) < n:
+        try:
+            event, node_id = events.get(timeout=1)
+        except queue.Empty:
+            if not any(p.is_alive() for p in workers):
+                break
+            continue
+        counts[event] += 1
+        if event == FAILED:
+            print("Node %s failed, see its log" % node_id)
+    return counts
+
+
+def drain_events(events):
+    """
+    Returns:
+        dict, the number of events of each kind left in events, once the
+        workers are gone
+    """
+    counts = {kind: 0 for kind in (READY, FAILED, EXITED)}
+    while True:
+        try:
+            event, _ = events.get(timeout=0.1)
+        except queue.Empty:
+            return counts
+        counts[event] += 1
+
+
+def run_network(launcher, log_dir=LOG_DIR, nb_processes=NB_PROCESSES):
+    """
+    Starts the nodes of the launcher's network, and runs them until Ctrl-C,
+    SIGTERM, or until all of them exited
+    """
+    n = launcher.nb_nodes
+    os.makedirs(log_dir, exist_ok=True)
+    events = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+
+    # the nodes send their ids to the main queue as soon as they start
+    launcher.init_connection()
+    start = time.time()
+    workers = start_workers(n, log_dir, events, stop, nb_processes)
+    try:
+        print("Starting %s nodes in %s processes, logs in %s"
+              % (n, len(workers), log_dir))
+        launcher.setup_network()
+        print("%s nodes declared in %.2fs" % (n, time.time() - start))
 
-DEFAULT_NB_NODES = 3
+        counts = wait_events(events, workers, n, (READY, FAILED))
+        print("%s nodes ready in %.2fs, %s failed. Ctrl-C to stop"
+              % (counts[READY], time.time() - start, counts[FAILED]))
+        wait_events(events, workers, counts[READY], (EXITED,))
+    except (KeyboardInterrupt, SystemExit):
+        print("\nStopping the nodes")
+    finally:
+        stop.set()
+        for p in workers:
+            p.join(SHUTDOWN_TIMEOUT)
+            if p.is_alive():
+                p.terminate()
+    counts = drain_events(events)
+    if counts[FAILED]:
+        print("%s nodes were stopped during their setup" % counts[FAILED])
+    launcher.delete_nodes_queues()
+    print("Exiting")
 
 
 def main(argv):
-    if len(argv) < 2:
-        n = DEFAULT_NB_NODES
-    else:
-        n = int(argv[1])
-    for i in range(n):
-        subprocess.call(
-            ["gnome-terminal", "-e", "python run_node.py"]
-        )
+    if TRANSPORT == MEMORY:
+        print("Nodes of different processes cannot share the in-memory "
+              "broker : use simulate.py")
+        return
+    run_network(make_launcher(argv))
 
 
 if __name__ == "__main__":
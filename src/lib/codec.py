@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This file contains the codecs turning protocol messages into message bodies.
+Two codecs are provided :
+    + JsonCodec, the original text format
+    + BinaryCodec, a compact versioned binary format, where the protocol
+      constants (message types, edge states, roles, ...) are sent as one byte
+      opcodes, and integers (node ids) as fixed width 32 or 64 bits fields.
+      Lists of integers (neighbors, routes) are packed as arrays, and
+      bytes are sent as they are
+All nodes of a deployment must use the same codec (see CODEC in config.py).
+It also contains the compact encoding of adjacency lists used by the shout
+protocol.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+from lib.config import CODEC
+from lib.constants import *
+
+
+class CodecError(Exception):
+    """
+    Raised when a message cannot be encoded, or a body cannot be decoded
+    """
+    pass
+
+
+# _________________________________________________________________________
+# _______________________ JSON CODEC ______________________________________
+
+class JsonCodec:
+    # bytes must be turned into text (base64) before being encoded
+    carries_bytes = False
+
+    def encode(self, msg):
+        return json.dumps(msg)
+
+    def decode(self, body):
+        return json.loads(body)
+
+    def encode_batch(self, bodies):
+        """
+        Returns the body of [BATCH, [msg_1, ..., msg_i]], given the bodies
+        of the messages
+        """
+        return '["%s", [%s]]' % (BATCH, ', '.join(bodies))
+
+
+# _________________________________________________________________________
+# _______________________ BINARY CODEC ____________________________________
+
+BINARY_VERSION = 1
+
+# value tags
+T_NONE = 0
+T_TRUE = 1
+T_FALSE = 2
+T_INT64 = 3
+T_STR = 4
+T_LIST = 5
+T_DICT = 6
+T_CONST = 7
+T_INT32 = 8
+T_INT32_ARRAY = 9
+T_INT64_ARRAY = 10
+T_BYTES = 11
+
+INT32_MIN = -2**31
+INT32_MAX = 2**31 - 1
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+
+# opcodes of the protocol constants. New constants must be appended at the
+# end of the tuple (and BINARY_VERSION bumped if one is removed), so that
+# opcodes do not change between versions
+OPCODES = (
+    MAIN_LAUNCHER, ID, NEIGHBORS,
+    DIRECTION, ROUTE, RECEIVER, BODY, TYPE, SENDER, FILENAME, SEQ, LAST,
+    RING_MSG, RING_ASK_FILE, RING_FILE, NO_SUCH_FILE,
+    IN, OUT, PRUNED, SOURCE, INTERMEDIATE, SINK, LEADER,
+    YES, NO, PRUNE_OUR_LINK, DONT_PRUNE_OUR_LINK,
+    ANSWER, FLUX, REFLUX,
+    RIGHT, LEFT,
+    FINGER, SEGMENT, RING_ROUTE,
+    YO_PHASE, OY_PHASE, SHOUT, BROADCAST, RING,
+    BATCH, RING_INTERACTIVE, RING_BULK,
+    RING_FILE_ACK,
+    TARGET, ORIGIN,
+)
+OPCODE_OF = {c: i for i, c in enumerate(OPCODES)}
+
+INT32 = struct.Struct('>i')
+INT64 = struct.Struct('>q')
+UINT32 = struct.Struct('>I')
+TAG_INT32 = struct.Struct('>Bi')
+TAG_INT64 = struct.Struct('>Bq')
+TAG_UINT32 = struct.Struct('>BI')
+
+
+class BinaryCodec:
+    carries_bytes = True
+
+    def encode(self, msg):
+        out = bytearray([BINARY_VERSION])
+        self.encode_value(msg, out)
+        return bytes(out)
+
+    def encode_batch(self, bodies):
+        """
+        Returns the body of [BATCH, [msg_1, ..., msg_i]], given the bodies
+        of the messages, whose version byte is dropped
+        """
+        out = bytearray([BINARY_VERSION])
+        out += TAG_UINT32.pack(T_LIST, 2)
+        out += bytes([T_CONST, OPCODE_OF[BATCH]])
+        out += TAG_UINT32.pack(T_LIST, len(bodies))
+        for body in bodies:
+            out += body[1:]
+        return bytes(out)
+
+    def encode_value(self, v, out):
+        """
+        Appends the encoding of v to the bytearray out
+        """
+        if v is None:
+            out.append(T_NONE)
+        elif v is True:
+            out.append(T_TRUE)
+        elif v is False:
+            out.append(T_FALSE)
+        elif isinstance(v, int):
+            if INT32_MIN <= v <= INT32_MAX:
+                out += TAG_INT32.pack(T_INT32, v)
+            elif INT64_MIN <= v <= INT64_MAX:
+                out += TAG_INT64.pack(T_INT64, v)
+            else:
+                raise CodecError("Integer out of the int64 range : %s" % v)
+        elif isinstance(v, str):
+            opcode = OPCODE_OF.get(v)
+            if opcode is not None:
+                out.append(T_CONST)
+                out.append(opcode)
+            else:
+                data = v.encode('utf-8')
+                out += TAG_UINT32.pack(T_STR, len(data))
+                out += data
+        elif isinstance(v, (bytes, bytearray)):
+            out += TAG_UINT32.pack(T_BYTES, len(v))
+            out += v
+        elif isinstance(v, (list, tuple)):
+            if v and all(type(e) is int for e in v):
+                low, high = min(v), max(v)
+                if INT32_MIN <= low and high <= INT32_MAX:
+                    out += TAG_UINT32.pack(T_INT32_ARRAY, len(v))
+                    out += struct.pack('>%di' % len(v), *v)
+                elif low < INT64_MIN or high > INT64_MAX:
+                    raise CodecError("Integer out of the int64 range : %s"
+                                     % (low if low < INT64_MIN else high))
+                else:
+                    out += TAG_UINT32.pack(T_INT64_ARRAY, len(v))
+                    out += struct.pack('>%dq' % len(v), *v)
+            else:
+                out += TAG_UINT32.pack(T_LIST, len(v))
+                for e in v:
+                    self.encode_value(e, out)
+        elif isinstance(v, dict):
+            out += TAG_UINT32.pack(T_DICT, len(v))
+            for k in v:
+                self.encode_value(k, out)
+                self.encode_value(v[k], out)
+        else:
+            raise CodecError("Cannot encode %r" % (v,))
+
+    def decode(self, body):
+        if not body or body[0] != BINARY_VERSION:
+            raise CodecError("Unknown binary codec version")
+        try:
+            v, i = self.decode_value(body, 1)
+        except (IndexError, struct.error):
+            raise CodecError("Truncated body")
+        except UnicodeDecodeError:
+            raise CodecError("Invalid UTF-8 string")
+        return v
+
+    def decode_value(self, body, i):
+        """
+        Decodes the value starting at index i of body.
+        Returns:
+            the value, and the index right after it
+        """
+        tag = body[i]
+        i += 1
+        if tag == T_INT32:
+            return INT32.unpack_from(body, i)[0], i + 4
+        elif tag == T_INT32_ARRAY:
+            n = UINT32.unpack_from(body, i)[0]
+            i += 4
+            return list(struct.unpack_from('>%di' % n, body, i)), i + 4*n
+        elif tag == T_CONST:
+            return OPCODES[body[i]], i + 1
+        elif tag == T_LIST:
+            n = UINT32.unpack_from(body, i)[0]
+            i += 4
+            result = []
+            for _ in range(n):
+                v, i = self.decode_value(body, i)
+                result.append(v)
+            return result, i
+        elif tag == T_STR:
+            n = UINT32.unpack_from(body, i)[0]
+            i += 4
+            return body[i:i+n].decode('utf-8'), i + n
+        elif tag == T_DICT:
+            n = UINT32.unpack_from(body, i)[0]
+            i += 4
+            result = dict()
+            for _ in range(n):
+                k, i = self.decode_value(body, i)
+                result[k], i = self.decode_value(body, i)
+            return result, i
+        elif tag == T_INT64:
+            return INT64.unpack_from(body, i)[0], i + 8
+        elif tag == T_INT64_ARRAY:
+            n = UINT32.unpack_from(body, i)[0]
+            i += 4
+            return list(struct.unpack_from('>%dq' % n, body, i)), i + 8*n
+        elif tag == T_BYTES:
+            n = UINT32.unpack_from(body, i)[0]
+            i += 4
+            if i + n > len(body):
+                raise CodecError("Truncated body")
+            return bytes(body[i:i+n]), i + n
+        elif tag == T_NONE:
+            return None, i
+        elif tag == T_TRUE:
+            return True, i
+        elif tag == T_FALSE:
+            return False, i
+        raise CodecError("Unknown tag %s" % tag)
+
+
+# _________________________________________________________________________
+# _______________________ ADJACENCY ENCODING ______________________________
+
+def encode_varints(values):
+    """
+    Returns the LEB128 encoding of non negative integers : 7 bits per byte,
+    the high bit set on all bytes of a value but the last
+    """
+    out = bytearray()
+    for v in values:
+        while v >= 0x80:
+            out.append((v & 0x7f) | 0x80)
+            v >>= 7
+        out.append(v)
+    return bytes(out)
+
+
+def decode_varints(data):
+    """
+    Decodes a sequence of LEB128 integers with array operations.
+    Returns:
+        array of uint64, the values
+    """
+    b = np.frombuffer(data, dtype=np.uint8)
+    if not len(b):
+        return np.empty(0, dtype=np.uint64)
+    last = (b & 0x80) == 0
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    value_of_byte = np.repeat(np.arange(len(starts)), np.diff(
+        np.append(starts, len(b))
+    ))
+    shift = 7 * (np.arange(len(b)) - starts[value_of_byte])
+    parts = (b & 0x7f).astype(np.uint64) << shift.astype(np.uint64)
+    return np.bitwise_or.reduceat(parts, starts)
+
+
+def pack_adjacency(node_id, neighbors):
+    """
+    Returns the record of a node in the compact adjacency format : its id,
+    then the number and the sorted list of its neighbors of greater id, each
+    as the difference with the previous one (the first one with node_id).
+    Each edge is thus sent once, by its end of smaller id, and records can
+    be concatenated.
+    """
+    greater = sorted(v for v in neighbors if v > node_id)
+    deltas = [b - a for a, b in zip([node_id] + greater, greater)]
+    return encode_varints([node_id, len(greater)] + deltas)
+
+
+def unpack_adjacency(data):
+    """
+    Decodes concatenated records of pack_adjacency.
+    Returns:
+        dict, {u: [v_1, ..., v_i]} the adjacency lists of all the nodes
+    """
+    values = decode_varints(data).astype(np.int64)
+    counts = values.tolist()
+    # walk the records : id, count, then count deltas
+    heads = []
+    i = 0
+    while i < len(counts):
+        heads.append(i)
+        i += 2 + counts[i + 1]
+    heads = np.array(heads, dtype=np.int64)
+    ids = values[heads]
+    nb = values[heads + 1]
+    # the deltas of all records, one after the other
+    offset = np.cumsum(nb) - nb
+    deltas = values[np.repeat(heads + 2 - offset, nb) + np.arange(nb.sum())]
+    # neighbors are the cumulated sums of the deltas within each record
+    sums = np.cumsum(deltas)
+    before = np.repeat(np.append(0, sums)[offset], nb)
+    owner = np.repeat(ids, nb)
+    neighbor = owner + sums - before
+
+    # both directions of each edge, grouped by node
+    u = np.concatenate((owner, neighbor))
+    v = np.concatenate((neighbor, owner))
+    order = np.argsort(u, kind='stable')
+    u, v = u[order], v[order]
+    graph = {w: [] for w in ids.tolist()}
+    if len(u):
+        bounds = np.flatnonzero(np.diff(u)) + 1
+        nodes = u[np.append(0, bounds)].tolist()
+        for w, vs in zip(nodes, np.split(v, bounds)):
+            graph[w] = vs.tolist()
+    return graph
+
+
+def make_codec(kind=CODEC):
+    """
+    Returns a codec of the given kind (JSON or BINARY)
+    """
+    if kind == JSON:
+        return JsonCodec()
+    elif kind == BINARY:
+        return BinaryCodec()
+    raise ValueError("Unknown codec : %s" % kind)
@@ -12,6 +12,19 @@ QUEUE_PREFIX = "pika_q_pr_"
 ID = "ID"
 NEIGHBORS = "NEIGHBORS"
 SELECT_TIMEOUT = 0.2
+MEMORY_WAIT_TIMEOUT = 0.2
+# stack size of the threads running nodes (simulations, worker processes) :
+# they only run the protocols, they do not need the default 8MB stack
+NODE_STACK_SIZE = 1024 * 1024
+# transports
+AMQP = "amqp"
+MEMORY = "memory"
+# codecs
+JSON = "json"
+BINARY = "binary"
+# main loops
+POLLING = "polling"
+ASYNCIO = "asyncio"
 
 DIRECTION = "DIRECTION"
 ROUTE = "ROUTE"
@@ -22,14 +35,48 @@ RING_MSG = "RING_MSG"
 SENDER = "SENDER"
 RING_ASK_FILE = "RING_ASK_FILE"
 RING_FILE = "RING_FILE"
+RING_FILE_ACK = "RING_FILE_ACK"
 FILENAME = "FILENAME"
+SEGMENT = "SEGMENT"
+TARGET = "TARGET"
+ORIGIN = "ORIGIN"
+RING_ROUTE = "RING_ROUTE"
 NO_SUCH_FILE = "NO SUCH FILE"
+SEQ = "SEQ"
+LAST = "LAST"
+FILE = "FILE"
+ACKED = "ACKED"
+# mailboxes, sorting the messages received by a node
+YO_PHASE = "YO_PHASE"
+OY_PHASE = "OY_PHASE"
+SHOUT = "SHOUT"
+BROADCAST = "BROADCAST"
+# ring traffic goes in three lanes, each its own mailbox : control (route
+# installations, in the RING mailbox), interactive (chat messages and file
+# requests, acknowledgements of file chunks), and bulk (file chunks).
+# Higher lanes are delivered and handled first
+RING = "RING"
+RING_INTERACTIVE = "RING_INTERACTIVE"
+RING_BULK = "RING_BULK"
+LANE_OF = {
+    RING_ROUTE: RING,
+    RING_MSG: RING_INTERACTIVE,
+    RING_ASK_FILE: RING_INTERACTIVE,
+    RING_FILE_ACK: RING_INTERACTIVE,
+    RING_FILE: RING_BULK
+}
+# message priorities of the lanes, other mailboxes have priority 0
+LANE_PRIORITY = {RING: 2, RING_INTERACTIVE: 1}
+MAX_PRIORITY = 2
+# several messages to the same queue, sent as one body
+BATCH = "BATCH"
 # COMMAND MACROS ______________________________________________________
 QUIT = "/q"
 SEND_MSG = "/s"
 LIST_NODES = "/l"
 HELP = "/h"
 ASK_FILE = "/ask_file"
+STATS = "/stats"
 
 # YO-YO ALGORITHM MACROS ______________________________________________________
 # edges
@@ -53,10 +100,25 @@ DONT_PRUNE_OUR_LINK = "NO_PRUNE"
 ANSWER = "ANSWER"
 FLUX = "FLUX"
 REFLUX = "REFLUX"
+# reflux formats
+DICT = "dict"
+COMPACT = "compact"
+
+
+# TOPOLOGIES _________________________________________________________________
+ERDOS_RENYI = "erdos_renyi"
+BARABASI_ALBERT = "barabasi_albert"
+GRID = "grid"
+TORUS = "torus"
+SMALL_WORLD = "small_world"
 
 
 # RING ALGORITHM MACROS _______________________________________________________
+# ring constructions
+CENTRAL = "central"
+DISTRIBUTED = "distributed"
 WHITE = "WHITE"
 BLACK = "BLACK"
 RIGHT = "RIGHT"
 LEFT = "LEFT"
+FINGER = "FINGER"
@@ -3,8 +3,8 @@
 
 # import graphviz as gv
 
-from random import choice, randrange
-from lib.config import DEFAULT_SPARSENESS
+from lib.constants import ERDOS_RENYI
+from lib.topology import generate
 
 
 def gen_graph(n, s):
@@ -17,39 +17,8 @@ def gen_graph(n, s):
     Returns:
         A dictionary {u: {v_1, ..., v_i}} representing the graph's edges
     """
-    # get the number of edges
-    if s == 0:        # get the default sparseness if need be
-        s = int(DEFAULT_SPARSENESS*n*(n-1)/2)
-    else:             # get a reasonnable number of edges
-        s = min(max(n-1, s), n*(n-1))
-    print("Generating a random connected graph with"
-          " %s vertices and %s edges" % (n, s))
-    edges = {v: set() for v in range(n)}
-    # first we build the graph's spanning tree
-    to_connect = {v for v in edges}
-    connected = set()
-    v = choice(tuple(to_connect))
-    to_connect.remove(v)
-    connected.add(v)
-
-    while to_connect:   # is not empty
-        u = choice(tuple(to_connect))
-        v = choice(tuple(connected))
-        edges[u].add(v)
-        edges[v].add(u)
-        to_connect.remove(u)
-        connected.add(u)
-
-    # now we need to add s-n+1 edges
-    to_add = s-n+1
-    while to_add > 0:
-        u, v = randrange(n), randrange(n)
-        if u != v and v not in edges[u]:
-            edges[u].add(v)
-            edges[v].add(u)
-            to_add -= 1
     # to_graphviz(edges)
-    return edges
+    return generate(ERDOS_RENYI, n, s).to_dict()
 
 
 def adj_matrix(edges):
@@ -61,7 +30,7 @@ def adj_matrix(edges):
         m, the adjacency matrix
     """
     n = len(edges)
-    return [[1 if j in edges[1] else 0 for j in range(n)] for i in range(n)]
+    return [[1 if j in edges[i] else 0 for j in range(n)] for i in range(n)]
 
 
 # def to_graphviz(edges):
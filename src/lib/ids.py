@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This file contains the allocation of the nodes' ids.
+Ids are integers of [RANDOM_START, RANDOM_END), about 2**63 values by
+default, so that they fit in a signed 64 bits integer (see the binary codec).
+    + a node proposes a random id, which is very unlikely to be taken
+    + when it is taken, the main launcher assigns a new one in O(1) : the
+      next value of a counter, scrambled by a bijection of the id space.
+      Successive ids are then distinct, and spread over the whole space
+"""
+
+import random
+
+from lib.config import RANDOM_START, RANDOM_END
+
+
+def random_id():
+    """
+    Returns a random id, for a node to propose to the main launcher
+    """
+    return random.SystemRandom().randrange(RANDOM_START, RANDOM_END)
+
+
+def scramble_id(i, bits):
+    """
+    Bijection of [0, 2**bits) : xor-shifts and multiplications by odd
+    constants are all invertible modulo 2**bits. 0 is mapped to 0
+    """
+    mask = (1 << bits) - 1
+    x = i & mask
+    x ^= x >> 31
+    x = (x * 0x7fb5d329728ea185) & mask
+    x ^= x >> 27
+    x = (x * 0x81dadef4bc2dd44d) & mask
+    x ^= x >> 33
+    return x
+
+
+class IdAllocator:
+    """
+    Hands out the ids of the network, in the order the nodes register
+    """
+    def __init__(self, start=RANDOM_START, end=RANDOM_END):
+        """
+        Args:
+            start, end: int, ids are taken in [start, end)
+        """
+        self.start = start
+        self.span = end - start
+        self.bits = max(1, (self.span - 1).bit_length())
+        self.taken = set()
+        self.counter = 0
+
+    def register(self, proposed_id):
+        """
+        Returns proposed_id if it is free, a new free id otherwise
+        """
+        new_id = proposed_id
+        while new_id in self.taken:
+            new_id = self.next_id()
+        self.taken.add(new_id)
+        return new_id
+
+    def next_id(self):
+        """
+        Returns the next counter value, scrambled within the id space. The
+        counter runs over [0, 2**bits), and values falling out of the space
+        are skipped (less than half of them). The id can only be taken if a
+        node proposed it, so register almost never calls this twice
+        """
+        while True:
+            if self.counter >> self.bits:
+                raise ValueError("No id left in [%s, %s)"
+                                 % (self.start, self.start + self.span))
+            x = scramble_id(self.counter, self.bits)
+            self.counter += 1
+            if x < self.span:
+                return self.start + x
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import heapq as hq
 import graphviz as gv
+from lib.config import USE_FINGERS
 from lib.constants import *
+from lib.routing import Router
+from lib.shout import subtree_summary
 
 
 color = dict()
@@ -12,8 +14,8 @@ color = dict()
 def make_ring(node):
     """
     main method for leader node to create a ring from a graph
-    Creates the virtual ring and initiates a broadcast of the ring
-    for other nodes to get it
+    Creates the virtual ring, and sends each node the part of it that it
+    needs, down the shout tree
     """
     assert(node.role == LEADER)
 
@@ -22,58 +24,302 @@ def make_ring(node):
         color[n] = WHITE
     color[node.my_id] = BLACK
     ring = make_ring_dfs(node, node.my_id)
-    draw_ring(node.graph, ring)
+    if node.interactive:
+        draw_ring(node.graph, ring)
 
-    # compute routes for the virtual ring
+    # compute routes for the virtual ring. The router is kept on the leader,
+    # so that the BFS already done are not done again
+    node.router = Router(node.graph)
     ring = [
-        get_path(node.graph, ring[i], ring[i+1]) for i in range(len(ring)-1)
-    ] + [get_path(node.graph, ring[-1], ring[0])]
-
-    print("The ring route is : %s" % ring)
-    # get own right and left routes
-    node.route_right = next(l for l in ring if l[0] == node.my_id)[1:]
-    node.route_left = [l[::-1] for l in ring if l[-1] == node.my_id][0][1:]
-
-    # get list of all nodes in the network
-    # and split ring in left side and right side
-    node.all_nodes = [l[0] for l in ring]
-    i = node.all_nodes.index(node.my_id)
-    node.all_nodes = node.all_nodes[i:] + node.all_nodes[:i]
-    node.nodes_right = node.all_nodes[:len(node.all_nodes)//2]
-    node.nodes_left = node.all_nodes[len(node.all_nodes)//2:]
-
-    # spread the ring informations to all other nodes on the network
+        node.router.path(ring[i], ring[i+1]) for i in range(len(ring)-1)
+    ] + [node.router.path(ring[-1], ring[0])]
+
+    if node.interactive:
+        print("The ring route is : %s" % ring)
+
+    # each node gets its own entry, and the size and length of the ring.
+    # The graph gathered by shout lists the nodes in the preorder of the
+    # shout tree (see shout.py), so that each subtree's entries follow
+    # each other. Without fingers, messages go around the ring in the
+    # direction reaching their receiver in fewer hops : each node then
+    # also gets the positions of all the nodes
+    entries = ring_entries(node, ring)
+    positions = None if USE_FINGERS else ring_positions(ring)
+    pass_ring_bundle(node, [len(ring), ring_length(ring), positions,
+                            [entries[u] for u in node.graph]])
+
+
+def ring_length(ring):
+    """
+    Returns the number of hops of the whole ring
+    """
+    return sum(len(route) - 1 for route in ring)
+
+
+def ring_positions(ring):
+    """
+    Returns the position of each node on the ring, as [node, index, offset].
+    Offsets are in hops from the leader
+    """
+    positions = []
+    offset = 0
+    for i, route in enumerate(ring):
+        positions.append([route[0], i, offset])
+        offset += len(route) - 1
+    return positions
+
+
+def ring_entries(node, ring):
+    """
+    Computes what each node needs to know about the ring : its index and
+    offset on the ring (in hops from the leader, so that messages can be
+    sent in the direction reaching their receiver in fewer hops), the
+    routes to its ring neighbors, its fingers, the next hops of the ring
+    routes going through it, and the positions of the nodes it is the home
+    of (see PikaNode.ring_home).
+    Returns:
+        dict, {u: [u, index, offset, route right, route left, fingers,
+                   forwarding, homed positions]}
+    """
+    order = [route[0] for route in ring]
+    offsets = [offset for _, _, offset in ring_positions(ring)]
+
+    forwarding = {u: [] for u in order}
+    for route in ring:
+        for i in range(1, len(route) - 1):
+            forwarding[route[i]] += [
+                [route[0], route[-1], route[i+1]],
+                [route[-1], route[0], route[i-1]]
+            ]
+
+    homed = [[] for _ in order]
+    for i, u in enumerate(order):
+        homed[u % len(order)].append([u, i, offsets[i]])
+
+    tree = bfs_tree(node)
+    entries = dict()
+    for i, u in enumerate(order):
+        right = ring[i][1:]
+        left = ring[i-1][::-1][1:]
+        fingers = finger_table(ring, offsets, i, tree)
+        entries[u] = [u, i, offsets[i], right, left, fingers, forwarding[u],
+                      homed[i]]
+    return entries
+
+
+def bfs_tree(node):
+    """
+    Returns the leader's BFS tree, as ({v: parent of v}, {v: depth of v})
+    """
+    parents = node.router.routes_from(node.my_id)
+    depth = dict()
+    for v in parents:                    # parents come before their children
+        depth[v] = 0 if parents[v] is None else depth[parents[v]] + 1
+    return parents, depth
+
+
+def tree_path(tree, u, v):
+    """
+    Returns the path from u to v in the leader's BFS tree, without u : up to
+    their lowest common ancestor, then down to v. It is at most twice as
+    long as the tree is deep
+    """
+    parents, depth = tree
+    up, down = [u], [v]
+    while depth[up[-1]] > depth[down[-1]]:
+        up.append(parents[up[-1]])
+    while depth[down[-1]] > depth[up[-1]]:
+        down.append(parents[down[-1]])
+    while up[-1] != down[-1]:
+        up.append(parents[up[-1]])
+        down.append(parents[down[-1]])
+    return up[1:] + down[-2::-1]
+
+
+def ring_path(ring, i, j):
+    """
+    Returns the path from the i-th to the j-th node of the ring along the
+    ring routes, without the i-th node, cut where it goes through a node
+    more than once
+    """
+    path = [ring[i][0]]
+    while i != j:
+        path += ring[i][1:]
+        i = (i + 1) % len(ring)
+    last = {v: k for k, v in enumerate(path)}
+    simple = []
+    k = 0
+    while k < len(path):
+        simple.append(path[k])
+        k = last[path[k]] + 1
+    return simple[1:]
+
+
+def finger_table(ring, offsets, i, tree):
+    """
+    Returns the fingers of the i-th node of the ring, Chord-like shortcuts on
+    the virtual ring : for each power of two 2^k smaller than the number of
+    nodes, the node 2^k places further on the right, its offset, and a
+    route to it. Messages can then be forwarded greedily in O(log n)
+    fingers instead of going around the ring.
+    Fingers are [distance on the ring, node, offset, route without the node
+    itself]. The route follows the ring routes when they are shorter than
+    the path through the leader's BFS tree (which is at most twice as long
+    as the tree is deep), so a finger costs O(depth) to compute
+    """
+    n = len(ring)
+    length = offsets[-1] + len(ring[-1]) - 1
+    u = ring[i][0]
+    fingers = []
+    distance = 1
+    while distance < n:
+        j = (i + distance) % n
+        target = ring[j][0]
+        if j == (i - 1) % n:
+            route = ring[j][::-1][1:]
+        else:
+            route = tree_path(tree, u, target)
+            if (offsets[j] - offsets[i]) % length <= len(route):
+                route = ring_path(ring, i, j)
+        fingers.append([distance, target, offsets[j], route])
+        distance *= 2
+    return fingers
+
+
+def set_ring_entry(node, nb_nodes, length, positions, entry):
+    """
+    Stores the ring informations of node.
+    node.ring_position gives the [index, offset] of the ring nodes known by
+    node : itself, its ring neighbors, its fingers, the nodes it is the
+    home of, and later the senders of the messages it receives. Without
+    fingers, positions lists all the ring nodes, which node then all knows.
+    node.next_hop, {(route start, route end): next node}, gives the next
+    hops of the ring routes going through node, in both directions : packets
+    then only carry the ends of the route they follow.
+    node.installed_routes holds the ends of the node's routes known by their
+    relays : the ring routes for now, finger routes once installed
+    """
+    _, index, offset, node.route_right, node.route_left, fingers, \
+        forwarding, homed = entry
+    node.ring_index = index
+    node.ring_size = nb_nodes
+    node.ring_length = length
+    node.fingers = [[distance, route] for distance, _, _, route in fingers]
+    node.ring_position = {u: [i, o] for u, i, o in positions or homed}
+    node.ring_position[node.route_left[-1]] = [
+        (index - 1) % nb_nodes, (offset - len(node.route_left)) % length
+    ]
+    for distance, target, target_offset, _ in fingers:
+        node.ring_position[target] = [(index + distance) % nb_nodes,
+                                      target_offset]
+    node.ring_position[node.my_id] = [index, offset]
+    node.next_hop = {(start, end): hop for start, end, hop in forwarding}
+    node.installed_routes = {
+        (node.my_id, node.route_right[-1]),
+        (node.my_id, node.route_left[-1])
+    }
+
+
+def pass_ring_bundle(node, msg):
+    """
+    Stores node's entry, the first of the bundle, and sends the rest of the
+    bundle to the children of node in the shout tree : the bundle lists the
+    entries of node's subtree in preorder, so each child's subtree starts
+    with the child's entry and ends before the next child's one.
+    Args:
+        msg: list, [number of nodes, ring length, positions of all the
+            nodes (None with fingers), bundle]
+    """
+    nb_nodes, length, positions, bundle = msg
+    set_ring_entry(node, nb_nodes, length, positions, bundle[0])
+    children = set(node.shout_children)
+    starts = [i for i, entry in enumerate(bundle) if entry[0] in children]
+    for start, end in zip(starts, starts[1:] + [len(bundle)]):
+        node.send_msg([nb_nodes, length, positions, bundle[start:end]],
+                      bundle[start][0], BROADCAST)
+
+
+# _________________________________________________________________________
+# _______________________ DISTRIBUTED RING ________________________________
+
+def make_ring_distributed(node):
+    """
+    Builds the virtual ring without gathering the graph anywhere. The ring is
+    the DFS order of the shout spanning tree, children being visited by
+    increasing id : the position of a node on the ring is the position of
+    its parent, plus one, plus the sizes of the subtrees of its elder
+    siblings. Positions and routes are sent down the tree, from the leader.
+    Each node only learns its own position and the routes to its ring
+    neighbors, which follow tree edges. Their relays learn them when they
+    are first used (see PikaNode.send_on_route).
+    """
+    if node.role == LEADER:
+        size, last_route = subtree_summary(node)
+        set_ring_setup(node, [0, size, last_route, []])
+    else:
+        node.recv_msg(BROADCAST, node.ring_setup_callback)
+
+
+def set_ring_setup(node, setup):
+    """
+    Stores the ring informations sent by the parent, and sends theirs to
+    the children.
+    Args:
+        setup: list, [position of node on the ring, number of nodes, route
+               to the previous node on the ring, route to the node following
+               node's subtree on the ring]
+    """
+    position, nb_nodes, route_left, exit_route = setup
+    children = sorted(node.reflux)
+    node.route_right = [children[0]] if children else exit_route
+    node.route_left = route_left
+    node.ring_position = {node.my_id: position}
+    node.fingers = None
+    node.next_hop = dict()
+    node.installed_routes = set()
     node.ring_received = True
-    node.nb_broadcast_msg_recv = 0
-    for v in node.neighbors_ids:
-        node.send_msg(ring, v)
+
+    offset = position + 1
+    for i, child in enumerate(children):
+        if i == 0:
+            left = [node.my_id]
+        else:
+            elder = children[i-1]
+            left = [node.my_id, elder] + node.reflux[elder][1]
+        if i + 1 < len(children):
+            after = [node.my_id, children[i+1]]
+        else:
+            after = [node.my_id] + exit_route
+        node.send_msg([offset, nb_nodes, left, after], child, BROADCAST)
+        offset += node.reflux[child][0]
 
 
 def make_ring_dfs(node, u):
     """
-    recursively builds a ring from a graph using the spanning tree.
-    DFS approach with vertex coloring to keep it simple
+    builds a ring from a graph using the spanning tree.
+    DFS approach with vertex coloring to keep it simple. The DFS uses an
+    explicit stack of neighbors iterators, so that deep trees do not hit the
+    recursion limit
     """
     result = [u]
-    for v in node.graph[u]:                    # for all neighbors
-        if color[v] == WHITE:                  # if neighbor is white
-            color[v] = BLACK                   # paint it black
-            result += make_ring_dfs(node, v)   # and call recursively on it
+    stack = [iter(node.graph[u])]
+    while stack:
+        for v in stack[-1]:                    # for all neighbors
+            if color[v] == WHITE:              # if neighbor is white
+                color[v] = BLACK               # paint it black
+                result.append(v)               # and go on from it
+                stack.append(iter(node.graph[v]))
+                break
+        else:                                  # no more white neighbor
+            stack.pop()
     return result
 
 
 def get_path(edges, start, end):
     """
-    Returns the shortest path between two nodes using Dijkstra's algorithm
+    Returns a shortest path between two nodes, see lib.routing
     """
-    q = [(0, start, [start])]
-    hq.heapify(q)
-    while len(q) > 0:
-        d, u, path = hq.heappop(q)
-        for v in edges[u]:
-            if v == end:
-                return path + [v]
-            hq.heappush(q, (d+1, v, path + [v]))
+    return Router(edges).path(start, end)
 
 
 def draw_ring(edges, ring):
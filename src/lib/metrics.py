@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This file contains the metrics of a node :
+    + messages and bytes sent and received, by mailbox, and the number of
+      publishes (fewer than the messages sent when they are coalesced)
+    + ring messages by type, and what the node did with them
+    + latency histograms : time spent waiting for each mailbox, time spent
+      handling each type of ring message, and duration of the setup phases
+They are shown by the /stats command and, with METRICS_FILE, written every
+METRICS_PERIOD seconds as JSON, or in the Prometheus text format when the
+file name ends with '.prom'.
+"""
+
+import os
+import json
+import time
+import bisect
+from collections import defaultdict
+
+from lib.config import METRICS_FILE, METRICS_PERIOD
+from lib.constants import YO_PHASE, OY_PHASE
+
+# upper bounds of the histograms' buckets, in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+
+class Histogram:
+    def __init__(self):
+        # one count per bucket, and the observations above all buckets
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket holding the q-quantile, None
+        if nothing was observed
+        """
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound
+
+    def cumulative(self):
+        """
+        Returns the [upper bound, number of observations below it] pairs,
+        the last bound being '+Inf'
+        """
+        bounds = [repr(b) for b in BUCKETS] + ["+Inf"]
+        seen = 0
+        result = []
+        for bound, count in zip(bounds, self.counts):
+            seen += count
+            result.append([bound, seen])
+        return result
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.sum,
+                "buckets": self.cumulative()}
+
+
+class Metrics:
+    def __init__(self):
+        self.sent = defaultdict(int)
+        self.sent_bytes = defaultdict(int)
+        self.publishes = 0
+        # bytes are counted by body, under the BATCH mailbox for batches
+        self.received = defaultdict(int)
+        self.received_bytes = defaultdict(int)
+        # (message type, action) -> number of ring messages
+        self.ring = defaultdict(int)
+        self.wait = defaultdict(Histogram)
+        self.handling = defaultdict(Histogram)
+        self.phases = dict()
+        self.last_snapshot = time.monotonic()
+
+    def count_sent(self, mailbox, nb_bytes):
+        self.sent[mailbox] += 1
+        self.sent_bytes[mailbox] += nb_bytes
+
+    def count_body(self, mailbox, nb_bytes):
+        self.received_bytes[mailbox] += nb_bytes
+
+    def count_received(self, mailbox):
+        self.received[mailbox] += 1
+
+    def yo_yo_messages(self):
+        return self.sent.get(YO_PHASE, 0) + self.sent.get(OY_PHASE, 0)
+
+# _________________________________________________________________________
+# _______________________ EXPORT __________________________________________
+
+    def to_dict(self, node_id):
+        return {
+            "node": node_id,
+            "time": time.time(),
+            "sent": dict(self.sent),
+            "sent_bytes": dict(self.sent_bytes),
+            "publishes": self.publishes,
+            "received": dict(self.received),
+            "received_bytes": dict(self.received_bytes),
+            "ring": [[t, action, count]
+                     for (t, action), count in self.ring.items()],
+            "wait_seconds": {k: h.to_dict() for k, h in self.wait.items()},
+            "ring_handling_seconds": {
+                k: h.to_dict() for k, h in self.handling.items()
+            },
+            "phase_seconds": self.phases
+        }
+
+    def to_prometheus(self, node_id):
+        """
+        Returns the metrics in the Prometheus text format
+        """
+        lines = []
+
+        def metric(name, kind, values):
+            lines.append("# TYPE pika_%s %s" % (name, kind))
+            for labels, value in values:
+                labels = [("node", node_id)] + labels
+                lines.append("pika_%s{%s} %s" % (name, ",".join(
+                    '%s="%s"' % (k, v) for k, v in labels
+                ), value))
+
+        def histograms(name, label, hists):
+            lines.append("# TYPE pika_%s histogram" % name)
+            for key, h in hists.items():
+                labels = 'node="%s",%s="%s"' % (node_id, label, key)
+                for bound, seen in h.cumulative():
+                    lines.append('pika_%s_bucket{%s,le="%s"} %s'
+                                 % (name, labels, bound, seen))
+                lines.append("pika_%s_sum{%s} %s" % (name, labels, h.sum))
+                lines.append("pika_%s_count{%s} %s"
+                             % (name, labels, h.count))
+
+        for name, counts in (("messages_sent_total", self.sent),
+                             ("bytes_sent_total", self.sent_bytes),
+                             ("messages_received_total", self.received),
+                             ("bytes_received_total", self.received_bytes)):
+            metric(name, "counter",
+                   [([("mailbox", k)], v) for k, v in counts.items()])
+        metric("publishes_total", "counter", [([], self.publishes)])
+        metric("ring_messages_total", "counter",
+               [([("type", t), ("action", action)], count)
+                for (t, action), count in self.ring.items()])
+        histograms("wait_seconds", "mailbox", self.wait)
+        histograms("ring_handling_seconds", "type", self.handling)
+        metric("phase_seconds", "gauge",
+               [([("phase", k)], v) for k, v in self.phases.items()])
+        return "\n".join(lines) + "\n"
+
+    def format_stats(self):
+        """
+        Returns the metrics as a text for the /stats command
+        """
+        lines = ["%-18s %10s %12s %10s %12s"
+                 % ("mailbox", "sent", "bytes", "received", "bytes")]
+        for mailbox in sorted(set(self.sent) | set(self.received) |
+                              set(self.received_bytes)):
+            lines.append("%-18s %10d %12d %10d %12d" % (
+                mailbox, self.sent.get(mailbox, 0),
+                self.sent_bytes.get(mailbox, 0),
+                self.received.get(mailbox, 0),
+                self.received_bytes.get(mailbox, 0)
+            ))
+        lines.append("publishes : %d, yo-yo messages sent : %d"
+                     % (self.publishes, self.yo_yo_messages()))
+        for (t, action), count in sorted(self.ring.items()):
+            lines.append("ring %s %s : %d" % (t, action, count))
+        for title, hists in (("wait", self.wait),
+                             ("handling", self.handling)):
+            for key, h in sorted(hists.items()):
+                lines.append("%s %s : %d, mean %.2gs, p50 <= %ss, "
+                             "p99 <= %ss" % (title, key, h.count,
+                                             h.sum / h.count,
+                                             h.quantile(0.5),
+                                             h.quantile(0.99)))
+        for phase, seconds in self.phases.items():
+            lines.append("phase %s : %.3fs" % (phase, seconds))
+        return "\n".join(lines)
+
+    def write(self, node_id, path=METRICS_FILE):
+        """
+        Writes a snapshot of the metrics to path ('%s' being replaced by
+        node_id), through a temporary file so that readers never see a
+        partial snapshot
+        """
+        if "%s" in path:
+            path = path % node_id
+        if path.endswith(".prom"):
+            data = self.to_prometheus(node_id)
+        else:
+            data = json.dumps(self.to_dict(node_id))
+        with open(path + ".tmp", 'w') as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        self.last_snapshot = time.monotonic()
+
+    def snapshot(self, node_id, period=METRICS_PERIOD):
+        """
+        Writes a snapshot if METRICS_FILE is set and the last one is older
+        than period seconds
+        """
+        if METRICS_FILE and time.monotonic() - self.last_snapshot >= period:
+            self.write(node_id)
@@ -1,20 +1,38 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import pika
-import json
 import sys
 import select
 import time
 import base64
+import asyncio
+import traceback
+from collections import defaultdict, deque
 
 from lib.config import *
 from lib.constants import *
 
 from lib.yo_yo import yo_yo
-from lib.shout import shout
-from lib.make_ring import make_ring
+from lib.shout import shout, merge_reflux, reflux_packet
+from lib.make_ring import make_ring, pass_ring_bundle, make_ring_distributed
+from lib.make_ring import set_ring_setup
 from lib.utils import console_print
+from lib.transport import make_transport, TransportError
+from lib.codec import make_codec
+from lib.metrics import Metrics
+from lib.tracing import Tracer
+
+# with a smaller window, a sender would wait forever for an acknowledgement
+# that its receiver only sends after FILE_ACK_EVERY chunks
+assert FILE_WINDOW >= FILE_ACK_EVERY, "FILE_WINDOW < FILE_ACK_EVERY"
+
+
+class NodeStopped(Exception):
+    """
+    Raised when a node is stopped while it waits for a message of its setup
+    """
+    pass
+
 
 # _________________________________________________________________________
 # _______________________ PIKA NODE CLASS _________________________________
@@ -22,35 +40,72 @@ from lib.utils import console_print
 
 
 class PikaNode:
-    def __init__(self, my_id):
+    def __init__(self, my_id, transport=None, interactive=True,
+                 verbose=None):
         """
         Class constructor.
         Args:
             my_id: int, the identifier of the node
+            transport: Transport, the transport used to talk to other nodes.
+                       A new transport of the configured kind if None
+            interactive: bool, False for nodes run headless (simulations),
+                         which do not read commands from stdin
+            verbose: bool, whether the node logs its progress.
+                     Same as interactive if None
         """
         self.my_id = my_id
+        self.transport = transport if transport is not None \
+            else make_transport()
+        self.interactive = interactive
+        self.verbose = interactive if verbose is None else verbose
+        self.codec = make_codec()
         self.out_queue = {MAIN_LAUNCHER: MAIN_Q}
         self.in_queue = QUEUE_PREFIX + str(self.my_id) + "__main_q"
+        self.to_close_on_exit = None
+        # files being sent, and files being received, chunk by chunk
+        self.outgoing_files = []
+        self.incoming_files = dict()
+        # messages received from other nodes, not handled yet
+        self.mailboxes = defaultdict(deque)
+        # with COALESCE, bodies waiting to be published, by (queue,
+        # priority), their total size, and when the oldest one was sent
+        self.outbox = dict()
+        self.outbox_size = dict()
+        self.outbox_since = None
+        self.metrics = Metrics()
+        self.tracer = Tracer()
+        self.in_main_loop = True
+
+    def log(self, sstr):
+        """
+        Prints sstr, if the node is verbose
+        """
+        if self.verbose:
+            print(sstr)
 
 # _________________________________________________________________________
 # _______________________ INIT CONNECTION _________________________________
 
     def init_connection(self):
         """
-        Initializes the connection with Rabbitmq
+        Initializes the connection with the broker
         """
-        self.connection = pika.BlockingConnection(
-            PIKA_CONNECTION_PARAMETERS
-        )
-        self.channel = self.connection.channel()
-        print("Connection initialized")
+        self.transport.open()
+        self.log("Connection initialized")
 
 # _________________________________________________________________________
 # _______________________ LAUNCH NODE _____________________________________
 
     def launch(self):
         """
-        Main method. Sets up the network, launches yoyo algorithm, etc ....
+        Main method. Sets up the network, then enters the main loop
+        """
+        self.setup_network()
+        self.main_loop()
+
+    def setup_network(self):
+        """
+        Sets up the network, launches yoyo algorithm, etc ....
         """
         # initialize connection
         self.init_connection()
@@ -62,63 +117,184 @@ class PikaNode:
         self.receive_neighbors_ids()
         self.declare_neighbors_queues()
 
+        # from now on, one consumer sorts all messages into the mailboxes
+        self.transport.subscribe(self.in_queue)
+
         # elect a leader
+        self.begin_phase("election")
         self.elect_leader()
+        self.end_phase("election")
 
         # use shout protocol so the leader can gather all the graph's info
+        self.begin_phase("shout")
         shout(self)
-
-        # leader creates a virtual ring, and sends routing infos to others
-        if self.role == LEADER:
-            self.graph = {int(k): self.graph[k] for k in self.graph}
+        self.end_phase("shout")
+
+        self.begin_phase("ring")
+        if RING_CONSTRUCTION == DISTRIBUTED:
+            # the ring follows the spanning tree built by shout
+            make_ring_distributed(self)
+        elif self.role == LEADER:
+            # leader creates a virtual ring, and sends each node its routing
+            # infos, down a spanning tree
+            self.tracer.begin("make_ring")
             make_ring(self)
+            self.tracer.end("make_ring")
         else:
-            self.ring_received = False
+            self.recv_msg(BROADCAST, self.ring_bundle_callback)
+        self.flush_outbox()
+        self.end_phase("ring")
+        if self.tracer.enabled:
+            self.tracer.write(self.my_id)
 
-        # get the virtual ring created by the leader
-        self.recv_msg(self.broadcast_callback)
-
-        # enter main loop
-        self.main_loop()
+    def begin_phase(self, phase):
+        self.phase_start = time.perf_counter()
+        self.tracer.begin(phase)
 
+    def end_phase(self, phase):
+        """
+        Records the duration of phase in the metrics, and ends its span
+        """
+        self.metrics.phases[phase] = time.perf_counter() - self.phase_start
+        self.tracer.end(phase)
 
 # _________________________________________________________________________
 # _______________________ SEND MESSAGE ____________________________________
 
-    def send_msg(self, msg, receiver_id):
+    def send_msg(self, msg, receiver_id, mailbox=None):
         """
-        Sends the message msg to 'receiver_id'.
+        Sends the message msg to 'receiver_id', in the given mailbox.
+        Messages to the main launcher have no mailbox.
         """
         queue_name = self.out_queue[receiver_id]
+        priority = LANE_PRIORITY.get(mailbox, 0)
+        if mailbox is not None:
+            msg = [mailbox, msg]
+            if self.tracer.enabled:
+                # the flow id lets the trace link sender and receiver
+                msg.append(self.tracer.flow_out(self.my_id, mailbox))
+        body = self.codec.encode(msg)
+        self.metrics.count_sent(mailbox or MAIN_LAUNCHER, len(body))
+        if COALESCE and mailbox is not None:
+            self.buffer_msg((queue_name, priority), body)
+        else:
+            self.publish(queue_name, body, priority)
+
+    def publish(self, queue_name, body, priority=0):
+        self.metrics.publishes += 1
         try:
-            self.channel.basic_publish(
-                exchange='',
-                routing_key=queue_name,
-                body=json.dumps(msg)
-            )
+            self.transport.publish(queue_name, body, priority)
         except:
             console_print("Error while attempting to send a message\n"
                           "Exiting.")
             self.exit_program()
 
+    def buffer_msg(self, key, body):
+        """
+        Adds body to the outbox key, a (queue, priority) pair. The outbox is
+        published when it is big enough, and all outboxes when the oldest
+        body waited long enough. Messages are encoded when sent, so later
+        changes to them are not seen
+        """
+        now = time.monotonic()
+        if self.outbox_since is None:
+            self.outbox_since = now
+        self.outbox.setdefault(key, []).append(body)
+        self.outbox_size[key] = self.outbox_size.get(key, 0) + len(body)
+        if now - self.outbox_since >= COALESCE_DELAY:
+            self.flush_outbox()
+        elif self.outbox_size[key] >= COALESCE_MAX_BYTES:
+            self.flush_queue(key)
+
+    def flush_queue(self, key):
+        """
+        Publishes the outbox key, a (queue, priority) pair, as a single
+        body. The outboxes of higher priority to the same queue go first,
+        so that route installations stay ahead of the packets using them
+        """
+        queue_name, priority = key
+        for higher in range(MAX_PRIORITY, priority, -1):
+            if (queue_name, higher) in self.outbox:
+                self.flush_queue((queue_name, higher))
+        bodies = self.outbox.pop(key)
+        del self.outbox_size[key]
+        if not self.outbox:
+            self.outbox_since = None
+        if len(bodies) == 1:
+            self.publish(queue_name, bodies[0], priority)
+        else:
+            self.publish(
+                queue_name, self.codec.encode_batch(bodies), priority
+            )
+
+    def flush_outbox(self):
+        """
+        Publishes all the outboxes. Called before the node waits for
+        messages, so that no neighbor waits for a buffered message
+        """
+        for key in sorted(self.outbox, key=lambda k: -k[1]):
+            if key in self.outbox:
+                self.flush_queue(key)
+
 # _________________________________________________________________________
 # _______________________ RECEIVE MESSAGE _________________________________
 
-    def recv_msg(self, callback):
+    def recv_msg(self, mailbox, callback):
         """
-        Starts consuming messages on own queue using 'callback'
+        Waits for the next message of 'mailbox', and handles it with
+        'callback'. Messages of other mailboxes arriving in the meantime
+        (from neighbors already in a later phase) are kept for later.
         """
+        box = self.mailboxes[mailbox]
+        start = time.perf_counter()
+        if not box:
+            self.flush_outbox()
         try:
-            self.channel.basic_consume(
-                callback,
-                queue=self.in_queue,
-                no_ack=False
-            )
-            self.channel.start_consuming()
+            while not box:
+                self.sort_msg(self.receive_body())
+        except NodeStopped:
+            raise
         except:
             console_print("Error while attempting to receive a message\n"
                           "Exiting.")
             self.exit_program()
+        self.metrics.wait[mailbox].observe(time.perf_counter() - start)
+        callback(box.popleft())
+
+    def receive_body(self):
+        """
+        Waits for the next message of the subscribed queue. Raises
+        NodeStopped if stop is called in the meantime
+        """
+        body = None
+        while body is None:
+            if not self.in_main_loop:
+                raise NodeStopped("Node %s stopped during its setup"
+                                  % self.my_id)
+            body = self.transport.receive(SELECT_TIMEOUT)
+        return body
+
+    def sort_msg(self, body):
+        """
+        Puts a message received from another node in its mailbox
+        """
+        frame = self.codec.decode(body)
+        self.metrics.count_body(frame[0], len(body))
+        if frame[0] == BATCH:
+            for f in frame[1]:
+                self.file_msg(f)
+        else:
+            self.file_msg(frame)
+
+    def file_msg(self, frame):
+        """
+        Files a [mailbox, msg] frame (followed by its flow id when traced)
+        """
+        mailbox, msg = frame[0], frame[1]
+        if len(frame) > 2:
+            self.tracer.flow_in(mailbox, frame[2])
+        self.mailboxes[mailbox].append(msg)
+        self.metrics.count_received(mailbox)
 # _________________________________________________________________________
 # _______________________ NETWORK INITIALIZATION __________________________
 
@@ -127,8 +303,8 @@ class PikaNode:
         Declare queues to communicate with the main launcher
         Sends my_id to the main launcher
         """
-        self.channel.queue_declare(queue=self.out_queue[MAIN_LAUNCHER])
-        self.channel.queue_declare(queue=self.in_queue)
+        self.transport.declare_queue(self.out_queue[MAIN_LAUNCHER])
+        self.transport.declare_queue(self.in_queue)
 
         # send id to main launcher
         self.send_msg(self.my_id, MAIN_LAUNCHER)
@@ -137,7 +313,9 @@ class PikaNode:
         """
         Receives ids from one's neighbors in the network.
         """
-        self.recv_msg(self.init_network_callback)
+        self.transport.subscribe(self.in_queue)
+        self.init_network_callback(self.receive_body())
+        self.transport.unsubscribe()
 
     def declare_neighbors_queues(self):
         """
@@ -145,7 +323,7 @@ class PikaNode:
         """
         for v in self.neighbors_ids:
             q_name = QUEUE_PREFIX + str(v) + "__"
-            self.channel.queue_declare(queue=q_name)
+            self.transport.declare_queue(q_name)
             self.out_queue[v] = q_name
 
 # _________________________________________________________________________
@@ -156,90 +334,323 @@ class PikaNode:
         Leader election, done with the yoyo algorithm
         """
         self.is_leader = yo_yo(self)
-        print("I am%s the leader" % ("" if self.role == LEADER else " not"))
+        self.log("I am%s the leader" % ("" if self.role == LEADER else " not"))
 
 
 # _____________________________________________________________________________
 # _______________________ MAIN LOOP ___________________________________________
 
     def main_loop(self):
-        self.in_main_loop = True
+        if MAIN_LOOP == ASYNCIO:
+            try:
+                asyncio.run(self.async_main_loop())
+            except Exception:
+                traceback.print_exc()
+                console_print("The main loop failed. Exiting.")
+            self.exit_program()
+        else:
+            self.polling_main_loop()
+
+    def polling_main_loop(self):
         while self.in_main_loop:
             try:
                 # check if user issued a command
-                if select.select([sys.stdin], [], [], 0.0)[0]:
+                if self.interactive and \
+                        select.select([sys.stdin], [], [], 0.0)[0]:
                     self.process_cmd()
                 self.get_msg_non_blocking()
+                self.send_file_chunks()
+                self.flush_outbox()
+                self.metrics.snapshot(self.my_id)
                 time.sleep(0.1)
             except:
                 self.in_main_loop = False
         self.exit_program()
 
+    def stop(self):
+        """
+        Makes the polling main loop exit at its next round, or the setup
+        raise NodeStopped within SELECT_TIMEOUT seconds if the node is still
+        waiting for a message of its setup. Can be called from another
+        thread
+        """
+        self.in_main_loop = False
+
+    async def async_main_loop(self):
+        """
+        Event driven main loop : ring messages are handled as soon as they
+        arrive, and user commands whenever stdin becomes readable
+        """
+        loop = asyncio.get_running_loop()
+        if self.interactive:
+            loop.add_reader(sys.stdin, self.process_cmd)
+        file_sender = asyncio.ensure_future(self.async_send_files())
+        flusher = asyncio.ensure_future(self.async_flush_outbox())
+        # the queue is now consumed by consume_async
+        for body in self.transport.unsubscribe():
+            self.sort_msg(body)
+        self.handle_ring_msgs()
+        self.flush_outbox()
+        try:
+            await self.transport.consume_async(
+                self.in_queue, self.async_ring_callback
+            )
+        finally:
+            file_sender.cancel()
+            flusher.cancel()
+            if self.interactive:
+                loop.remove_reader(sys.stdin)
+
+    async def async_send_files(self):
+        """
+        Sends outgoing files chunk by chunk, giving the hand back to the
+        event loop between two rounds of chunks. Files waiting for their
+        acknowledgements are sent by file_acked
+        """
+        while True:
+            nb_sent = self.send_file_chunks()
+            await asyncio.sleep(0 if nb_sent else SELECT_TIMEOUT)
+
+    async def async_flush_outbox(self):
+        """
+        Publishes the outboxes every COALESCE_DELAY seconds
+        """
+        while True:
+            await asyncio.sleep(COALESCE_DELAY if COALESCE else SELECT_TIMEOUT)
+            self.flush_outbox()
+            self.metrics.snapshot(self.my_id)
+
     def process_cmd(self):
-        cmd = raw_input()
+        cmd = input()
         if not cmd:
             pass
         elif cmd == QUIT:
             self.exit_program()
         elif cmd.split()[0] == SEND_MSG:
             self.ring_send_msg(cmd)
+        elif cmd == LIST_NODES and self.fingers is None:
+            print("Nodes of a distributed ring are not listed. "
+                  "Ring neighbors : %s, %s"
+                  % (self.route_left[-1], self.route_right[-1]))
         elif cmd == LIST_NODES:
             print(
-                "Available nodes : {0}".format(
-                    ', '.join({str(e) for e in self.all_nodes})
+                "Known nodes : {0}".format(
+                    ', '.join({str(e) for e in self.ring_position
+                               if e != self.my_id})
                 )
             )
         elif cmd.split()[0] == ASK_FILE:
             self.ring_ask_file(cmd)
         elif cmd == HELP:
             self.display_help()
+        elif cmd == STATS:
+            console_print(self.metrics.format_stats())
 
     def display_help(self):
         console_print("Commmands :\n'%s' -> lists network's nodes\n"
                       "'%s recv_id msg' -> sends a message\n"
                       "'%s' -> display help\n"
-                      "'%s recv_id filename' -> request a file"
-                      % (LIST_NODES, SEND_MSG, HELP, ASK_FILE))
+                      "'%s recv_id filename' -> request a file\n"
+                      "'%s' -> display the node's metrics"
+                      % (LIST_NODES, SEND_MSG, HELP, ASK_FILE, STATS))
 
     def get_msg_non_blocking(self):
         try:
-            m_frame, header_frame, body = self.channel.basic_get(self.in_queue)
-            if m_frame:
-                self.channel.basic_ack(m_frame.delivery_tag)
-                msg = json.loads(body)
-                if msg[ROUTE]:
-                    self.route_msg(msg)
-                elif int(msg[RECEIVER]) == self.my_id:
-                    self.open_msg(msg)
-                else:
-                    if msg[DIRECTION] == LEFT:
-                        msg[ROUTE] = self.route_left[1:]
-                    else:
-                        msg[ROUTE] = self.route_right[1:]
-                        self.send_msg(msg, self.route_right[0])
-            # else -> no message on the queue
-        except pika.exceptions.ChannelClosed:
+            body = self.transport.receive(0)
+            while body is not None:
+                self.sort_msg(body)
+                body = self.transport.receive(0)
+        except TransportError:
             self.exit_program()
+        self.handle_ring_msgs()
+
+    def async_ring_callback(self, body):
+        self.sort_msg(body)
+        self.handle_ring_msgs()
+
+    def handle_ring_msgs(self):
+        """
+        Handles the messages waiting in the ring lanes : route installations
+        first, then in turn up to INTERACTIVE_WEIGHT chat messages and file
+        requests, and up to BULK_WEIGHT file chunks, so that chat messages
+        are forwarded ahead of the file transfers received with them.
+        The installation of a route is received before the packets using
+        it, so it is always handled before them
+        """
+        control = self.mailboxes[RING]
+        lanes = [(self.mailboxes[RING_INTERACTIVE], INTERACTIVE_WEIGHT),
+                 (self.mailboxes[RING_BULK], BULK_WEIGHT)]
+        while control or any(box for box, _ in lanes):
+            while control:
+                self.ring_callback(control.popleft())
+            for box, weight in lanes:
+                for _ in range(min(weight, len(box))):
+                    self.ring_callback(box.popleft())
+
+    def ring_callback(self, msg):
+        """
+        Handles a message received on the ring : opens it if it is for me,
+        forwards it otherwise
+        """
+        start = time.perf_counter()
+        if msg[TYPE] == RING_ROUTE:
+            self.install_route(msg)
+            action = "install"
+        elif int(msg[RECEIVER]) == self.my_id:
+            if self.fingers is not None:    # the sender can be answered
+                self.ring_position[msg[SENDER]] = msg[ORIGIN]
+            self.open_msg(msg)
+            action = "open"
+        elif msg[SEGMENT][1] != self.my_id:
+            self.route_msg(msg)
+            action = "relay"
+        elif msg[SENDER] == self.my_id and \
+                (msg[DIRECTION] != FINGER or msg[TARGET] == self.ring_index):
+            # went around the ring, or sent back by the receiver's home :
+            # the receiver does not exist
+            console_print("No node %s on the ring" % msg[RECEIVER])
+            if msg[TYPE] == RING_FILE:
+                self.abort_file(int(msg[RECEIVER]), msg[FILENAME])
+            action = "bounce"
+        else:
+            if msg[DIRECTION] == FINGER and msg[TARGET] == self.ring_index:
+                self.resolve_target(msg)
+            self.send_on_route(msg, self.next_route(msg))
+            action = "forward"
+        self.metrics.ring[(msg[TYPE], action)] += 1
+        self.metrics.handling[msg[TYPE]].observe(time.perf_counter() - start)
 
 # _____________________________________________________________________________
 # _______________________ RING METHODS ________________________________________
 
-    def send_on_ring(self, msg_type, msg_body, recv_id, filename=None, direction=RIGHT):
-        route = self.route_right if direction == RIGHT else self.route_left
+    def default_direction(self, recv_id):
+        """
+        Returns the direction of the messages to recv_id : through the
+        fingers if enabled, else the way reaching recv_id in fewer hops if
+        its position is known, else to the right.
+        Nodes of a distributed ring only know their ring neighbors, and
+        send to the right
+        """
+        if self.fingers is None:
+            return RIGHT
+        if USE_FINGERS:
+            return FINGER
+        if recv_id in self.ring_position:
+            return self.ring_direction(recv_id)
+        return RIGHT
+
+    def valid_receiver(self, recv_id):
+        """
+        Tells whether recv_id may be on the ring. With fingers, nodes only
+        know the positions of a few others : messages to unknown ids come
+        back to their sender, unless the node is the home of recv_id.
+        Without fingers, nodes know the positions of all the others
+        """
+        if self.fingers is None or recv_id in self.ring_position:
+            return True
+        return USE_FINGERS and self.ring_home(recv_id) != self.ring_index
+
+    def ring_home(self, recv_id):
+        """
+        Returns the index of the home of recv_id on the ring : the node
+        which knows the position of recv_id, if it is on the ring. Homes are
+        spread evenly, ids being random
+        """
+        return recv_id % self.ring_size
+
+    def ring_target(self, recv_id):
+        """
+        Returns the index on the ring that messages to recv_id head for :
+        the position of recv_id if known, else its home's one
+        """
+        position = self.ring_position.get(recv_id)
+        return position[0] if position else self.ring_home(recv_id)
+
+    def resolve_target(self, msg):
+        """
+        Called on the home of the receiver of msg : sends msg on to the
+        receiver, or back to its sender if the receiver is not on the ring
+        """
+        position = self.ring_position.get(int(msg[RECEIVER]))
+        msg[TARGET] = position[0] if position else msg[ORIGIN][0]
+
+    def ring_direction(self, recv_id):
+        """
+        Returns the direction (RIGHT or LEFT) reaching recv_id in fewer hops
+        """
+        right = (self.ring_position[recv_id][1] -
+                 self.ring_position[self.my_id][1]) % self.ring_length
+        return RIGHT if right <= self.ring_length - right else LEFT
+
+    def finger_route(self, target):
+        """
+        Returns the route to the farthest finger not going past the index
+        target on the ring
+        """
+        d = (target - self.ring_index) % self.ring_size
+        route = self.fingers[0][1]
+        for distance, finger_route in self.fingers:
+            if distance > d:
+                break
+            route = finger_route
+        return route
+
+    def next_route(self, msg):
+        """
+        Returns the route to the next ring node on the way of msg
+        """
+        if msg[DIRECTION] == FINGER:
+            return self.finger_route(msg[TARGET])
+        return self.route_left if msg[DIRECTION] == LEFT else self.route_right
+
+    def send_on_ring(self, msg_type, msg_body, recv_id, filename=None,
+                     direction=None, seq=None, last=True, target=None):
+        """
+        Sends a packet to recv_id on the ring. With fingers, the packet
+        heads for the index target, by default ring_target(recv_id), and
+        carries the position of the node so that the receiver can answer
+        """
+        if not self.valid_receiver(int(recv_id)):
+            console_print("No node %s on the ring" % recv_id)
+            return
+        if direction is None:
+            direction = self.default_direction(int(recv_id))
+        if direction == FINGER and target is None:
+            target = self.ring_target(int(recv_id))
         packet = {
             TYPE: msg_type,
             BODY: msg_body,
             RECEIVER: recv_id,
             DIRECTION: direction,
-            ROUTE: route[1:],
+            TARGET: target,
             SENDER: self.my_id,
-            FILENAME: filename
+            ORIGIN: self.ring_position[self.my_id],
+            FILENAME: filename,
+            SEQ: seq,
+            LAST: last
         }
-        self.send_msg(packet, route[0])
+        self.metrics.ring[(msg_type, "send")] += 1
+        self.send_on_route(packet, self.next_route(packet))
+
+    def send_on_route(self, msg, route):
+        """
+        Sends msg along route (which does not include the node itself).
+        The packet only carries the ends of the route : relays find the next
+        hop in their forwarding table. Finger routes are installed on their
+        relays by a RING_ROUTE packet the first time they are used ; it
+        travels ahead of the packets following it on the same queues.
+        """
+        segment = [self.my_id, route[-1]]
+        if len(route) > 1 and tuple(segment) not in self.installed_routes:
+            self.send_msg({TYPE: RING_ROUTE, SEGMENT: segment,
+                           ROUTE: route[1:]}, route[0], RING)
+            self.installed_routes.add(tuple(segment))
+        msg[SEGMENT] = segment
+        self.send_msg(msg, route[0], LANE_OF[msg[TYPE]])
 
     def ring_send_msg(self, cmd):
         cmd_spl = cmd.split()
-        if len(cmd_spl) < 3 or int(cmd_spl[1]) not in self.all_nodes:
+        if len(cmd_spl) < 3 or not self.valid_receiver(int(cmd_spl[1])):
             console_print("Send a message syntax : '%s recv_id msg'\n"
                           "For instance, '%s 471 hello mister 471"
                           % (SEND_MSG, SEND_MSG))
@@ -252,7 +663,7 @@ class PikaNode:
 
     def ring_ask_file(self, cmd):
         cmd_spl = cmd.split()
-        if len(cmd_spl) < 3 or int(cmd_spl[1]) not in self.all_nodes:
+        if len(cmd_spl) < 3 or not self.valid_receiver(int(cmd_spl[1])):
             console_print("ask a file syntax : '%s recv_id filename'\n"
                           "For instance, '%s 471 new_file.txt'"
                           % (ASK_FILE, ASK_FILE))
@@ -264,10 +675,23 @@ class PikaNode:
             )
 
     def route_msg(self, msg):
-        assert(msg[ROUTE] != [])
-        recv_id = int(msg[ROUTE][0])
-        msg[ROUTE] = msg[ROUTE][1:]
-        self.send_msg(msg, recv_id)
+        """
+        Relays msg to the next hop of the route it follows
+        """
+        self.send_msg(
+            msg, self.next_hop[tuple(msg[SEGMENT])], LANE_OF[msg[TYPE]]
+        )
+
+    def install_route(self, msg):
+        """
+        Stores the next hop of a finger route, and passes the installation
+        on to the next relay
+        """
+        route = msg[ROUTE]
+        self.next_hop[tuple(msg[SEGMENT])] = route[0]
+        if len(route) > 1:
+            msg[ROUTE] = route[1:]
+            self.send_msg(msg, route[0], RING)
 
     def open_msg(self, msg):
         if msg[TYPE] == RING_MSG:
@@ -278,87 +702,179 @@ class PikaNode:
             if msg[FILENAME] == NO_SUCH_FILE:
                 console_print("Invalid filename")
             else:
-                f = open(msg[FILENAME], 'wb')
-                f.write(base64.b64decode(msg[BODY]))
-                f.close()
-                console_print("%s copy successful" % msg[FILENAME])
+                self.write_file_chunk(msg)
         elif msg[TYPE] == RING_ASK_FILE:
             self.ring_send_file(msg[BODY], msg[SENDER])
+        elif msg[TYPE] == RING_FILE_ACK:
+            self.file_acked(msg)
 
-    def ring_send_file(self, filename, recv_id, direction=RIGHT):
+    def write_file_chunk(self, msg):
+        """
+        Appends a chunk received on the ring to the file it belongs to.
+        Chunks follow the same route, so they arrive in order : a sequence
+        number gap means the transfer failed, and the sender is told with an
+        acknowledgement without body. Every FILE_ACK_EVERY chunks, the
+        sender is told how many chunks arrived, so that it can send more
+        """
+        key = (msg[SENDER], msg[FILENAME])
+        if msg[SEQ] == 0:
+            self.incoming_files[key] = {
+                FILE: open(msg[FILENAME], 'wb'),
+                SEQ: 0
+            }
+        transfer = self.incoming_files.get(key)
+        if transfer is None or transfer[SEQ] != msg[SEQ]:
+            console_print("%s copy failed : chunk %s missing"
+                          % (msg[FILENAME], msg[SEQ]))
+            if transfer is not None:
+                transfer[FILE].close()
+                del self.incoming_files[key]
+            self.send_on_ring(RING_FILE_ACK, None, msg[SENDER],
+                              msg[FILENAME])
+            return
+        transfer[FILE].write(base64.b64decode(msg[BODY]))
+        transfer[SEQ] += 1
+        if msg[LAST]:
+            transfer[FILE].close()
+            del self.incoming_files[key]
+            console_print("%s copy successful" % msg[FILENAME])
+        elif transfer[SEQ] % FILE_ACK_EVERY == 0:
+            self.send_on_ring(RING_FILE_ACK, transfer[SEQ], msg[SENDER],
+                              msg[FILENAME])
+
+    def file_acked(self, msg):
+        """
+        Opens the window of the file transfer acknowledged by msg, and sends
+        the chunks it allows right away. An acknowledgement without body
+        means the receiver lost a chunk : the transfer is aborted
+        """
+        if msg[BODY] is None:
+            self.abort_file(msg[SENDER], msg[FILENAME])
+            return
+        for transfer in self.outgoing_files:
+            if int(transfer[RECEIVER]) == msg[SENDER] and \
+                    transfer[FILENAME] == msg[FILENAME]:
+                transfer[ACKED] = max(transfer[ACKED], msg[BODY])
+        self.send_file_chunks()
+
+    def abort_file(self, recv_id, filename):
+        """
+        Stops sending filename to recv_id. Notices about transfers already
+        finished or aborted are ignored
+        """
+        for transfer in self.outgoing_files:
+            if int(transfer[RECEIVER]) == recv_id and \
+                    transfer[FILENAME] == filename:
+                transfer[FILE].close()
+                self.outgoing_files.remove(transfer)
+                console_print("%s copy to %s failed" % (filename, recv_id))
+                return
+
+    def ring_send_file(self, filename, recv_id, direction=None):
+        """
+        Queues a file to be sent on the ring. Its chunks are then sent by
+        send_file_chunks, so that only one chunk is in memory at a time and
+        the ring is still served during the transfer
+        """
         try:
             f = open(filename, 'rb')
         except IOError:
-            filename = NO_SUCH_FILE
-        route = self.route_right if direction == RIGHT else self.route_left
-        packet = {
-                TYPE: RING_FILE,
-                DIRECTION: direction,
-                ROUTE: route[1:],
-                RECEIVER: recv_id,
-                SENDER: self.my_id,
-                BODY: base64.b64encode(f.read())
-                if filename != NO_SUCH_FILE else None,
-                FILENAME: filename
-        }
-        self.send_msg(packet, route[0])
+            self.send_on_ring(
+                RING_FILE, None, recv_id, NO_SUCH_FILE, direction
+            )
+            return
+        # all chunks must follow the same route
+        if direction is None:
+            direction = self.default_direction(int(recv_id))
+        target = None
+        if direction == FINGER:
+            target = self.ring_target(int(recv_id))
+        self.outgoing_files += [{
+            FILE: f,
+            FILENAME: filename,
+            RECEIVER: recv_id,
+            DIRECTION: direction,
+            TARGET: target,
+            SEQ: 0,
+            ACKED: 0
+        }]
+
+    def send_file_chunks(self, nb_chunks=FILE_CHUNKS_PER_ROUND):
+        """
+        Sends the next nb_chunks chunks of each outgoing file, without
+        having more than FILE_WINDOW chunks of a file not acknowledged.
+        Returns:
+            int, the number of chunks sent
+        """
+        nb_sent = 0
+        for transfer in list(self.outgoing_files):
+            for _ in range(nb_chunks):
+                if transfer[SEQ] - transfer[ACKED] >= FILE_WINDOW:
+                    break
+                chunk = transfer[FILE].read(FILE_CHUNK_SIZE)
+                last = len(chunk) < FILE_CHUNK_SIZE
+                self.send_on_ring(
+                    RING_FILE,
+                    base64.b64encode(chunk).decode(),
+                    transfer[RECEIVER],
+                    transfer[FILENAME],
+                    transfer[DIRECTION],
+                    seq=transfer[SEQ],
+                    last=last,
+                    target=transfer[TARGET]
+                )
+                transfer[SEQ] += 1
+                nb_sent += 1
+                if last:
+                    transfer[FILE].close()
+                    self.outgoing_files.remove(transfer)
+                    break
+        return nb_sent
 
 # _____________________________________________________________________________
 # _______________________ CALLBACKS ___________________________________________
 
-    def init_network_callback(self, ch, method, properties, body):
+    def init_network_callback(self, body):
         """
         Callback for consuming main launcher answer.
         Stores neighbors' ids, and eventually modifies my_id
         """
-        self.channel.basic_ack(method.delivery_tag)
-        msg = json.loads(body)
+        msg = self.codec.decode(body)
         self.my_id = msg[ID]
-        print("ID : %s" % self.my_id)
+        self.log("ID : %s" % self.my_id)
         self.to_close_on_exit = self.in_queue
         self.in_queue = QUEUE_PREFIX + str(self.my_id) + "__"
-        self.channel.queue_declare(self.in_queue)
+        self.transport.declare_queue(self.in_queue)
         self.neighbors_ids = msg[NEIGHBORS]
-        print("NEIGHBORS : %s" % self.neighbors_ids)
-        self.channel.stop_consuming()
+        self.log("NEIGHBORS : %s" % self.neighbors_ids)
 
-    def yoyo_recv_id_callback(self, ch, method_frame, properties, body):
+    def yoyo_recv_id_callback(self, msg):
         """
         yo_yo specific callback. Stores the candidate's id received in a dict.
         """
-        # ack
-        self.channel.basic_ack(method_frame.delivery_tag)
-        # process answer and stop consuming
-        sender, packet = json.loads(body)
+        sender, packet = msg
         self.id_received[sender] = packet
-        self.channel.stop_consuming()
 
-    def oy_oy_callback(self, ch, method_frame, properties, body):
+    def oy_oy_callback(self, msg):
         """
         yo_yo specific callback. Stores the yes/no answer received, and
         processesthe pruning/not pruning request
         """
-        # ack
-        self.channel.basic_ack(method_frame.delivery_tag)
-        # process answer and stop consuming
-        sender, packet, prune_or_not = json.loads(body)
+        sender, packet, prune_or_not = msg
         if packet == NO:
-            self.edges_to_flip += [sender]
+            self.edges_to_flip.add(sender)
         self.yes_no_received[sender] = packet
         if prune_or_not == PRUNE_OUR_LINK:
             self.edges[sender] = PRUNED
-        self.channel.stop_consuming()
 
-    def shout_callback(self, ch, method_frame, properties, body):
+    def shout_callback(self, msg):
         """
         shout protocol specific callback. Depending on th type of message
         (ANSWER, FLUW OR REFLUX), adapts its behavior.
         shout protocol allows to send all graph informations to the leader
         """
-        # ack
-        self.channel.basic_ack(method_frame.delivery_tag)
         # process message
-        p_type, sender, packet = json.loads(body)
+        p_type, sender, packet = msg
 
         # answer : if yes, wait for reflux ; if no, wait for nothing more
         if p_type == ANSWER:
@@ -368,62 +884,64 @@ class PikaNode:
         # flux
         elif p_type == FLUX: # TODO -> case where only one neighbor or case where all say no # noqa
             if self.shout_answer == YES:  # if first FLUX recv
+                self.tracer.instant("flux", parent=sender)
                 self.where_to_reflux = sender
                 self.shout_answer = NO
                 for v in self.neighbors_ids:
                     if v != sender:
                         self.wait_answer_from += [v]
-                        self.send_msg([FLUX, self.my_id, None], v)
+                        self.send_msg([FLUX, self.my_id, None], v, SHOUT)
                     else:
-                        self.send_msg([ANSWER, self.my_id, YES], v)
+                        self.send_msg([ANSWER, self.my_id, YES], v, SHOUT)
             else:  # not first FLUX recv
-                self.send_msg([ANSWER, self.my_id, NO], sender)
+                self.send_msg([ANSWER, self.my_id, NO], sender, SHOUT)
 
         # reflux
         elif p_type == REFLUX:
-            for k in packet:
-                self.reflux[int(k)] = packet[k]
+            merge_reflux(self, sender, packet)
+            self.shout_children.append(sender)
             self.wait_answer_from.remove(sender)
 
         if not self.wait_answer_from:
             if self.role != LEADER:
+                self.tracer.instant("reflux", parent=self.where_to_reflux)
                 self.send_msg(
-                    [REFLUX, self.my_id, self.reflux], self.where_to_reflux
+                    [REFLUX, self.my_id, reflux_packet(self)],
+                    self.where_to_reflux,
+                    SHOUT
                 )
-            self.channel.stop_consuming()
+            self.shout_done = True
 
-    def broadcast_callback(self, ch, method_frame, properties, body):
+    def ring_setup_callback(self, setup):
         """
-        Callback used to broadcast the virtual ring around the nodes
+        Callback receiving the ring informations of a distributed ring
         """
-        if not self.ring_received:
-            ring = json.loads(body)
-
-            # get own right and left routes
-            self.route_right = [l for l in ring if l[0] == self.my_id][0][1:]
-            self.route_left = [l[::-1] for l in ring if l[-1] == self.my_id][0][1:]  # noqa: E501
+        set_ring_setup(self, setup)
 
-            # get list of all nodes in the network
-            self.all_nodes = [l[0] for l in ring if l[0] != self.my_id]
-
-            # spread info to neighbors
-            for v in self.neighbors_ids:
-                self.send_msg(ring, v)
-            self.nb_broadcast_msg_recv = 1
-            self.ring_received = True
-        else:
-
-            self.nb_broadcast_msg_recv += 1
-        if self.nb_broadcast_msg_recv == len(self.neighbors_ids):
-            self.channel.stop_consuming()
+    def ring_bundle_callback(self, msg):
+        """
+        Callback receiving the ring informations of node's subtree, from its
+        parent in the shout tree
+        """
+        self.tracer.instant("ring entries", subtree_size=len(msg[3]))
+        pass_ring_bundle(self, msg)
 
 # _____________________________________________________________________________
 # _______________________ EXIT PROGRAM ________________________________________
 
+    def close(self):
+        """
+        Deletes the node's queues and closes its connection
+        """
+        self.flush_outbox()
+        if METRICS_FILE:
+            self.metrics.write(self.my_id)
+        self.transport.delete_queue(self.in_queue)
+        if self.to_close_on_exit is not None:
+            self.transport.delete_queue(self.to_close_on_exit)
+        self.transport.close()
+
     def exit_program(self):
-        self.channel.queue_delete(queue=self.in_queue)
-        self.channel.queue_delete(self.to_close_on_exit)
-        self.channel.close()
-        self.connection.close()
+        self.close()
         console_print("bye")
         sys.exit()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This file contains the routing engine used by the leader to compute the
+routes of the virtual ring.
+Routes are shortest paths (in number of hops) computed with BFS. The BFS
+from a given source stores only a parent per vertex, and is resumable : it
+explores the graph just far enough to reach the requested destination, and
+later requests from the same source continue from where it stopped.
+"""
+
+from collections import deque
+
+
+class Router:
+    def __init__(self, graph):
+        """
+        Args:
+            graph: dict, {u: [v_1, ..., v_i]} the graph's adjacency lists
+        """
+        self.graph = graph
+        # source -> (parents of the vertices reached so far, BFS frontier)
+        self.bfs = dict()
+
+    def explore(self, source, target=None):
+        """
+        Runs (or resumes) the BFS from source, until target is reached, or
+        until the whole connected component is reached if target is None.
+        Returns:
+            dict, {v: parent of v on a shortest path from source}
+        """
+        if source not in self.bfs:
+            self.bfs[source] = ({source: None}, deque([source]))
+        parents, frontier = self.bfs[source]
+        graph = self.graph
+        while frontier and (target is None or target not in parents):
+            u = frontier.popleft()
+            for v in graph[u]:
+                if v not in parents:
+                    parents[v] = u
+                    frontier.append(v)
+        return parents
+
+    def path(self, start, end):
+        """
+        Returns a shortest path [start, ..., end] between two nodes,
+        None if end cannot be reached from start
+        """
+        parents = self.explore(start, end)
+        if end not in parents:
+            return None
+        path = [end]
+        while path[-1] != start:
+            path.append(parents[path[-1]])
+        path.reverse()
+        return path
+
+    def routes_from(self, source):
+        """
+        Completes the BFS from source.
+        Returns:
+            dict, {v: parent of v} for all v reachable from source
+        """
+        return self.explore(source)
@@ -1,19 +1,107 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import base64
+import zlib
+
+from lib.config import REFLUX_FORMAT, REFLUX_ZLIB, RING_CONSTRUCTION
 from lib.constants import *
+from lib.codec import pack_adjacency, unpack_adjacency
 
 
 def shout(node):
-    node.reflux = {node.my_id: list(node.neighbors_ids)}
+    node.reflux = own_reflux(node)
+    node.shout_children = []
+    node.shout_done = False
     if node.role == LEADER:
         node.shout_answer = NO
         node.wait_answer_from = [e for e in node.neighbors_ids]
         for v in node.neighbors_ids:
-            node.send_msg([FLUX, node.my_id, None], v)
-        node.recv_msg(node.shout_callback)
-        node.graph = dict(node.reflux)
+            node.send_msg([FLUX, node.my_id, None], v, SHOUT)
+        while not node.shout_done:
+            node.recv_msg(SHOUT, node.shout_callback)
+        if RING_CONSTRUCTION != DISTRIBUTED:
+            node.graph = reflux_graph(node)
     else:
         node.wait_answer_from = []
         node.shout_answer = YES
-        node.recv_msg(node.shout_callback)
+        while not node.shout_done:
+            node.recv_msg(SHOUT, node.shout_callback)
+
+
+# REFLUX ______________________________________________________________________
+# The REFLUX messages carry the adjacency lists of a whole subtree. In the
+# COMPACT format, node.reflux is the list of the records of the subtree's
+# nodes (see pack_adjacency), as received from the children : they are
+# joined once, when sent, so that merging costs nothing, and they are sent
+# as bytes by the binary codec (base64 text in JSON).
+# In both formats, a node's own adjacency list comes first, then the
+# subtrees of its children, one after the other : the graph gathered by the
+# leader lists the nodes in the preorder of the shout tree, which make_ring
+# relies on to send each subtree its entries.
+# For a DISTRIBUTED ring construction, the graph is not gathered : REFLUX
+# messages carry the size of the subtree, and the route from its root to
+# its last node in DFS order (see make_ring_distributed). node.reflux then
+# holds these for each child of the node in the spanning tree.
+
+def own_reflux(node):
+    """
+    Returns the reflux of a node alone
+    """
+    if RING_CONSTRUCTION == DISTRIBUTED:
+        return dict()
+    if REFLUX_FORMAT == COMPACT:
+        return [pack_adjacency(node.my_id, node.neighbors_ids)]
+    return {node.my_id: list(node.neighbors_ids)}
+
+
+def merge_reflux(node, sender, packet):
+    """
+    Adds the reflux packet of sender's subtree to node.reflux
+    """
+    if RING_CONSTRUCTION == DISTRIBUTED:
+        node.reflux[sender] = packet
+    elif REFLUX_FORMAT == COMPACT:
+        data = packet if isinstance(packet, bytes) \
+            else base64.b64decode(packet)
+        node.reflux.append(zlib.decompress(data) if REFLUX_ZLIB else data)
+    else:
+        for k in packet:
+            node.reflux[int(k)] = packet[k]
+
+
+def reflux_packet(node):
+    """
+    Returns node.reflux, ready to be sent in a REFLUX message
+    """
+    if RING_CONSTRUCTION == DISTRIBUTED:
+        return subtree_summary(node)
+    if REFLUX_FORMAT == COMPACT:
+        data = b"".join(node.reflux)
+        if REFLUX_ZLIB:
+            data = zlib.compress(data, 1)
+        if node.codec.carries_bytes:
+            return data
+        return base64.b64encode(data).decode()
+    return node.reflux
+
+
+def reflux_graph(node):
+    """
+    Returns the graph gathered by the leader, {u: [v_1, ..., v_i]}
+    """
+    if REFLUX_FORMAT == COMPACT:
+        return unpack_adjacency(b"".join(node.reflux))
+    return {int(k): node.reflux[k] for k in node.reflux}
+
+
+def subtree_summary(node):
+    """
+    Returns [size of node's subtree, route from node to the last node of its
+    subtree in DFS order]. Children are visited by increasing id
+    """
+    size = 1 + sum(node.reflux[c][0] for c in node.reflux)
+    if not node.reflux:
+        return [size, []]
+    last = max(node.reflux)
+    return [size, [last] + node.reflux[last][1]]
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This file contains the topology generators used by the main launcher, and
+the loader of topologies stored in edge-list files.
+All generators are seeded, build their edges with NumPy array operations,
+and return a Topology : the adjacency lists of the graph stored in two
+arrays (CSR format), which stays compact for millions of vertices.
+All generated graphs are connected and have vertices 0..n-1.
+"""
+
+import os
+import mmap
+
+import numpy as np
+
+from lib.config import DEFAULT_DEGREE, SMALL_WORLD_P
+from lib.config import EDGE_LIST_CHUNK_SIZE
+from lib.constants import *
+
+
+# _________________________________________________________________________
+# _______________________ TOPOLOGY ________________________________________
+
+class Topology:
+    def __init__(self, n, u, v):
+        """
+        Args:
+            n: int, the number of vertices
+            u, v: arrays, the edges' ends. Each undirected edge appears once,
+                  without self loops
+        """
+        self.nb_nodes = n
+        self.nb_edges = len(u)
+        # original ids of the vertices, for topologies loaded from files
+        self.labels = None
+        src = np.concatenate((u, v))
+        dst = np.concatenate((v, u))
+        self.indices = dst[np.argsort(src)]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=self.indptr[1:])
+
+    def __len__(self):
+        return self.nb_nodes
+
+    def __iter__(self):
+        return iter(range(self.nb_nodes))
+
+    def __getitem__(self, u):
+        """
+        Returns the array of u's neighbors
+        """
+        return self.indices[self.indptr[u]:self.indptr[u+1]]
+
+    def is_connected(self):
+        """
+        BFS from vertex 0 over the CSR arrays, a whole frontier at a time.
+        Returns:
+            bool, whether all vertices are reached
+        """
+        if self.nb_nodes == 0:
+            return False
+        seen = np.zeros(self.nb_nodes, dtype=bool)
+        seen[0] = True
+        frontier = np.zeros(1, dtype=np.int64)
+        while len(frontier):
+            starts = self.indptr[frontier]
+            lengths = self.indptr[frontier + 1] - starts
+            # positions of the frontier's adjacency lists in indices
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths,
+                                lengths)
+            neighbors = self.indices[offsets + np.arange(lengths.sum())]
+            frontier = np.unique(neighbors[~seen[neighbors]])
+            seen[frontier] = True
+        return bool(seen.all())
+
+    def to_dict(self):
+        """
+        Returns the graph as a dictionary {u: {v_1, ..., v_i}}
+        """
+        return {u: set(self[u].tolist()) for u in self}
+
+
+def sorted_unique(a):
+    """
+    Returns the sorted array of the distinct values of a
+    """
+    a = np.sort(a)
+    return a[np.concatenate(([True], a[1:] != a[:-1]))] if len(a) else a
+
+
+def contains(sorted_a, x):
+    """
+    Returns the boolean array telling which values of x are in sorted_a
+    """
+    if not len(sorted_a):
+        return np.zeros(len(x), dtype=bool)
+    i = np.minimum(np.searchsorted(sorted_a, x), len(sorted_a) - 1)
+    return sorted_a[i] == x
+
+
+def edge_keys(n, u, v):
+    """
+    Returns the keys min(u, v)*n + max(u, v) identifying undirected edges
+    """
+    return np.minimum(u, v) * n + np.maximum(u, v)
+
+
+def unique_edges(n, u, v):
+    """
+    Removes self loops and duplicated edges.
+    Returns:
+        (u, v), with u < v for each edge
+    """
+    keep = u != v
+    keys = sorted_unique(edge_keys(n, u[keep], v[keep]))
+    return keys // n, keys % n
+
+
+# _________________________________________________________________________
+# _______________________ GENERATORS ______________________________________
+
+def random_tree(n, rng):
+    """
+    Returns the edges of a random recursive tree : the i-th vertex of a
+    random permutation is attached to one of the i vertices before it
+    """
+    order = rng.permutation(n)
+    parents = (rng.random(n - 1) * np.arange(1, n)).astype(np.int64)
+    return order[1:], order[parents]
+
+
+def erdos_renyi(n, s, rng):
+    """
+    Connected random graph with n vertices and s edges : a random spanning
+    tree, plus s-n+1 edges drawn uniformly among the missing ones
+    """
+    s = min(max(n - 1, s), n * (n - 1) // 2)
+    tree = sorted_unique(edge_keys(n, *random_tree(n, rng)))
+
+    to_add = s - (n - 1)
+    if to_add > (n * (n - 1) // 2 - (n - 1)) // 2:
+        # dense graph : draw among all the missing edges
+        iu, iv = np.triu_indices(n, 1)
+        missing = iu * n + iv
+        missing = missing[~contains(tree, missing)]
+        extra = rng.choice(missing, to_add, False)
+    else:
+        # sparse graph : draw batches of random pairs until enough are new
+        extra = np.empty(0, dtype=np.int64)
+        while len(extra) < to_add:
+            batch = int(1.1 * (to_add - len(extra))) + 16
+            a = rng.integers(0, n, batch)
+            b = rng.integers(0, n, batch)
+            new = edge_keys(n, a[a != b], b[a != b])
+            new = new[~contains(tree, new)]
+            extra = sorted_unique(np.concatenate((extra, new)))
+        extra = rng.permutation(extra)[:to_add]
+    keys = np.concatenate((tree, extra))
+    return Topology(n, keys // n, keys % n)
+
+
+def barabasi_albert(n, k, rng):
+    """
+    Preferential attachment : each new vertex v attaches k edges to
+    earlier vertices, picked with a probability proportional to their
+    degree. An endpoint of an earlier edge is picked uniformly, and the
+    chains of 'target of an earlier edge' are resolved by pointer jumping.
+    Duplicated edges are merged, so some vertices end up with less than k
+    edges.
+    """
+    k = max(1, k)
+    nb = (n - 1) * k
+    edge = np.arange(nb)
+    src = edge // k + 1
+    # endpoint 2e is the source of edge e, endpoint 2e+1 its target.
+    # Edges of vertex v pick among the endpoints of vertices 1..v-1 ;
+    # vertex 1 has nothing to pick from and attaches to vertex 0 (-1)
+    bound = 2 * (src - 1) * k
+    ptr = np.where(
+        bound > 0, (rng.random(nb) * bound).astype(np.int64), -1
+    )
+    res = ptr.copy()
+    odd = (res >= 0) & (res % 2 == 1)
+    while odd.any():
+        res[odd] = ptr[res[odd] // 2]
+        odd = (res >= 0) & (res % 2 == 1)
+    dst = np.where(res < 0, 0, res // 2 // k + 1)
+    return Topology(n, *unique_edges(n, src, dst))
+
+
+def grid(n, torus=False):
+    """
+    Vertices are laid out row after row on a grid of width ceil(sqrt(n)),
+    the last row may be incomplete. With torus, rows and columns wrap around
+    """
+    w = int(np.ceil(np.sqrt(n)))
+    i = np.arange(n)
+    right = (i % w != w - 1) & (i + 1 < n)
+    down = i + w < n
+    u = np.concatenate((i[right], i[down]))
+    v = np.concatenate((i[right] + 1, i[down] + w))
+    if torus:
+        # last vertex of each row to the first one
+        first = i[i % w == 0]
+        last = np.minimum(first + w - 1, n - 1)
+        long_rows = last - first > 1
+        # last vertex of each column to the first one
+        col = i[:w]
+        bottom = col + (n - 1 - col) // w * w
+        long_cols = bottom - col > w
+        u = np.concatenate((u, first[long_rows], col[long_cols]))
+        v = np.concatenate((v, last[long_rows], bottom[long_cols]))
+    return Topology(n, *unique_edges(n, u, v))
+
+
+def small_world(n, k, p, rng):
+    """
+    Watts-Strogatz graph : a ring where each vertex is linked to its k//2
+    closest vertices on each side, then each edge is rewired to a random
+    vertex with probability p. Edges between ring neighbors are never
+    rewired, so the graph stays connected.
+    """
+    half = max(1, k // 2)
+    i = np.arange(n)
+    u = np.tile(i, half)
+    v = (u + np.repeat(np.arange(1, half + 1), n)) % n
+    rewire = (rng.random(len(u)) < p) & (v != (u + 1) % n)
+    v[rewire] = rng.integers(0, n, rewire.sum())
+    return Topology(n, *unique_edges(n, u, v))
+
+
+def generate(family, n, s=0, seed=None):
+    """
+    Generates a connected graph of the given family.
+    Args:
+        family: str, ERDOS_RENYI, BARABASI_ALBERT, GRID, TORUS or SMALL_WORLD
+        n: int, the number of vertices
+        s: int, the wanted number of edges (approximate for all families but
+           ERDOS_RENYI, ignored for GRID and TORUS). If 0, the graph has
+           an average degree of DEFAULT_DEGREE, so that its size is linear
+           in n
+        seed: int, the random seed. The same seed gives the same graph
+    Returns:
+        a Topology
+    """
+    max_edges = n * (n - 1) // 2
+    if s == 0:
+        s = min(DEFAULT_DEGREE * n // 2, max_edges)
+    elif s > max_edges:
+        raise ValueError("a graph of %s vertices has at most %s edges, not %s"
+                         % (n, max_edges, s))
+    rng = np.random.default_rng(seed)
+    if family == ERDOS_RENYI:
+        return erdos_renyi(n, s, rng)
+    elif family == BARABASI_ALBERT:
+        return barabasi_albert(n, int(round(s / n)), rng)
+    elif family == GRID:
+        return grid(n)
+    elif family == TORUS:
+        return grid(n, torus=True)
+    elif family == SMALL_WORLD:
+        return small_world(n, 2 * int(round(s / n)), SMALL_WORLD_P, rng)
+    raise ValueError("Unknown topology : %s" % family)
+
+
+# _________________________________________________________________________
+# _______________________ EDGE-LIST FILES _________________________________
+
+def parse_edges(data):
+    """
+    Parses the bytes of complete lines of an edge-list file : one edge per
+    line, as two non negative integers separated by spaces, tabs or commas.
+    Further columns (weights, ...) are ignored, and so are empty lines and
+    comment lines (starting with '#' or '%').
+    Returns:
+        (u, v), the arrays of the edges' ends
+    """
+    b = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(b == ord('\n'))
+
+    # tokens are runs of digits
+    is_digit = (b >= ord('0')) & (b <= ord('9'))
+    bounds = np.diff(is_digit.view(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(bounds == 1)
+    lengths = np.flatnonzero(bounds == -1) - starts
+
+    # drop the tokens of comment lines
+    token_line = np.searchsorted(newlines, starts)
+    line_starts = np.concatenate(([0], newlines + 1))[token_line]
+    keep = ~np.isin(b[np.minimum(line_starts, len(b) - 1)],
+                    (ord('#'), ord('%')))
+    starts, lengths, token_line = \
+        starts[keep], lengths[keep], token_line[keep]
+
+    # numbers, one digit position at a time (Horner's method)
+    values = np.zeros(len(starts), dtype=np.int64)
+    for k in range(lengths.max() if len(lengths) else 0):
+        more = lengths > k
+        values[more] = values[more] * 10 + (b[starts[more] + k] - ord('0'))
+
+    # keep the first two tokens of each line
+    index = np.arange(len(starts))
+    first = np.concatenate(([True], token_line[1:] != token_line[:-1]))
+    rank = index - np.maximum.accumulate(np.where(first, index, 0))
+    u, v = values[rank == 0], values[rank == 1]
+    has_v = np.isin(token_line[rank == 0], token_line[rank == 1])
+    return u[has_v], v
+
+
+def load_edge_list(path, chunk_size=EDGE_LIST_CHUNK_SIZE):
+    """
+    Loads an undirected graph from an edge-list file. The file is memory
+    mapped and parsed by chunks of whole lines, so that only one chunk of
+    text is decoded at a time. Vertices are renumbered 0..n-1 in the order
+    of their original ids, which are kept in the labels attribute.
+    Self loops and duplicated edges are dropped.
+    Returns:
+        a Topology
+    Raises:
+        ValueError, if the file has no edge, or if the graph is not
+        connected (the election and the shout need a connected network)
+    """
+    us, vs = [], []
+    with open(path, 'rb') as f:
+        # empty files can not be memory mapped
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = 0
+                while start < len(mm):
+                    end = mm.find(b'\n',
+                                  min(start + chunk_size, len(mm)) - 1)
+                    end = len(mm) if end < 0 else end + 1
+                    u, v = parse_edges(mm[start:end])
+                    us.append(u)
+                    vs.append(v)
+                    start = end
+    u = np.concatenate(us) if us else np.empty(0, dtype=np.int64)
+    v = np.concatenate(vs) if vs else np.empty(0, dtype=np.int64)
+    labels, ends = np.unique(np.concatenate((u, v)), return_inverse=True)
+    n = len(labels)
+    topology = Topology(n, *unique_edges(n, ends[:len(u)], ends[len(u):]))
+    topology.labels = labels
+    if topology.nb_edges == 0:
+        raise ValueError("%s has no edge" % path)
+    if not topology.is_connected():
+        raise ValueError("the graph of %s is not connected" % path)
+    return topology
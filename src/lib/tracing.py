@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This file contains the tracer recording the setup of a node (election,
+shout, ring) in the Chrome trace event format, viewable in chrome://tracing
+or Perfetto :
+    + phases and yo-yo rounds are begin / end events
+    + steps of the shout wave are instant events
+    + each message sent carries a flow id, recorded by the sender and by the
+      receiver, which draws an arrow from the sending span to the receiving
+      one : following the arrows gives the critical path across the nodes
+Each node writes its own file (TRACE_FILE) once its ring is set up, and
+merge_traces.py combines the files of all nodes into one timeline.
+Timestamps are wall clock times, so nodes on different hosts should have
+synchronized clocks.
+"""
+
+import os
+import json
+import time
+
+from lib.config import TRACE_FILE
+
+FLOW = "message"
+
+
+class Tracer:
+    def __init__(self, enabled=TRACE_FILE is not None):
+        self.enabled = enabled
+        self.events = []
+        self.nb_flows = 0
+
+    def record(self, event):
+        event["ts"] = time.time() * 1e6
+        self.events.append(event)
+
+    def begin(self, name, **args):
+        if self.enabled:
+            self.record({"name": name, "ph": "B", "args": args})
+
+    def end(self, name):
+        if self.enabled:
+            self.record({"name": name, "ph": "E"})
+
+    def instant(self, name, **args):
+        if self.enabled:
+            self.record({"name": name, "ph": "i", "s": "t", "args": args})
+
+    def flow_out(self, node_id, mailbox):
+        """
+        Records the sending of a message of mailbox.
+        Returns:
+            str, the flow id to be carried by the message
+        """
+        self.nb_flows += 1
+        flow_id = "%s.%s" % (node_id, self.nb_flows)
+        self.record({"name": FLOW, "cat": mailbox, "ph": "s",
+                     "id": flow_id})
+        return flow_id
+
+    def flow_in(self, mailbox, flow_id):
+        """
+        Records the reception of the message of flow_id
+        """
+        if self.enabled:
+            self.record({"name": FLOW, "cat": mailbox, "ph": "f", "bp": "e",
+                         "id": flow_id})
+
+    def write(self, node_id, path=TRACE_FILE):
+        """
+        Writes the events to path ('%s' being replaced by node_id), and
+        stops recording
+        """
+        if "%s" in path:
+            path = path % node_id
+        for event in self.events:
+            event["pid"] = node_id
+            event["tid"] = 0
+        with open(path + ".tmp", 'w') as f:
+            json.dump({"traceEvents": self.events,
+                       "otherData": {"node": node_id}}, f)
+        os.replace(path + ".tmp", path)
+        self.enabled = False
+        self.events = []
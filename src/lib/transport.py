@@ -0,0 +1,899 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This file contains the transport layer used by the PikaNodes and the main
+launcher. A transport moves opaque message bodies between named queues.
+Three backends are provided :
+    + PikaTransport, talking to a RabbitMQ broker (default)
+    + PooledTransport, a channel on one of the few RabbitMQ connections of a
+      ConnectionPool, shared by the nodes of a process
+    + MemoryTransport, using an in-process broker, so that thousands of
+      nodes can run as threads of a single process
+"""
+
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+
+import pika
+try:
+    import aio_pika
+except ImportError:     # needed by the main launcher and the asyncio main
+    aio_pika = None     # loop on RabbitMQ, see confirm_delivery
+
+from lib.config import PIKA_CONNECTION_PARAMETERS, AMQP_URL, TRANSPORT
+from lib.config import CONFIRM_WINDOW, PREFETCH_COUNT, PRIORITY_QUEUES
+from lib.config import SHARED_CONNECTIONS
+from lib.constants import AMQP, MEMORY, MEMORY_WAIT_TIMEOUT, MAX_PRIORITY
+from lib.constants import SELECT_TIMEOUT
+
+# arguments of all the queues declared on RabbitMQ : they must be the same
+# for every declaration of a queue
+QUEUE_ARGUMENTS = {"x-max-priority": MAX_PRIORITY} if PRIORITY_QUEUES \
+    else None
+
+
+class TransportError(Exception):
+    """
+    Raised when the underlying connection or channel is not usable anymore
+    """
+    pass
+
+
+# _________________________________________________________________________
+# _______________________ TRANSPORT INTERFACE _____________________________
+# _________________________________________________________________________
+
+class Transport(ABC):
+    """
+    Interface shared by all transports. Callbacks given to consume receive
+    the message body only : acknowledging is the transport's job.
+    Backends implement all abstract methods : a backend missing one fails
+    when it is created, not in the middle of a protocol.
+    """
+    def open(self):
+        """
+        Opens the connection
+        """
+        pass
+
+    @abstractmethod
+    def declare_queue(self, queue):
+        pass
+
+    @abstractmethod
+    def delete_queue(self, queue):
+        pass
+
+    def confirm_delivery(self):
+        """
+        Enables publisher confirms, where the backend supports them
+        """
+        pass
+
+    @abstractmethod
+    def publish(self, queue, body, priority=0):
+        """
+        Publishes body on queue. Messages of higher priority (up to
+        MAX_PRIORITY) are delivered first when PRIORITY_QUEUES is set.
+        Returns:
+            bool, False if the message could not be published
+        """
+
+    def publish_batch(self, messages, declare=False):
+        """
+        Publishes many messages at once. Backends may pipeline them, so the
+        order of the messages is only kept within each queue.
+        Args:
+            messages: list, the (queue, body) pairs to publish
+            declare: bool, whether to declare the queues before publishing
+        Returns:
+            list, the (queue, body) pairs that could not be published
+        """
+        failed = []
+        for queue, body in messages:
+            if declare:
+                self.declare_queue(queue)
+            if not self.publish(queue, body):
+                failed.append((queue, body))
+        return failed
+
+    @abstractmethod
+    def consume(self, queue, callback):
+        """
+        Calls callback(body) for each message arriving on queue, until
+        stop_consuming is called (usually from within the callback)
+        """
+
+    @abstractmethod
+    def stop_consuming(self):
+        pass
+
+    @abstractmethod
+    async def consume_async(self, queue, callback):
+        """
+        Asyncio version of consume : calls callback(body) as soon as a message
+        arrives on queue, until stop_consuming is called
+        """
+
+    @abstractmethod
+    def get(self, queue):
+        """
+        Non blocking read on queue.
+        Returns:
+            the body of the first message waiting on queue, None if empty
+        """
+
+    @abstractmethod
+    def subscribe(self, queue):
+        """
+        Starts a long-lived consumer on queue. Its messages are then read
+        with receive, until unsubscribe is called
+        """
+
+    @abstractmethod
+    def receive(self, timeout=None):
+        """
+        Reads the next message of the subscribed queue, waiting at most
+        timeout seconds (forever if None).
+        Returns:
+            the body of the message, None if none came
+        """
+
+    @abstractmethod
+    def unsubscribe(self):
+        """
+        Stops the consumer started by subscribe.
+        Returns:
+            list, the bodies already received but not read yet
+        """
+
+    def close(self):
+        pass
+
+
+# _________________________________________________________________________
+# _______________________ RABBITMQ TRANSPORT ______________________________
+# _________________________________________________________________________
+
+class InboxTransport(Transport):
+    """
+    Subscription of the RabbitMQ transports : the broker pushes up to
+    prefetch messages of the subscribed queue ahead of time to an inbox,
+    that receive reads, and they are acknowledged in batches.
+    Subclasses tell how a channel operation runs with channel_call (and
+    channel_send when the result is not needed), and how to wait for
+    messages with wait_inbox
+    """
+    def __init__(self):
+        # messages of the subscribed queue : (delivery tag, body) pairs
+        # received from the broker, and the number of them read but not
+        # acknowledged yet
+        self.inbox = deque()
+        self.arrived = threading.Condition()
+        self.nb_unacked = 0
+        self.last_tag = None
+        self.consumer_tag = None
+
+    @abstractmethod
+    def channel_call(self, fn, *args, **kwargs):
+        """
+        Runs the channel operation fn, and waits for it.
+        Returns:
+            the result of fn
+        """
+
+    def channel_send(self, fn, *args, **kwargs):
+        """
+        Runs the channel operation fn, whose result is not needed
+        """
+        self.channel_call(fn, *args, **kwargs)
+
+    @abstractmethod
+    def wait_inbox(self, timeout):
+        """
+        Waits at most timeout seconds (forever if None) for messages to
+        arrive in the inbox, with self.arrived held
+        """
+
+    def subscribe(self, queue, prefetch=PREFETCH_COUNT):
+        self.prefetch = prefetch
+        self.channel_call(self.channel.basic_qos, prefetch_count=prefetch)
+        self.consumer_tag = self.channel_call(
+            self.channel.basic_consume, self.on_inbox_message, queue=queue,
+            no_ack=False
+        )
+
+    def on_inbox_message(self, ch, method_frame, properties, body):
+        with self.arrived:
+            self.inbox.append((method_frame.delivery_tag, body))
+            self.arrived.notify()
+
+    def receive(self, timeout=None):
+        with self.arrived:
+            if not self.inbox:
+                self.ack_inbox()
+                self.wait_inbox(timeout)
+            if not self.inbox:
+                return None
+            tag, body = self.inbox.popleft()
+        self.last_tag = tag
+        self.nb_unacked += 1
+        if self.nb_unacked >= self.prefetch // 2:
+            self.ack_inbox()
+        return body
+
+    def ack_inbox(self):
+        """
+        Acknowledges all the messages read so far, with a single frame
+        """
+        if self.nb_unacked:
+            self.channel_send(self.channel.basic_ack, self.last_tag,
+                              multiple=True)
+            self.nb_unacked = 0
+
+    def unsubscribe(self):
+        return self.cancel(requeue=False)
+
+    def cancel(self, requeue):
+        """
+        Stops the consumer started by subscribe. Messages received but not
+        read yet are given back to the broker if requeue, and otherwise
+        acknowledged and handed back, so that the broker does not deliver
+        them again.
+        Returns:
+            list, the bodies handed back
+        """
+        if self.consumer_tag is not None:
+            self.channel_call(self.channel.basic_cancel, self.consumer_tag)
+            self.consumer_tag = None
+        with self.arrived:
+            left = list(self.inbox)
+            self.inbox.clear()
+        self.ack_inbox()
+        if not left:
+            return []
+        if requeue:
+            self.channel_send(self.channel.basic_nack, left[-1][0],
+                              multiple=True, requeue=True)
+            return []
+        self.channel_send(self.channel.basic_ack, left[-1][0], multiple=True)
+        return [body for _, body in left]
+
+
+class PikaTransport(InboxTransport):
+    def __init__(self, parameters=PIKA_CONNECTION_PARAMETERS, url=AMQP_URL):
+        """
+        Args:
+            parameters: pika.ConnectionParameters, where to find the broker
+            url: str, the same broker as an AMQP url, for aio_pika
+        """
+        InboxTransport.__init__(self)
+        self.parameters = parameters
+        self.url = url
+        self.outbox = None
+
+    def open(self):
+        self.connection = pika.BlockingConnection(self.parameters)
+        self.channel = self.connection.channel()
+
+    def declare_queue(self, queue):
+        self.channel.queue_declare(queue=queue, arguments=QUEUE_ARGUMENTS)
+
+    def delete_queue(self, queue):
+        self.channel.queue_delete(queue=queue)
+
+    def confirm_delivery(self):
+        """
+        Confirmed batches (the main launcher's) need aio_pika : checked
+        here, when the launcher starts, rather than once the nodes wait for
+        their neighbors
+        """
+        if aio_pika is None:
+            raise TransportError("publisher confirms need aio_pika "
+                                 "(pip install aio-pika)")
+        self.channel.confirm_delivery()
+
+    def publish(self, queue, body, priority=0):
+        if self.outbox is not None:     # asyncio mode, see consume_async
+            self.outbox.put_nowait((queue, body, priority))
+            return True
+        return self.channel.basic_publish(
+            exchange='',
+            routing_key=queue,
+            body=body,
+            properties=pika.BasicProperties(priority=priority)
+            if priority else None
+        ) is not False
+
+    def publish_batch(self, messages, declare=False):
+        """
+        The batch goes through a dedicated aio_pika connection where
+        publisher confirms are asynchronous : up to CONFIRM_WINDOW messages
+        (and queue declarations) are in flight at once, instead of waiting
+        for a broker round trip per message
+        """
+        if aio_pika is None:
+            raise TransportError("batches need aio_pika "
+                                 "(pip install aio-pika)")
+        return asyncio.run(self.publish_batch_async(messages, declare))
+
+    async def publish_batch_async(self, messages, declare,
+                                  window=CONFIRM_WINDOW):
+        connection = await aio_pika.connect_robust(self.url)
+        failed = []
+        try:
+            channel = await connection.channel(publisher_confirms=True)
+            in_flight = asyncio.Semaphore(window)
+
+            async def send(queue, body):
+                async with in_flight:
+                    if isinstance(body, str):
+                        body = body.encode()
+                    try:
+                        if declare:
+                            await channel.declare_queue(
+                                queue, arguments=QUEUE_ARGUMENTS
+                            )
+                        await channel.default_exchange.publish(
+                            aio_pika.Message(body=body),
+                            routing_key=queue
+                        )
+                    except aio_pika.exceptions.DeliveryError:
+                        failed.append((queue, body))
+
+            await asyncio.gather(*(send(q, b) for q, b in messages))
+        finally:
+            await connection.close()
+        return failed
+
+    def consume(self, queue, callback):
+        def on_message(ch, method_frame, properties, body):
+            ch.basic_ack(method_frame.delivery_tag)
+            callback(body)
+
+        self.channel.basic_consume(on_message, queue=queue, no_ack=False)
+        self.channel.start_consuming()
+
+    def stop_consuming(self):
+        self.channel.stop_consuming()
+        self.consuming = False
+
+    async def consume_async(self, queue, callback):
+        """
+        Opens an aio_pika connection next to the blocking one. While it runs,
+        publish goes through an outbox emptied by a single task, so that
+        messages leave in the order they were published, and the blocking
+        connection is kept alive (heartbeats) by another task.
+        Raises TransportError if a message of the outbox can not be
+        published, instead of letting the outbox grow forever
+        """
+        if aio_pika is None:
+            raise TransportError("the asyncio main loop needs aio_pika")
+        connection = await aio_pika.connect_robust(self.url)
+        channel = await connection.channel()
+        self.outbox = asyncio.Queue()
+        publisher = asyncio.ensure_future(self.publish_outbox(channel))
+        consumer = asyncio.ensure_future(
+            self.consume_queue(channel, queue, callback)
+        )
+        keep_alive = asyncio.ensure_future(self.pump_blocking())
+        self.consuming = True
+        try:
+            done, _ = await asyncio.wait(
+                [publisher, consumer, keep_alive],
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if publisher in done:
+                raise TransportError("publishing failed : %r"
+                                     % publisher.exception())
+            if keep_alive in done:
+                raise TransportError("blocking connection lost : %r"
+                                     % keep_alive.exception())
+            consumer.result()
+        finally:
+            for task in (publisher, consumer, keep_alive):
+                task.cancel()
+            self.outbox = None
+            await connection.close()
+
+    async def consume_queue(self, channel, queue, callback):
+        amqp_queue = await channel.declare_queue(
+            queue, arguments=QUEUE_ARGUMENTS
+        )
+        async with amqp_queue.iterator() as messages:
+            async for message in messages:
+                async with message.process():
+                    callback(message.body)
+                if not self.consuming:
+                    break
+
+    async def publish_outbox(self, channel):
+        while True:
+            queue, body, priority = await self.outbox.get()
+            if isinstance(body, str):
+                body = body.encode()
+            await channel.default_exchange.publish(
+                aio_pika.Message(body=body, priority=priority or None),
+                routing_key=queue
+            )
+
+    async def pump_blocking(self):
+        """
+        Lets the blocking connection, unused while consume_async runs,
+        answer the broker's heartbeats
+        """
+        while True:
+            await asyncio.sleep(SELECT_TIMEOUT)
+            self.connection.process_data_events(time_limit=0)
+
+    def get(self, queue):
+        try:
+            m_frame, header_frame, body = self.channel.basic_get(queue)
+        except pika.exceptions.ChannelClosed:
+            raise TransportError("channel closed")
+        if not m_frame:
+            return None
+        self.channel.basic_ack(m_frame.delivery_tag)
+        return body
+
+    def channel_call(self, fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except (pika.exceptions.ChannelClosed,
+                pika.exceptions.ConnectionClosed):
+            raise TransportError("channel closed")
+
+    def wait_inbox(self, timeout):
+        self.channel_call(self.connection.process_data_events,
+                          time_limit=timeout)
+        while timeout is None and not self.inbox:
+            self.channel_call(self.connection.process_data_events,
+                              time_limit=None)
+
+    def close(self):
+        self.channel.close()
+        self.connection.close()
+
+
+# _________________________________________________________________________
+# _______________________ SHARED CONNECTIONS ______________________________
+# _________________________________________________________________________
+
+class IOConnection:
+    """
+    A RabbitMQ connection owned by an I/O thread. pika connections are not
+    thread safe : the other threads hand their channel operations to the I/O
+    thread, which runs them in order between two waits for broker events,
+    and delivers the messages of all channels
+    """
+    def __init__(self, parameters):
+        self.connection = pika.BlockingConnection(parameters)
+        self.running = True
+        self.nb_channels = 0
+        self.thread = threading.Thread(target=self.pump, daemon=True)
+        self.thread.start()
+
+    def pump(self):
+        try:
+            while self.running:
+                self.connection.process_data_events(time_limit=SELECT_TIMEOUT)
+            self.connection.close()
+        except pika.exceptions.AMQPError:
+            self.running = False
+
+    def alive(self):
+        return self.running and self.thread.is_alive()
+
+    def submit(self, run):
+        """
+        Runs run() in the I/O thread, without waiting for it
+        """
+        if not self.alive():
+            raise TransportError("connection closed")
+        self.connection.add_callback_threadsafe(run)
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Runs fn in the I/O thread, and waits for it.
+        Returns:
+            the result of fn, whose exceptions are raised in this thread
+        """
+        if threading.current_thread() is self.thread:
+            return fn(*args, **kwargs)
+        done = threading.Event()
+        outcome = [None, None]
+
+        def run():
+            try:
+                outcome[0] = fn(*args, **kwargs)
+            except Exception as e:
+                outcome[1] = e
+            done.set()
+
+        self.submit(run)
+        while not done.wait(SELECT_TIMEOUT):
+            if not self.alive():
+                raise TransportError("connection closed")
+        if outcome[1] is not None:
+            raise outcome[1]
+        return outcome[0]
+
+    def stop(self):
+        if self.alive():
+            self.running = False
+            self.connection.add_callback_threadsafe(lambda: None)
+            self.thread.join()
+
+
+class ConnectionPool:
+    """
+    A few RabbitMQ connections shared by the transports of a process, so
+    that hundreds of nodes do not open hundreds of connections : each
+    transport gets its own channel, on the connection with the fewest
+    channels. Connections are opened on first use
+    """
+    def __init__(self, size=SHARED_CONNECTIONS or 1,
+                 parameters=PIKA_CONNECTION_PARAMETERS):
+        """
+        Args:
+            size: int, the maximum number of connections
+            parameters: pika.ConnectionParameters, where to find the broker
+        """
+        self.size = size
+        self.parameters = parameters
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def transport(self):
+        """
+        Returns:
+            PooledTransport, a new transport on this pool
+        """
+        return PooledTransport(self)
+
+    def open_channel(self):
+        """
+        Returns:
+            (IOConnection, channel), a new channel and its connection
+        """
+        with self.lock:
+            self.connections = [c for c in self.connections if c.alive()]
+            if len(self.connections) < self.size:
+                io = IOConnection(self.parameters)
+                self.connections.append(io)
+            else:
+                io = min(self.connections, key=lambda c: c.nb_channels)
+            io.nb_channels += 1
+        return io, io.call(io.connection.channel)
+
+    def release(self, io):
+        with self.lock:
+            io.nb_channels -= 1
+
+    def close(self):
+        """
+        Closes all connections, with the channels left on them
+        """
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for io in connections:
+            io.stop()
+
+
+class PooledTransport(InboxTransport):
+    """
+    Transport on a channel of a ConnectionPool. Channel operations run in
+    the I/O thread of the connection : publishes and acknowledgements are
+    handed over without waiting, and the messages of the subscribed queue
+    are pushed to an inbox by the I/O thread, that receive reads without
+    touching the connection
+    """
+    def __init__(self, pool):
+        InboxTransport.__init__(self)
+        self.pool = pool
+        self.io = None
+        # PikaTransport of the confirmed publishes, see confirm_delivery
+        self.confirmed = None
+        self.consuming = False
+
+    def open(self):
+        self.io, self.channel = self.pool.open_channel()
+
+    def declare_queue(self, queue):
+        self.io.call(self.channel.queue_declare, queue=queue,
+                     arguments=QUEUE_ARGUMENTS)
+
+    def delete_queue(self, queue):
+        self.io.call(self.channel.queue_delete, queue=queue)
+
+    def confirm_delivery(self):
+        """
+        With publisher confirms (the main launcher), each publish would wait
+        in the I/O thread for a broker round trip, and stall the other
+        channels of the connection : publishes go through a PikaTransport
+        of their own instead, which keeps up to CONFIRM_WINDOW messages in
+        flight for batches (see PikaTransport.publish_batch)
+        """
+        self.confirmed = PikaTransport(self.pool.parameters)
+        self.confirmed.open()
+        self.confirmed.confirm_delivery()
+
+    def channel_call(self, fn, *args, **kwargs):
+        return self.io.call(fn, *args, **kwargs)
+
+    def channel_send(self, fn, *args, **kwargs):
+        """
+        Runs the channel operation fn in the I/O thread, without waiting.
+        An error closes the channel, and is seen by the next calls
+        """
+        def run():
+            try:
+                fn(*args, **kwargs)
+            except pika.exceptions.AMQPError:
+                pass
+
+        self.io.submit(run)
+
+    def publish(self, queue, body, priority=0):
+        if self.confirmed is not None:
+            return self.confirmed.publish(queue, body, priority)
+        properties = pika.BasicProperties(priority=priority) \
+            if priority else None
+        if not self.channel.is_open:
+            raise TransportError("channel closed")
+        self.channel_send(self.channel.basic_publish, exchange='',
+                          routing_key=queue, body=body, properties=properties)
+        return True
+
+    def publish_batch(self, messages, declare=False):
+        """
+        The whole batch runs in the I/O thread : one thread switch instead
+        of one per message
+        """
+        if self.confirmed is not None:
+            return self.confirmed.publish_batch(messages, declare)
+        return self.io.call(Transport.publish_batch, self, messages, declare)
+
+    def consume(self, queue, callback):
+        self.subscribe(queue)
+        self.consuming = True
+        try:
+            while self.consuming:
+                callback(self.receive())
+        finally:
+            self.cancel(requeue=True)
+
+    def stop_consuming(self):
+        self.consuming = False
+
+    async def consume_async(self, queue, callback):
+        """
+        Messages already in the inbox are handled right away ; the event
+        loop only hands the wait over to a thread when it is empty
+        """
+        loop = asyncio.get_running_loop()
+        self.subscribe(queue)
+        self.consuming = True
+        try:
+            while self.consuming:
+                body = self.receive(0)
+                if body is None:
+                    body = await loop.run_in_executor(
+                        None, self.receive, SELECT_TIMEOUT
+                    )
+                if body is not None:
+                    callback(body)
+                await asyncio.sleep(0)
+        finally:
+            self.cancel(requeue=True)
+
+    def get(self, queue):
+        m_frame, header_frame, body = self.io.call(self.channel.basic_get,
+                                                   queue)
+        if not m_frame:
+            return None
+        self.channel_send(self.channel.basic_ack, m_frame.delivery_tag)
+        return body
+
+    def check(self):
+        """
+        Raises TransportError if the channel can not deliver anymore
+        """
+        if not self.io.alive() or not self.channel.is_open:
+            raise TransportError("channel closed")
+
+    def wait_inbox(self, timeout):
+        if timeout is None:
+            while not self.inbox:
+                self.check()
+                self.arrived.wait(SELECT_TIMEOUT)
+        elif timeout > 0:
+            self.arrived.wait(timeout)
+        if not self.inbox:
+            self.check()
+
+    def close(self):
+        if self.confirmed is not None:
+            self.confirmed.close()
+            self.confirmed = None
+        if self.io is None:
+            return
+        if self.io.alive() and self.channel.is_open:
+            self.io.call(self.channel.close)
+        self.pool.release(self.io)
+        self.io = None
+
+
+# _________________________________________________________________________
+# _______________________ IN-PROCESS TRANSPORT ____________________________
+# _________________________________________________________________________
+
+class MemoryQueue:
+    """
+    Queue of the in-process broker : one FIFO per priority, popleft returns
+    the oldest message of the highest priority
+    """
+    def __init__(self):
+        self.levels = [deque() for _ in range(MAX_PRIORITY + 1)]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, body, priority=0):
+        self.levels[priority].append(body)
+        self.size += 1
+
+    def popleft(self):
+        for level in reversed(self.levels):
+            if level:
+                self.size -= 1
+                return level.popleft()
+        raise IndexError("pop from an empty queue")
+
+
+class MemoryBroker:
+    """
+    A minimal in-process broker : a dictionary of queues, each guarded by
+    its own condition so that waking a consumer costs O(1)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = dict()
+
+    def queue(self, name):
+        """
+        Returns the (messages, condition) pair of the queue 'name'.
+        Queues are created on first use, so that a message published before
+        its receiver declared the queue is not lost.
+        """
+        q = self.queues.get(name)
+        if q is None:
+            with self.lock:
+                q = self.queues.setdefault(
+                    name, (MemoryQueue(), threading.Condition())
+                )
+        return q
+
+    def delete(self, name):
+        with self.lock:
+            self.queues.pop(name, None)
+
+
+class MemoryTransport(Transport):
+    def __init__(self, broker=None):
+        """
+        Args:
+            broker: MemoryBroker, shared by all transports of the cluster.
+                    The process wide broker is used if None
+        """
+        self.broker = broker if broker is not None else DEFAULT_BROKER
+        self.consuming = False
+        self.subscribed = None
+        self.inbox = deque()
+
+    def declare_queue(self, queue):
+        self.broker.queue(queue)
+
+    def delete_queue(self, queue):
+        self.broker.delete(queue)
+
+    def publish(self, queue, body, priority=0):
+        messages, cond = self.broker.queue(queue)
+        with cond:
+            messages.append(body, priority if PRIORITY_QUEUES else 0)
+            cond.notify()
+        return True
+
+    def consume(self, queue, callback):
+        messages, cond = self.broker.queue(queue)
+        self.consuming = True
+        while self.consuming:
+            with cond:
+                while not messages:
+                    cond.wait()
+                body = messages.popleft()
+            callback(body)
+
+    def stop_consuming(self):
+        self.consuming = False
+
+    async def consume_async(self, queue, callback):
+        """
+        Messages already queued are handled right away ; the event loop only
+        hands the wait over to a thread when the queue is empty
+        """
+        loop = asyncio.get_running_loop()
+        self.consuming = True
+        while self.consuming:
+            body = self.get(queue)
+            if body is None:
+                body = await loop.run_in_executor(None, self.wait_get, queue)
+            if body is not None:
+                callback(body)
+            await asyncio.sleep(0)      # let other tasks run between messages
+
+    def wait_get(self, queue, timeout=MEMORY_WAIT_TIMEOUT):
+        """
+        Blocking read on queue, giving up after timeout seconds.
+        Returns:
+            the body of the first message waiting on queue, None if none came
+        """
+        messages, cond = self.broker.queue(queue)
+        with cond:
+            if not messages:
+                cond.wait(timeout)
+            return messages.popleft() if messages else None
+
+    def get(self, queue):
+        messages, cond = self.broker.queue(queue)
+        with cond:
+            return messages.popleft() if messages else None
+
+    def subscribe(self, queue, prefetch=PREFETCH_COUNT):
+        self.subscribed = queue
+        self.prefetch = prefetch
+
+    def receive(self, timeout=None):
+        """
+        Moves up to prefetch messages to the inbox at each lock acquisition
+        """
+        if not self.inbox:
+            messages, cond = self.broker.queue(self.subscribed)
+            with cond:
+                if timeout is None:
+                    while not messages:
+                        cond.wait()
+                elif not messages and timeout > 0:
+                    cond.wait(timeout)
+                for _ in range(min(self.prefetch, len(messages))):
+                    self.inbox.append(messages.popleft())
+        return self.inbox.popleft() if self.inbox else None
+
+    def unsubscribe(self):
+        left = list(self.inbox)
+        self.inbox.clear()
+        self.subscribed = None
+        return left
+
+
+DEFAULT_BROKER = MemoryBroker()
+DEFAULT_POOL = ConnectionPool()
+
+
+def make_transport(kind=TRANSPORT):
+    """
+    Returns a new transport of the given kind (AMQP or MEMORY). With
+    SHARED_CONNECTIONS, AMQP transports are channels of the process wide
+    connection pool
+    """
+    if kind == AMQP and SHARED_CONNECTIONS:
+        return DEFAULT_POOL.transport()
+    if kind == AMQP:
+        return PikaTransport()
+    elif kind == MEMORY:
+        return MemoryTransport()
+    raise ValueError("Unknown transport : %s" % kind)
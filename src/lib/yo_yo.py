@@ -13,16 +13,28 @@ from lib.constants import *
 def yo_yo(node):
     """
     yoyo algorithm for leader election in a graph.
-    The result is actually stored in node.role (LEADER or not)
+    The result is actually stored in node.role (LEADER or not), and the
+    number of rounds the node took part in in node.yo_yo_rounds
     """
     # Create oriented edges with neighbors
-    node.edges = {v: IN if v < node.my_id else OUT for v in node.neighbors_ids}
+    node.edges = EdgeStates(
+        {v: IN if v < node.my_id else OUT for v in node.neighbors_ids}
+    )
     # Determine one's role in the resulting DAG
     get_role(node)
+    node.yo_yo_rounds = 0
     while (node.role != PRUNED and node.role != LEADER):
         # yo- phase, then -yo (oy) phase
+        node.tracer.begin("yo-yo round", round=node.yo_yo_rounds,
+                          role=node.role)
+        node.tracer.begin("yo-")
         yo_phase(node)
+        node.tracer.end("yo-")
+        node.tracer.begin("-yo")
         oy_phase(node)
+        node.tracer.end("-yo")
+        node.tracer.end("yo-yo round")
+        node.yo_yo_rounds += 1
 
 
 # YO- PHASE _____________________________________________________________
@@ -33,12 +45,12 @@ def yo_phase(node):
     # gather ids from in edges (and include my_id for sources)
     node.id_received = {None: node.my_id}
     for v in in_edges(node):
-        node.recv_msg(node.yoyo_recv_id_callback)
+        node.recv_msg(YO_PHASE, node.yoyo_recv_id_callback)
 
     # send smaller id received (or my_id if node is source) on out edges
     node.min_id_recv = min(node.id_received.values())
     for v in out_edges(node):
-        node.send_msg([node.my_id, node.min_id_recv], v)
+        node.send_msg([node.my_id, node.min_id_recv], v, YO_PHASE)
 
 
 # -YO PHASE _______________________________________________________________
@@ -47,7 +59,7 @@ def oy_phase(node):
     -YO phase of the YO-YO algorithm
     """
     node.yes_no_received = dict()
-    node.edges_to_flip = []
+    node.edges_to_flip = set()
     ids_already_sent = set()
 
     if node.role == SINK:
@@ -66,22 +78,22 @@ def oy_phase(node):
 
             # send yes/no and prune/not_prune on all in_edges
             if node.id_received[v] == node.min_id_recv:
-                node.send_msg([node.my_id, YES, prune_or_not], v)
+                node.send_msg([node.my_id, YES, prune_or_not], v, OY_PHASE)
             else:
-                node.send_msg([node.my_id, NO, prune_or_not], v)
-                node.edges_to_flip += [v]
+                node.send_msg([node.my_id, NO, prune_or_not], v, OY_PHASE)
+                node.edges_to_flip.add(v)
 
     elif node.role == INTERMEDIATE:
         # gather answers from all out edges
         for v in out_edges(node):
-            node.recv_msg(node.oy_oy_callback)
+            node.recv_msg(OY_PHASE, node.oy_oy_callback)
 
         # node could have become a leaf after receiving answers (from pruning)
         if is_leaf(node):
             prune_or_not = PRUNE_OUR_LINK
             node.role = PRUNED
             for v in in_edges(node):
-                node.send_msg([node.my_id, YES, prune_or_not], v)
+                node.send_msg([node.my_id, YES, prune_or_not], v, OY_PHASE)
                 node.edges[v] = PRUNED
 
         # if all votes are YES
@@ -98,10 +110,14 @@ def oy_phase(node):
                     ids_already_sent.add(node.id_received[v])
                 # should I yes or should I no ? (ok, easy one)
                 if node.id_received[v] == node.min_id_recv:
-                    node.send_msg([node.my_id, YES, prune_or_not], v)
+                    node.send_msg(
+                        [node.my_id, YES, prune_or_not], v, OY_PHASE
+                    )
                 else:
-                    node.send_msg([node.my_id, NO, prune_or_not], v)
-                    node.edges_to_flip += [v]
+                    node.send_msg(
+                        [node.my_id, NO, prune_or_not], v, OY_PHASE
+                    )
+                    node.edges_to_flip.add(v)
 
         else:
             # at least one upcoming vote was no : send no to everyone, the best
@@ -112,49 +128,90 @@ def oy_phase(node):
                     node.edges[v] = PRUNED
                 else:
                     prune_or_not = DONT_PRUNE_OUR_LINK
-                node.send_msg([node.my_id, NO, prune_or_not], v)
-                node.edges_to_flip += [v]
+                node.send_msg([node.my_id, NO, prune_or_not], v, OY_PHASE)
+                node.edges_to_flip.add(v)
 
     else:  # node.role == SOURCE
         # gather answers from all out_edges
         for v in out_edges(node):
-            node.recv_msg(node.oy_oy_callback)
+            node.recv_msg(OY_PHASE, node.oy_oy_callback)
 
     flip_edges(node)
 
 
-# YO-YO UTILS _____________________________________________________________
+# EDGE STATES _____________________________________________________________
+
+class EdgeStates:
+    """
+    The state (IN, OUT or PRUNED) of a node's edges, indexed by neighbor.
+    The sets of in and out edges are kept up to date on each change, so
+    that roles and leaves are found in O(1), even for nodes of high degree.
+    """
+    def __init__(self, states):
+        """
+        Args:
+            states: dict, {neighbor: IN, OUT or PRUNED}
+        """
+        self.states = dict()
+        self.ins = set()
+        self.outs = set()
+        for v in states:
+            self[v] = states[v]
+
+    def __getitem__(self, v):
+        return self.states[v]
+
+    def __setitem__(self, v, state):
+        self.ins.discard(v)
+        self.outs.discard(v)
+        if state == IN:
+            self.ins.add(v)
+        elif state == OUT:
+            self.outs.add(v)
+        self.states[v] = state
+
+    def __iter__(self):
+        return iter(self.states)
+
+    def __len__(self):
+        return len(self.states)
+
+    def flip(self, vs):
+        """
+        Flips the orientation of the edges to the neighbors vs, pruned
+        edges excepted
+        """
+        for v in vs:
+            state = self.states[v]
+            if state == IN:
+                self[v] = OUT
+            elif state == OUT:
+                self[v] = IN
 
-def active_edges(node):
-    """
-    Returns the list of node's edges which have not been pruned yet
-    """
-    return [v for v in node.edges if node.edges[v] != PRUNED]
 
+# YO-YO UTILS _____________________________________________________________
 
 def out_edges(node):
     """
     Returns the list of node's out edges
     """
-    return [v for v in active_edges(node) if node.edges[v] == OUT]
+    return list(node.edges.outs)
 
 
 def in_edges(node):
     """
-    Returns the list of node's in edges
+    Returns the list of node's in edges, by increasing neighbor id : when
+    several in edges bring the same id, the one kept is the first, from the
+    smallest neighbor (the choice yo_yo_sim.py makes too)
     """
-    return [v for v in active_edges(node) if node.edges[v] == IN]
+    return sorted(node.edges.ins)
 
 
 def flip_edges(node):
     """
     Flips the logical orientation of node's edges which are in edges_to_flip
     """
-    for v in node.edges:
-        if v in node.edges_to_flip and node.edges[v] == IN:
-            node.edges[v] = OUT
-        elif v in node.edges_to_flip and node.edges[v] == OUT:
-            node.edges[v] = IN
+    node.edges.flip(node.edges_to_flip)
     # flipping the edges can modify role in the DAG, so role is recomputed
     get_role(node)
 
@@ -163,18 +220,18 @@ def is_leaf(node):
     """
     Returns true iff node is a sink with exactly one in edge
     """
-    return (len(in_edges(node)) == 1) and (len(out_edges(node)) == 0)
+    return len(node.edges.ins) == 1 and not node.edges.outs
 
 
 def get_role(node):
     """
     Determines own role in the DAG : source, intermediate, sink, pruned, leader
     """
-    if not active_edges(node):
+    if not node.edges.ins and not node.edges.outs:
         node.role = LEADER if node.role == SOURCE else PRUNED
-    elif all([node.edges[e] == IN for e in active_edges(node)]):
+    elif not node.edges.outs:
         node.role = SINK
-    elif all([node.edges[e] == OUT for e in active_edges(node)]):
+    elif not node.edges.ins:
         node.role = SOURCE
     else:
         node.role = INTERMEDIATE
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This file contains a centralized simulator of the yo-yo election, used to
+predict the leader, the number of rounds and the number of messages of an
+election without running the network, and to check yo_yo.py against it.
+The whole graph is handled at once with NumPy : the oriented edges are two
+arrays (tails and heads), and each phase walks the DAG level by level, each
+level being a handful of array operations.
+The rules are the ones of yo_yo.py, including its choices :
+    + a node compares the ids received with its own id
+    + when several in edges bring the same id to a node, the one from the
+      neighbor with the smallest id is kept, the others are pruned
+"""
+
+import numpy as np
+
+from lib.topology import sorted_unique
+
+
+class ElectionStats:
+    def __init__(self):
+        self.leader = None
+        self.rounds = 0
+        # per round : messages of the yo- phase, of the -yo phase, and
+        # number of edges pruned
+        self.yo_messages = []
+        self.oy_messages = []
+        self.pruned = []
+
+    def nb_messages(self):
+        """
+        Returns the total number of messages of the election
+        """
+        return sum(self.yo_messages) + sum(self.oy_messages)
+
+    def __str__(self):
+        return ("leader %s elected in %s rounds, with %s messages"
+                % (self.leader, self.rounds, self.nb_messages()))
+
+
+def out_edges_of(ptr, order, nodes):
+    """
+    Returns the indices of the edges leaving nodes, given the edges sorted
+    by tail (order) and the offsets of each tail in this order (ptr)
+    """
+    counts = ptr[nodes + 1] - ptr[nodes]
+    total = counts.sum()
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    # position of each edge within its tail's block
+    shift = np.repeat(np.cumsum(counts) - counts, counts)
+    return order[np.repeat(ptr[nodes], counts) + np.arange(total) - shift]
+
+
+def yo_yo_round(n, ids, tail, head, stats):
+    """
+    Runs one round (yo- phase, then -yo phase) on the oriented edges
+    tail[e] -> head[e], and records it in stats.
+    Returns:
+        (tail, head), the oriented edges not pruned, after the flips
+    """
+    m = len(tail)
+    indeg = np.bincount(head, minlength=n)
+    outdeg = np.bincount(tail, minlength=n)
+    order = np.argsort(tail, kind='stable')
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(outdeg, out=ptr[1:])
+
+    # yo- phase : from the sources down, each node sends on its out edges
+    # the smallest id among its own and the ones received on its in edges.
+    # The edges are grouped by level of their tail in the DAG
+    val = ids.copy()
+    remaining = indeg.copy()
+    frontier = np.flatnonzero((indeg == 0) & (outdeg > 0))
+    levels = []
+    while len(frontier):
+        e = out_edges_of(ptr, order, frontier)
+        levels.append(e)
+        h = head[e]
+        np.minimum.at(val, h, val[tail[e]])
+        np.subtract.at(remaining, h, 1)
+        frontier = sorted_unique(h[remaining[h] == 0])
+
+    # -yo phase : from the sinks up, each node answers on its in edges
+    received = val[tail]
+    yes = received == val[head]
+    duplicate = np.zeros(m, dtype=bool)
+    s = np.lexsort((ids[tail], received, head))
+    duplicate[s[1:]] = (head[s][1:] == head[s][:-1]) & \
+        (received[s][1:] == received[s][:-1])
+    sink = outdeg == 0
+    nb_no = np.zeros(n, dtype=np.int64)
+    nb_pruned = np.zeros(n, dtype=np.int64)
+    answer = np.zeros(m, dtype=bool)
+    prune = np.zeros(m, dtype=bool)
+    for e in reversed(levels):
+        h = head[e]
+        # a node with a single in edge and no out edge left prunes itself
+        leaf = (indeg[h] == 1) & (nb_pruned[h] == outdeg[h])
+        all_yes = nb_no[h] == 0
+        answer[e] = np.where(leaf, yes[e] | ~sink[h], all_yes & yes[e])
+        prune[e] = leaf | (all_yes & duplicate[e])
+        np.add.at(nb_no, tail[e], ~answer[e])
+        np.add.at(nb_pruned, tail[e], prune[e])
+
+    # a source whose out edges were all pruned is the leader
+    leader = np.flatnonzero((indeg == 0) & (outdeg > 0) &
+                            (nb_pruned == outdeg))
+    if len(leader):
+        stats.leader = int(ids[leader[0]])
+    stats.rounds += 1
+    stats.yo_messages.append(m)
+    stats.oy_messages.append(m)
+    stats.pruned.append(int(prune.sum()))
+
+    # NO answers flip the edges
+    flip = ~answer
+    tail, head = np.where(flip, head, tail), np.where(flip, tail, head)
+    return tail[~prune], head[~prune]
+
+
+def simulate_yo_yo(topology, ids=None, seed=None):
+    """
+    Simulates the yo-yo election on a graph.
+    Args:
+        topology: Topology, the graph (see lib.topology)
+        ids: array, the id of each vertex. A random permutation of 1..n
+             if None
+        seed: int, the random seed of the ids
+    Returns:
+        an ElectionStats
+    """
+    n = len(topology)
+    if ids is None:
+        ids = np.random.default_rng(seed).permutation(n) + 1
+    ids = np.asarray(ids, dtype=np.int64)
+    stats = ElectionStats()
+    if n == 1:
+        stats.leader = int(ids[0])
+        return stats
+
+    # each edge once, from the smaller id to the greater one
+    u = np.repeat(np.arange(n), np.diff(topology.indptr))
+    v = topology.indices
+    once = u < v
+    u, v = u[once], v[once]
+    tail = np.where(ids[u] < ids[v], u, v)
+    head = np.where(ids[u] < ids[v], v, u)
+    while len(tail):
+        tail, head = yo_yo_round(n, ids, tail, head, stats)
+    return stats
@@ -2,13 +2,15 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import pika
-import json
-import random
+
+import numpy as np
 
 from lib.config import *
 from lib.constants import *
-from lib.graph_gen import gen_graph
+from lib.topology import generate, load_edge_list
+from lib.ids import IdAllocator
+from lib.transport import make_transport
+from lib.codec import make_codec
 
 
 # _________________________________________________________________________
@@ -16,16 +18,36 @@ from lib.graph_gen import gen_graph
 # _________________________________________________________________________
 
 class MainLauncher:
-    def __init__(self, n, s):
+    def __init__(self, n, s, transport=None, family=DEFAULT_TOPOLOGY,
+                 seed=DEFAULT_SEED, topology_file=None):
         """
         Args:
             n: int, the number of nodes in the network
             s: int, the number of edges in the network
-        """
-        self.nb_nodes = n
-        self.adjacencies = gen_graph(n, s)
+            transport: Transport, used to talk to the nodes.
+                       A new transport of the configured kind if None
+            family: str, the kind of topology to generate (see lib.topology)
+            seed: int, the random seed of the topology
+            topology_file: str, an edge-list file to load the topology from,
+                           instead of generating it. n, s, family and seed
+                           are then ignored
+        """
+        self.transport = transport if transport is not None \
+            else make_transport()
+        self.codec = make_codec()
+        if topology_file is not None:
+            self.adjacencies = load_edge_list(topology_file)
+            print("Loaded %s vertices and %s edges from %s"
+                  % (self.adjacencies.nb_nodes, self.adjacencies.nb_edges,
+                     topology_file))
+        else:
+            self.adjacencies = generate(family, n, s, seed)
+            print("Generated a %s graph with %s vertices and %s edges "
+                  "(seed %s)" % (family, self.adjacencies.nb_nodes,
+                                 self.adjacencies.nb_edges, seed))
+        self.nb_nodes = len(self.adjacencies)
         self.nodes_id = []
-        self.id_stored = []
+        self.ids = IdAllocator()
 # _________________________________________________________________________
 # _______________________ LAUNCH NETWORK___________________________________
 
@@ -54,22 +76,27 @@ class MainLauncher:
         # job done, exiting
         self.exit_program()
 
+    def setup_network(self):
+        """
+        Collects the nodes ids and sends them their neighbors, without
+        any interaction with the user. The connection must be initialized.
+        """
+        self.collect_nodes_id()
+        self.send_neighbors()
+        self.close()
+
 # _________________________________________________________________________
 # _______________________ INIT CONNECTION _________________________________
 
     def init_connection(self):
         """
-        Initializes Rabbitmq connection and creates a channel to receive
+        Initializes the broker connection and the queue receiving
         the ids from the PikaNodes
         """
-        # init pika connection and channel
-        self.connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host='localhost')
-        )
-        self.channel = self.connection.channel()
-        self.channel.queue_delete(queue=MAIN_Q)
-        self.channel.queue_declare(queue=MAIN_Q)
-        self.channel.confirm_delivery()
+        self.transport.open()
+        self.transport.delete_queue(MAIN_Q)
+        self.transport.declare_queue(MAIN_Q)
+        self.transport.confirm_delivery()
 
 # _________________________________________________________________________
 # _______________________ SEND MSG ________________________________________
@@ -78,14 +105,10 @@ class MainLauncher:
         """
         Sends a message on a queue
         Args:
-            msg: json str, the message to send
+            msg: str or bytes, the encoded message to send
             queue_name: str, the queue to send it on
         """
-        if not self.channel.basic_publish(
-            exchange='',
-            routing_key=queue_name,
-            body=msg
-        ):                      # unhappy smiley because it's a failure case
+        if not self.transport.publish(queue_name, msg):
             self.handle_msg_not_send(msg, queue_name)
 
     def handle_msg_not_send(self, msg, queue_name):
@@ -100,51 +123,42 @@ class MainLauncher:
         """
         Collects the identifiers from all nodes on the network
         """
-        for method_f, pr, body in self.channel.consume(MAIN_Q):
-            # ack
-            self.channel.basic_ack(method_f.delivery_tag)
-
-            # check if id already here, replace if needed
-            node_id = new_node_id = json.loads(body)
-            if node_id in self.id_stored:
-                new_node_id = self.choose_new_id()
-
-            # store
-            self.id_stored += [new_node_id]
-            self.nodes_id += [(node_id, new_node_id)]
+        self.transport.consume(MAIN_Q, self.collect_id_callback)
 
-            # exit loop once enough ids have been collected
-            if len(self.nodes_id) == self.nb_nodes:
-                break
-
-    def choose_new_id(self):
+    def collect_id_callback(self, body):
         """
-        Generates a random number which is not in self.nodes_id list
+        Stores the id sent by a node, replacing it if already taken
         """
-        rng = random.SystemRandom()
-        new_id = rng.randrange(RANDOM_START, RANDOM_END)
-        while new_id in self.id_stored:
-            new_id = rng.randrange(RANDOM_START, RANDOM_END)
-        return new_id
+        node_id = self.codec.decode(body)
+        new_node_id = self.ids.register(node_id)
+        self.nodes_id.append((node_id, new_node_id))
+
+        # stop consuming once enough ids have been collected
+        if len(self.nodes_id) == self.nb_nodes:
+            self.transport.stop_consuming()
 
 # _________________________________________________________________________
 # _______________________ SEND NEIGHBORS IDS ______________________________
 
     def send_neighbors(self):
         """
-        Sends to each PikaNode in the network the list of its neighbors' id
+        Sends to each PikaNode in the network the list of its neighbors' id.
+        All messages are handed to the transport as a single batch, which
+        also declares the nodes' queues, so that they can be pipelined
         """
-        for i, v in enumerate(self.nodes_id):
-            node_id, new_node_id = v
+        new_ids = np.array([new_node_id for _, new_node_id in self.nodes_id])
+        messages = []
+        for i, (node_id, new_node_id) in enumerate(self.nodes_id):
             # get the list of neighbors' ids
-            neighbors = [self.nodes_id[j][1] for j in self.adjacencies[i]]
+            neighbors = new_ids[self.adjacencies[i]].tolist()
 
-            # create a dedicated queue
+            # each node has a dedicated queue
             send_queue = QUEUE_PREFIX + str(node_id) + "__main_q"
-            self.channel.queue_declare(send_queue)
-
             msg = {ID: new_node_id, NEIGHBORS: neighbors}
-            self.send_msg(json.dumps(msg), send_queue)
+            messages.append((send_queue, self.codec.encode(msg)))
+
+        for queue_name, msg in self.transport.publish_batch(messages, True):
+            self.handle_msg_not_send(msg, queue_name)
 
 # _________________________________________________________________________
 # _______________________ EXIT PROGRAM ____________________________________
@@ -154,16 +168,53 @@ class MainLauncher:
         Close the connection and exits
         """
         print("Exiting")
-        self.channel.queue_delete(queue=MAIN_Q)
-        self.connection.close()
+        self.close()
         sys.exit()
 
+    def close(self):
+        """
+        Deletes the main queue and closes the connection
+        """
+        self.transport.delete_queue(MAIN_Q)
+        self.transport.close()
+
+    def delete_nodes_queues(self):
+        """
+        Deletes the queues of the nodes, on a new connection, once they are
+        all stopped : a node stopped during its setup may have declared the
+        queue of a neighbor after the neighbor deleted it
+        """
+        self.transport.open()
+        for node_id, new_node_id in self.nodes_id:
+            self.transport.delete_queue(
+                QUEUE_PREFIX + str(node_id) + "__main_q"
+            )
+            self.transport.delete_queue(QUEUE_PREFIX + str(new_node_id) + "__")
+        self.close()
+
 
 # _________________________________________________________________________
 # _______________________ MAIN ____________________________________________
 
+def make_launcher(argv):
+    """
+    Returns the MainLauncher of the command line arguments :
+    [n] [s] [family] [seed], or an edge-list file. Exits with the reason if
+    the topology can not be built (too many edges, disconnected file, ...)
+    """
+    try:
+        if len(argv) > 1 and not argv[1].isdigit():
+            # python main.py edges.txt
+            return MainLauncher(0, 0, topology_file=argv[1])
+        n = int(argv[1]) if len(argv) > 1 else DEFAULT_MATRIX_SIZE
+        s = int(argv[2]) if len(argv) > 2 else 0
+        family = argv[3] if len(argv) > 3 else DEFAULT_TOPOLOGY
+        seed = int(argv[4]) if len(argv) > 4 else DEFAULT_SEED
+        return MainLauncher(n, s, family=family, seed=seed)
+    except (ValueError, OSError) as e:
+        print("Cannot build the network : %s" % e)
+        sys.exit(1)
+
+
 if __name__ == "__main__":
-    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MATRIX_SIZE
-    s = int(sys.argv[2]) if len(sys.argv) > 2 else 0
-    launcher = MainLauncher(n, s)
-    launcher.launch_network()
+    make_launcher(sys.argv).launch_network()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Merges the trace files written by the nodes (see TRACE_FILE in config.py)
+into a single Chrome trace, to be opened in chrome://tracing or Perfetto.
+Each node becomes a process of the timeline, named after its id, and times
+start at the first event of the cluster. The last node to finish each phase
+(the straggler) is printed.
+Run from /src/ with `python merge_traces.py merged.json trace_*.json`
+"""
+
+import sys
+import json
+
+PHASES = ("election", "shout", "ring")
+
+
+def merge_traces(paths):
+    """
+    Returns:
+        dict, the merged trace
+    """
+    traces = []
+    for path in paths:
+        with open(path) as f:
+            traces.append(json.load(f))
+    traces.sort(key=lambda trace: trace["otherData"]["node"])
+    t0 = min((e["ts"] for trace in traces for e in trace["traceEvents"]),
+             default=0)
+
+    events = []
+    for pid, trace in enumerate(traces, 1):
+        node_id = trace["otherData"]["node"]
+        # node ids may not fit in the pids of the viewers
+        events.append({"name": "process_name", "ph": "M", "pid": pid,
+                       "tid": 0, "args": {"name": "node %s" % node_id}})
+        for event in trace["traceEvents"]:
+            event["pid"] = pid
+            event["ts"] -= t0
+            events.append(event)
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def stragglers(trace):
+    """
+    Returns:
+        dict, {phase: (end of the phase in ms, process name of the last
+        node to finish it)}
+    """
+    names = {e["pid"]: e["args"]["name"] for e in trace["traceEvents"]
+             if e["ph"] == "M"}
+    last = dict()
+    for e in trace["traceEvents"]:
+        if e["ph"] == "E" and e["name"] in PHASES:
+            if e["name"] not in last or e["ts"] > last[e["name"]][0] * 1e3:
+                last[e["name"]] = (e["ts"] / 1e3, names[e["pid"]])
+    return last
+
+
+def main(argv):
+    if len(argv) < 3:
+        print("Usage : python merge_traces.py merged.json trace_1.json ...")
+        return
+    trace = merge_traces(argv[2:])
+    with open(argv[1], 'w') as f:
+        json.dump(trace, f)
+    print("%s nodes merged into %s" % (len(argv) - 2, argv[1]))
+    last = stragglers(trace)
+    for phase in PHASES:
+        if phase in last:
+            print("%-9s done at %9.1fms, last : %s"
+                  % (phase, last[phase][0], last[phase][1]))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,7 +1,6 @@
 import sys
-import random
 
-from lib.config import RANDOM_START, RANDOM_END
+from lib.ids import random_id
 from lib.pika_node import PikaNode
 
 
@@ -13,8 +12,7 @@ def run_pika_node(my_id):
                if my_id is None, then a random number is picked
     """
     if my_id is None:
-        rng = random.SystemRandom()
-        my_id = rng.randrange(RANDOM_START, RANDOM_END)
+        my_id = random_id()
     node = PikaNode(my_id)
     node.launch()
 
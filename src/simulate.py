@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import random
+import threading
+
+from lib.config import DEFAULT_MATRIX_SIZE, DEFAULT_TOPOLOGY, DEFAULT_SEED
+from lib.constants import LEADER, NODE_STACK_SIZE
+from lib.pika_node import PikaNode
+from lib.transport import MemoryBroker, MemoryTransport
+from main import MainLauncher
+
+
+def simulate(n, s, family=DEFAULT_TOPOLOGY, seed=DEFAULT_SEED):
+    """
+    Runs a whole network (main launcher and n PikaNodes) as threads of this
+    process, on an in-memory broker. Election, shout and ring construction
+    are run, then the simulation stops.
+    Args:
+        n: int, the number of nodes in the network
+        s: int, the number of edges in the network
+        family: str, the kind of topology (see lib.topology)
+        seed: int, the random seed of the topology
+    Returns:
+        the list of PikaNodes, once the ring is set up on all of them
+    """
+    threading.stack_size(NODE_STACK_SIZE)
+    broker = MemoryBroker()
+
+    launcher = MainLauncher(n, s, MemoryTransport(broker), family, seed)
+    launcher.init_connection()
+    threads = [threading.Thread(target=launcher.setup_network)]
+
+    nodes = []
+    for my_id in random.sample(range(1, n+1), n):
+        node = PikaNode(my_id, MemoryTransport(broker), interactive=False)
+        nodes += [node]
+        threads += [threading.Thread(target=node.setup_network)]
+
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    leader = next(node for node in nodes if node.role == LEADER)
+    print("%s nodes set up in %.2fs, the leader is %s"
+          % (n, elapsed, leader.my_id))
+    return nodes
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MATRIX_SIZE
+    s = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    simulate(n, s)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the message codecs (lib/codec.py).
+Run from /src/ with `python -m pytest tests`
+"""
+
+import pytest
+
+from lib.constants import *
+from lib.codec import JsonCodec, BinaryCodec, CodecError, BINARY_VERSION
+from lib.codec import T_STR, T_INT32, T_LIST
+
+MESSAGES = [
+    None, True, False, 0, -1, 2**31 - 1, -2**31, 2**31, -2**63, 2**63 - 1,
+    "", "hello", "héllo ☃", YO_PHASE, [], [1, 2, 3],
+    [1, 2**40, -5], [-2**63, 2**63 - 1], [True, 1, None], ["a", [YES, 3]],
+    {ID: 12, NEIGHBORS: [3, 4, 5]},
+    [SHOUT, {TYPE: RING_MSG, BODY: "hi", RECEIVER: 2**62, SEQ: None,
+             LAST: True}],
+]
+
+
+@pytest.mark.parametrize("codec", [JsonCodec(), BinaryCodec()])
+@pytest.mark.parametrize("msg", MESSAGES)
+def test_round_trip(codec, msg):
+    assert codec.decode(codec.encode(msg)) == msg
+
+
+@pytest.mark.parametrize("codec", [JsonCodec(), BinaryCodec()])
+def test_batch(codec):
+    msgs = [[YO_PHASE, 5], [SHOUT, {ID: 1}], [RING, "x"]]
+    body = codec.encode_batch([codec.encode(m) for m in msgs])
+    assert codec.decode(body) == [BATCH, msgs]
+
+
+@pytest.mark.parametrize("value", [2**63, -2**63 - 1, 10**30,
+                                   [1, 2**64], [-2**70, 3]])
+def test_int_out_of_range(value):
+    with pytest.raises(CodecError):
+        BinaryCodec().encode(value)
+
+
+def test_unknown_type():
+    with pytest.raises(CodecError):
+        BinaryCodec().encode({1, 2})
+
+
+def test_truncated_bodies():
+    codec = BinaryCodec()
+    body = codec.encode([ID, 2**40, "some text", [1, 2, 3]])
+    for end in range(1, len(body)):
+        with pytest.raises(CodecError):
+            codec.decode(body[:end])
+
+
+@pytest.mark.parametrize("body", [
+    b"",
+    bytes([BINARY_VERSION + 1, T_INT32, 0, 0, 0, 1]),
+    bytes([BINARY_VERSION, 250]),
+    bytes([BINARY_VERSION, T_STR, 0, 0, 0, 2, 0xff, 0xfe]),
+    bytes([BINARY_VERSION, T_LIST, 0, 0, 0, 1, T_STR, 0, 0, 0, 1, 0x80]),
+])
+def test_invalid_bodies(body):
+    with pytest.raises(CodecError):
+        BinaryCodec().decode(body)
+
+
+@pytest.mark.parametrize("data", [b"", b"\x00\xff" * 100, bytearray(b"ab")])
+def test_bytes(data):
+    codec = BinaryCodec()
+    msg = [REFLUX, 12, data]
+    assert codec.decode(codec.encode(msg)) == [REFLUX, 12, bytes(data)]
+    body = codec.encode(data)
+    with pytest.raises(CodecError):
+        codec.decode(body[:-1] if data else body[:-2])
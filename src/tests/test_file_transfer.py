@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the file transfers on the ring (lib/pika_node.py) : the sender
+stops sending when the receiver loses a chunk, or does not exist.
+Run from /src/ with `python -m pytest tests`
+"""
+
+from lib.constants import *
+from lib.config import FILE_CHUNK_SIZE
+from tests.test_make_ring import ring_network, ring_order
+
+
+def run(nodes, send_chunks=True):
+    """
+    Runs the nodes until their messages are handled. Chunks are not sent
+    if not send_chunks, since sender and receiver would use the same file
+    """
+    for _ in range(4 * len(nodes)):
+        for x in nodes:
+            if send_chunks:
+                x.send_file_chunks()
+            x.flush_outbox()
+            x.get_msg_non_blocking()
+
+
+def test_lost_chunk_aborts_the_transfer(tmp_path):
+    path = tmp_path / "sent"
+    path.write_bytes(b"x" * 100 * FILE_CHUNK_SIZE)
+    nodes = ring_network()
+    sender, receiver = nodes[:2]
+    sender.ring_send_file(str(path), receiver.my_id)
+    assert len(sender.outgoing_files) == 1
+
+    # chunk 3 arrives for a transfer the receiver does not know
+    receiver.write_file_chunk({SENDER: sender.my_id, FILENAME: str(path),
+                               SEQ: 3, BODY: "", LAST: False})
+    run(nodes, send_chunks=False)
+    assert sender.outgoing_files == []
+    assert sender.metrics.ring[(RING_FILE_ACK, "open")] >= 1
+
+
+def test_notices_of_unknown_transfers_are_ignored():
+    nodes = ring_network()
+    sender, receiver = nodes[:2]
+    receiver.send_on_ring(RING_FILE_ACK, None, sender.my_id, "unknown")
+    run(nodes)
+    assert sender.outgoing_files == []
+    assert sender.metrics.ring[(RING_FILE_ACK, "open")] == 1
+
+
+def test_bounced_chunks_abort_the_transfer(tmp_path):
+    path = tmp_path / "sent"
+    path.write_bytes(b"x" * 100 * FILE_CHUNK_SIZE)
+    nodes = ring_network()
+    order = ring_order(nodes)
+    missing = 10 * len(nodes) + 3
+    home = order[missing % len(nodes)]
+    sender = next(x for x in nodes if x.my_id != home)
+
+    sender.ring_send_file(str(path), missing)
+    run(nodes)
+    assert sender.outgoing_files == []
+    assert sender.metrics.ring[(RING_FILE, "bounce")] >= 1
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the allocation of ids (lib/ids.py) : scramble_id is a bijection,
+and the ids handed out by IdAllocator are distinct, even when nodes propose
+taken ids.
+Run from /src/ with `python -m pytest tests`
+"""
+
+import pytest
+
+from lib.ids import IdAllocator, scramble_id
+
+
+@pytest.mark.parametrize("bits", [1, 2, 7, 12, 16])
+def test_scramble_id_is_a_bijection(bits):
+    images = {scramble_id(i, bits) for i in range(2 ** bits)}
+    assert images == set(range(2 ** bits))
+
+
+def test_scramble_id_spreads_successive_values():
+    images = [scramble_id(i, 63) for i in range(1, 100)]
+    assert len(set(images)) == len(images)
+    assert sum(x >= 2 ** 62 for x in images) > 20
+
+
+def test_free_ids_are_kept():
+    allocator = IdAllocator(10, 20)
+    assert [allocator.register(i) for i in range(10, 20)] == \
+        list(range(10, 20))
+
+
+def test_taken_ids_are_replaced_by_free_ones():
+    allocator = IdAllocator(100, 150)
+    ids = [allocator.register(123) for _ in range(50)]
+    assert ids[0] == 123
+    assert sorted(ids) == list(range(100, 150))
+    with pytest.raises(ValueError):
+        allocator.register(123)
+
+
+def test_proposals_collide_with_the_counter():
+    # nodes propose the very ids the counter hands out next
+    allocator = IdAllocator(0, 64)
+    upcoming = [scramble_id(i, allocator.bits) for i in range(64)]
+    ids = []
+    for proposed in upcoming[:32]:
+        ids.append(allocator.register(proposed))
+        ids.append(allocator.register(proposed))
+    assert len(set(ids)) == len(ids) == 64
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the ring lanes (PikaNode.handle_ring_msgs, and the priorities of
+the in-memory broker) : chat messages overtake the file chunks received
+before them, and without PRIORITY_QUEUES the broker keeps FIFO order.
+Run from /src/ with `python -m pytest tests`
+"""
+
+import pytest
+
+import lib.pika_node as pika_node
+import lib.transport as transport
+from lib.constants import *
+from lib.pika_node import PikaNode
+from lib.transport import MemoryBroker, MemoryTransport
+
+
+@pytest.fixture
+def node(monkeypatch):
+    node = PikaNode(1, MemoryTransport(MemoryBroker()), interactive=False)
+    node.handled = []
+    node.ring_callback = lambda msg: node.handled.append(msg)
+    return node
+
+
+def test_interactive_messages_overtake_bulk(node, monkeypatch):
+    monkeypatch.setattr(pika_node, "INTERACTIVE_WEIGHT", 3)
+    monkeypatch.setattr(pika_node, "BULK_WEIGHT", 1)
+    node.mailboxes[RING_BULK].extend("chunk %s" % i for i in range(4))
+    node.mailboxes[RING_INTERACTIVE].extend("chat %s" % i for i in range(7))
+    node.mailboxes[RING].append("route")
+    node.handle_ring_msgs()
+
+    assert node.handled == [
+        "route",
+        "chat 0", "chat 1", "chat 2", "chunk 0",
+        "chat 3", "chat 4", "chat 5", "chunk 1",
+        "chat 6", "chunk 2",
+        "chunk 3",
+    ]
+
+
+def test_bulk_is_not_starved(node):
+    node.mailboxes[RING_BULK].append("chunk")
+    node.mailboxes[RING_INTERACTIVE].extend(
+        "chat %s" % i for i in range(10 * pika_node.INTERACTIVE_WEIGHT)
+    )
+    node.handle_ring_msgs()
+    assert node.handled.index("chunk") == pika_node.INTERACTIVE_WEIGHT
+
+
+@pytest.mark.parametrize("priority_queues", [True, False])
+def test_broker_delivers_higher_lanes_first(node, monkeypatch,
+                                            priority_queues):
+    monkeypatch.setattr(transport, "PRIORITY_QUEUES", priority_queues)
+    node.out_queue[2] = "to_2"
+    node.send_msg("chunk 0", 2, RING_BULK)
+    node.send_msg("chat", 2, RING_INTERACTIVE)
+    node.send_msg("chunk 1", 2, RING_BULK)
+    node.send_msg("route", 2, RING)
+
+    receiver = PikaNode(2, MemoryTransport(node.transport.broker),
+                        interactive=False)
+    received = []
+    body = receiver.transport.get("to_2")
+    while body is not None:
+        received.append(receiver.codec.decode(body)[1])
+        body = receiver.transport.get("to_2")
+    if priority_queues:
+        assert received == ["route", "chat", "chunk 0", "chunk 1"]
+    else:
+        assert received == ["chunk 0", "chat", "chunk 1", "route"]
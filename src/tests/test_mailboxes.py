@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the mailboxes (PikaNode.recv_msg) : a message of a later phase,
+received while the node waits for its current phase, waits in its mailbox
+and is handled in order once that phase starts.
+Run from /src/ with `python -m pytest tests`
+"""
+
+from lib.constants import *
+from lib.pika_node import PikaNode
+from lib.transport import MemoryBroker, MemoryTransport
+
+
+def test_later_phases_wait_in_their_mailbox():
+    broker = MemoryBroker()
+    node = PikaNode(1, MemoryTransport(broker), interactive=False)
+    node.transport.subscribe(node.in_queue)
+    neighbor = PikaNode(2, MemoryTransport(broker), interactive=False)
+    neighbor.out_queue[1] = node.in_queue
+
+    # a neighbor already in the shout phase, another still in yo-yo
+    neighbor.send_msg("shout 0", 1, SHOUT)
+    neighbor.send_msg("shout 1", 1, SHOUT)
+    neighbor.send_msg("yo", 1, YO_PHASE)
+    neighbor.send_msg("shout 2", 1, SHOUT)
+
+    handled = []
+    node.recv_msg(YO_PHASE, handled.append)
+    assert handled == ["yo"]
+    assert list(node.mailboxes[SHOUT]) == ["shout 0", "shout 1"]
+
+    # the shout phase starts : waiting messages first, in order, then the
+    # ones still on the queue
+    for _ in range(3):
+        node.recv_msg(SHOUT, handled.append)
+    assert handled == ["yo", "shout 0", "shout 1", "shout 2"]
+    assert node.transport.receive(0) is None
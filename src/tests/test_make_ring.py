@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the central ring construction (lib/make_ring.py) : the entries
+sent down the shout tree, the ring they make on simulated networks, how
+messages find their way on it, and the distributed ring construction.
+Run from /src/ with `python -m pytest tests`
+"""
+
+import random
+import types
+
+import pytest
+
+import lib.make_ring as make_ring
+import lib.pika_node as pika_node
+import lib.shout as shout
+from lib.constants import *
+from simulate import simulate
+
+N = 40
+
+
+def ring_network(n=N, seed=0, family=ERDOS_RENYI):
+    random.seed(seed)
+    return simulate(n, 2 * n, family, seed)
+
+
+def ring_order(nodes):
+    """
+    Returns the ids of the nodes in the order of the ring, from the leader
+    """
+    by_id = {x.my_id: x for x in nodes}
+    order = [next(x.my_id for x in nodes if x.role == LEADER)]
+    while len(order) < len(nodes):
+        order.append(by_id[order[-1]].route_right[-1])
+    return order
+
+
+def exchange(nodes, pairs):
+    """
+    Sends a chat message for each (sender, receiver) of pairs, and runs the
+    nodes until the messages are handled.
+    Returns:
+        list, the (receiver, packet) of the messages opened
+    """
+    by_id = {x.my_id: x for x in nodes}
+    opened = []
+    for x in nodes:
+        x.open_msg = (lambda u: lambda msg: opened.append((u, msg)))(x.my_id)
+    for sender, receiver in pairs:
+        by_id[sender].send_on_ring(RING_MSG, "hello", receiver)
+    for _ in range(4 * len(nodes)):
+        for x in nodes:
+            x.flush_outbox()
+            x.get_msg_non_blocking()
+    return opened
+
+
+def test_pass_ring_bundle_splits_subtrees(monkeypatch):
+    stored = []
+    monkeypatch.setattr(make_ring, "set_ring_entry",
+                        lambda node, nb, length, positions, entry:
+                        stored.append(entry))
+    sent = []
+    node = types.SimpleNamespace(
+        shout_children=[5, 2],
+        send_msg=lambda msg, receiver, mailbox: sent.append(
+            (receiver, mailbox, msg)
+        )
+    )
+    # preorder of the subtree of 1 : 1, then 2 (with 3 and 4), then 5
+    # (with 6)
+    bundle = [[1, "a"], [2, "b"], [3, "c"], [4, "d"], [5, "e"], [6, "f"]]
+    make_ring.pass_ring_bundle(node, [6, 9, None, bundle])
+
+    assert stored == [[1, "a"]]
+    assert sent == [
+        (2, BROADCAST, [6, 9, None, [[2, "b"], [3, "c"], [4, "d"]]]),
+        (5, BROADCAST, [6, 9, None, [[5, "e"], [6, "f"]]]),
+    ]
+
+
+def test_leaf_keeps_its_entry(monkeypatch):
+    stored = []
+    monkeypatch.setattr(make_ring, "set_ring_entry",
+                        lambda node, nb, length, positions, entry:
+                        stored.append(entry))
+    node = types.SimpleNamespace(shout_children=[], send_msg=None)
+    make_ring.pass_ring_bundle(node, [1, 0, None, [[7, "g"]]])
+    assert stored == [[7, "g"]]
+
+
+@pytest.mark.parametrize("family", [ERDOS_RENYI, BARABASI_ALBERT, GRID])
+@pytest.mark.parametrize("seed", range(2))
+def test_ring_goes_through_all_nodes(family, seed):
+    nodes = ring_network(seed=seed, family=family)
+    by_id = {x.my_id: x for x in nodes}
+    leader = next(x for x in nodes if x.role == LEADER)
+
+    order = [leader.my_id]
+    while True:
+        right = by_id[order[-1]].route_right
+        if right[-1] == leader.my_id:
+            break
+        order.append(right[-1])
+        assert len(order) <= len(nodes)
+    assert sorted(order) == sorted(by_id)
+    # the left route of a node leads back to the previous one
+    for previous, u in zip(order, order[1:] + order[:1]):
+        assert by_id[u].route_left[-1] == previous
+
+
+def test_entries_go_down_the_shout_tree():
+    nodes = ring_network()
+    for x in nodes:
+        expected = 0 if x.role == LEADER else 1
+        assert x.metrics.received.get(BROADCAST, 0) == expected
+
+
+def test_tree_path_goes_through_lowest_common_ancestor():
+    #      0
+    #    1   2
+    #   3 4   5
+    parents = {0: None, 1: 0, 2: 0, 3: 1, 4: 1, 5: 2}
+    depth = {0: 0, 1: 1, 2: 1, 3: 2, 4: 2, 5: 2}
+    tree = (parents, depth)
+    assert make_ring.tree_path(tree, 3, 4) == [1, 4]
+    assert make_ring.tree_path(tree, 3, 5) == [1, 0, 2, 5]
+    assert make_ring.tree_path(tree, 5, 0) == [2, 0]
+    assert make_ring.tree_path(tree, 0, 4) == [1, 4]
+    assert make_ring.tree_path(tree, 2, 2) == []
+
+
+def test_ring_path_follows_and_shortcuts_ring_routes():
+    ring = [[0, 1, 2], [2, 3], [3, 1, 4], [4, 0]]
+    assert make_ring.ring_path(ring, 0, 1) == [1, 2]
+    assert make_ring.ring_path(ring, 1, 3) == [3, 1, 4]
+    # 0 -> 1 -> 2 -> 3 -> 1 -> 4 goes through 1 twice
+    assert make_ring.ring_path(ring, 0, 3) == [1, 4]
+    assert make_ring.ring_path(ring, 2, 2) == []
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_fingers_lead_to_their_nodes(seed):
+    nodes = ring_network(seed=seed)
+    leader = next(x for x in nodes if x.role == LEADER)
+    by_id = {x.my_id: x for x in nodes}
+    order = ring_order(nodes)
+
+    for i, u in enumerate(order):
+        distances = [finger[0] for finger in by_id[u].fingers]
+        assert distances == [2 ** k for k in range(len(distances))]
+        assert distances[-1] < len(nodes) <= 2 * distances[-1]
+        for distance, route in by_id[u].fingers:
+            # each route is a walk in the graph ending on the finger
+            assert route[-1] == order[(i + distance) % len(nodes)]
+            for a, b in zip([u] + route, route):
+                assert b in leader.graph[a]
+
+
+def test_nodes_know_their_homed_ids_and_fingers():
+    nodes = ring_network()
+    order = ring_order(nodes)
+    index = {u: i for i, u in enumerate(order)}
+    for x in nodes:
+        assert x.ring_index == index[x.my_id]
+        assert x.ring_size == len(nodes)
+        for u, (i, _) in x.ring_position.items():
+            assert i == index[u]
+        homed = [u for u in order if u % len(nodes) == x.ring_index]
+        assert set(homed) <= set(x.ring_position)
+        for distance, _ in x.fingers:
+            assert order[(x.ring_index + distance) % len(nodes)] \
+                in x.ring_position
+
+
+def test_messages_reach_unknown_receivers_through_their_home():
+    nodes = ring_network()
+    random.seed(1)
+    pairs = [tuple(random.sample([x.my_id for x in nodes], 2))
+             for _ in range(100)]
+    opened = exchange(nodes, pairs)
+    assert sorted((r, msg[SENDER]) for r, msg in opened) == \
+        sorted((r, s) for s, r in pairs)
+
+
+def test_home_bounces_messages_to_missing_ids():
+    nodes = ring_network()
+    order = ring_order(nodes)
+    by_id = {x.my_id: x for x in nodes}
+    missing = 10 * len(nodes) + 3
+    home = by_id[order[missing % len(nodes)]]
+    sender = next(x for x in nodes
+                  if x is not home and missing not in x.ring_position)
+
+    assert exchange(nodes, [(sender.my_id, missing)]) == []
+    assert home.metrics.ring[(RING_MSG, "forward")] == 1
+    assert sender.metrics.ring[(RING_MSG, "bounce")] == 1
+
+
+def test_home_refuses_missing_ids_at_once():
+    nodes = ring_network()
+    order = ring_order(nodes)
+    by_id = {x.my_id: x for x in nodes}
+    missing = 10 * len(nodes) + 3
+    home = by_id[order[missing % len(nodes)]]
+    exchange(nodes, [(home.my_id, missing)])
+    assert home.metrics.ring[(RING_MSG, "send")] == 0
+
+
+def test_receiver_answers_without_the_senders_home():
+    nodes = ring_network()
+    order = ring_order(nodes)
+    sender, receiver = next(
+        (a, b) for a in nodes for b in nodes
+        if a is not b and a.my_id not in b.ring_position
+    )
+    exchange(nodes, [(sender.my_id, receiver.my_id)])
+    assert receiver.ring_position[sender.my_id] == \
+        sender.ring_position[sender.my_id]
+    assert receiver.ring_target(sender.my_id) == order.index(sender.my_id)
+
+
+@pytest.fixture
+def no_fingers(monkeypatch):
+    monkeypatch.setattr(make_ring, "USE_FINGERS", False)
+    monkeypatch.setattr(pika_node, "USE_FINGERS", False)
+
+
+def test_without_fingers_nodes_know_all_positions(no_fingers):
+    nodes = ring_network()
+    order = ring_order(nodes)
+    for x in nodes:
+        assert {u: i for u, (i, _) in x.ring_position.items()} == \
+            {u: i for i, u in enumerate(order)}
+        assert not x.valid_receiver(10 * len(nodes) + 3)
+
+    random.seed(2)
+    pairs = [tuple(random.sample(order, 2)) for _ in range(50)]
+    opened = exchange(nodes, pairs)
+    assert sorted((r, msg[SENDER]) for r, msg in opened) == \
+        sorted((r, s) for s, r in pairs)
+
+
+def test_without_fingers_messages_take_the_shorter_way(no_fingers):
+    nodes = ring_network()
+    order = ring_order(nodes)
+    by_id = {x.my_id: x for x in nodes}
+    sender = by_id[order[0]]
+    length = sender.ring_length
+    offset = {u: sender.ring_position[u][1] for u in order}
+    # the farthest receiver on each side
+    right = max(order[1:], key=lambda u: (offset[u] <= length / 2, offset[u]))
+    left = min(order[1:], key=lambda u: (offset[u] <= length / 2, offset[u]))
+
+    for receiver, direction, between in [
+        (right, RIGHT, order[1:order.index(right)]),
+        (left, LEFT, order[order.index(left) + 1:]),
+    ]:
+        for x in nodes:
+            x.metrics.ring.clear()
+        opened = exchange(nodes, [(sender.my_id, receiver)])
+        assert [msg[DIRECTION] for _, msg in opened] == [direction]
+        forwarded = {x.my_id for x in nodes
+                     if x.metrics.ring[(RING_MSG, "forward")]}
+        # relays of a ring route may be the receiver, which opens the
+        # message before the end of the route
+        assert forwarded <= set(between)
+
+
+def distributed_ring(n, seed):
+    """
+    Builds a distributed ring on a random tree of n nodes, delivering the
+    setup messages by hand.
+    Returns:
+        (dict, {id: node}, dict, {id: parent id})
+    """
+    rng = random.Random(seed)
+    ids = rng.sample(range(1, 10 * n), n)
+    parent = {ids[0]: None}
+    for i in range(1, n):
+        parent[ids[i]] = ids[rng.randrange(i)]
+    inbox = []
+    nodes = {u: types.SimpleNamespace(
+        my_id=u, role=LEADER if parent[u] is None else PRUNED, reflux={},
+        send_msg=lambda msg, receiver, mailbox: inbox.append((receiver, msg))
+    ) for u in ids}
+    # REFLUX : children before their parent
+    for u in reversed(ids[1:]):
+        nodes[parent[u]].reflux[u] = shout.subtree_summary(nodes[u])
+
+    make_ring.make_ring_distributed(nodes[ids[0]])
+    while inbox:
+        receiver, setup = inbox.pop()
+        make_ring.set_ring_setup(nodes[receiver], setup)
+    return nodes, parent
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("n", [1, 2, 30])
+def test_distributed_ring_follows_the_tree(n, seed):
+    nodes, parent = distributed_ring(n, seed)
+    at = {x.ring_position[u]: u for u, x in nodes.items()}
+    assert sorted(at) == list(range(n))
+
+    def tree_edge(u, v):
+        return parent[u] == v or parent[v] == u
+
+    for p in range(n):
+        u, v = at[p], at[(p + 1) % n]
+        right, left = nodes[u].route_right, nodes[v].route_left
+        if n == 1:
+            assert right == left == []
+            continue
+        assert right[-1] == v and left[-1] == u
+        assert all(tree_edge(a, b) for a, b in zip([u] + right, right))
+        assert all(tree_edge(a, b) for a, b in zip([v] + left, left))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the coalescing of messages (PikaNode.buffer_msg, flush_queue and
+flush_outbox), on the in-memory transport, with both codecs : outboxes are
+published once big enough or old enough, and each queue gets its messages
+in order.
+Run from /src/ with `python -m pytest tests`
+"""
+
+import pytest
+
+import lib.pika_node as pika_node
+from lib.constants import *
+from lib.codec import JsonCodec, BinaryCodec
+from lib.pika_node import PikaNode
+from lib.transport import MemoryBroker, MemoryTransport
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture(params=[JsonCodec, BinaryCodec])
+def node(request, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(pika_node, "COALESCE", True)
+    monkeypatch.setattr(pika_node, "COALESCE_DELAY", 1.0)
+    monkeypatch.setattr(pika_node.time, "monotonic", clock.monotonic)
+    node = PikaNode(1, MemoryTransport(MemoryBroker()), interactive=False)
+    node.codec = request.param()
+    node.out_queue.update({2: "to_2", 3: "to_3"})
+    node.clock = clock
+    return node
+
+
+def published(node, queue):
+    """
+    Returns the bodies published on queue, decoded
+    """
+    bodies = []
+    body = node.transport.get(queue)
+    while body is not None:
+        bodies.append(node.codec.decode(body))
+        body = node.transport.get(queue)
+    return bodies
+
+
+def unbatch(bodies):
+    """
+    Returns the [mailbox, msg] frames of the decoded bodies, in order
+    """
+    frames = []
+    for body in bodies:
+        frames += body[1] if body[0] == BATCH else [body]
+    return frames
+
+
+def test_outbox_is_published_once_big_enough(node, monkeypatch):
+    size = len(node.codec.encode([YO_PHASE, [0, 0]]))
+    monkeypatch.setattr(pika_node, "COALESCE_MAX_BYTES", 3 * size)
+    for i in range(7):
+        node.send_msg([i, 0], 2, YO_PHASE)
+
+    bodies = published(node, "to_2")
+    assert [body[0] for body in bodies] == [BATCH, BATCH]
+    assert [len(body[1]) for body in bodies] == [3, 3]
+    assert node.metrics.publishes == 2
+    # the last message waits for more
+    assert node.outbox_size[("to_2", 0)] == size
+
+
+def test_outboxes_are_published_once_old_enough(node):
+    node.send_msg("a", 2, YO_PHASE)
+    node.clock.now = 0.5
+    node.send_msg("b", 3, YO_PHASE)
+    assert published(node, "to_2") == published(node, "to_3") == []
+
+    # the oldest body waited COALESCE_DELAY : all outboxes go
+    node.clock.now = 1.0
+    node.send_msg("c", 2, YO_PHASE)
+    assert unbatch(published(node, "to_2")) == [[YO_PHASE, "a"],
+                                                [YO_PHASE, "c"]]
+    assert published(node, "to_3") == [[YO_PHASE, "b"]]
+    assert node.outbox == dict() and node.outbox_since is None
+
+    # the delay starts again with the next body
+    node.clock.now = 1.5
+    node.send_msg("d", 2, YO_PHASE)
+    assert published(node, "to_2") == []
+
+
+def test_each_queue_keeps_its_order(node, monkeypatch):
+    size = len(node.codec.encode([SHOUT, [0, 0]]))
+    monkeypatch.setattr(pika_node, "COALESCE_MAX_BYTES", 2 * size)
+    sent = {2: [], 3: []}
+    for i in range(20):
+        receiver = 2 if i % 3 else 3
+        node.send_msg([i, i], receiver, SHOUT)
+        sent[receiver].append([SHOUT, [i, i]])
+    node.flush_outbox()
+
+    assert unbatch(published(node, "to_2")) == sent[2]
+    assert unbatch(published(node, "to_3")) == sent[3]
+
+
+def test_route_installations_go_first(node):
+    node.send_msg("packet", 2, RING_BULK)
+    node.send_msg("route", 2, RING)
+    node.flush_queue(("to_2", 0))
+
+    assert unbatch(published(node, "to_2")) == [[RING, "route"],
+                                                [RING_BULK, "packet"]]
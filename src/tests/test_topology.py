@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the topology generators and of the edge-list loader
+(lib/topology.py).
+Run from /src/ with `python -m pytest tests`
+"""
+
+import pytest
+
+from lib.config import DEFAULT_DEGREE
+from lib.constants import ERDOS_RENYI, BARABASI_ALBERT, SMALL_WORLD
+from lib.topology import generate, load_edge_list
+
+
+@pytest.mark.parametrize("family", [ERDOS_RENYI, BARABASI_ALBERT,
+                                    SMALL_WORLD])
+def test_default_degree(family):
+    topology = generate(family, 2000, 0, 1)
+    assert topology.nb_edges == pytest.approx(DEFAULT_DEGREE * 2000 / 2,
+                                              rel=0.05)
+
+
+def test_small_default():
+    assert generate(ERDOS_RENYI, 3, 0, 1).nb_edges == 3
+
+
+def test_too_many_edges():
+    assert generate(ERDOS_RENYI, 5, 10, 1).nb_edges == 10
+    with pytest.raises(ValueError):
+        generate(ERDOS_RENYI, 5, 11, 1)
+
+
+@pytest.mark.parametrize("family", [ERDOS_RENYI, BARABASI_ALBERT,
+                                    SMALL_WORLD])
+def test_generated_graphs_are_connected(family):
+    assert generate(family, 500, 0, 2).is_connected()
+
+
+def edge_list(tmp_path, text):
+    path = tmp_path / "edges.txt"
+    path.write_text(text)
+    return str(path)
+
+
+def test_load_edge_list(tmp_path):
+    topology = load_edge_list(edge_list(
+        tmp_path, "# a comment\n10 20 0.5\n20 30\n30 10\n10 10\n20 10\n"
+    ), chunk_size=4)
+    assert list(topology.labels) == [10, 20, 30]
+    assert topology.nb_edges == 3
+    assert sorted(topology[0]) == [1, 2]
+
+
+@pytest.mark.parametrize("text", ["", "# only comments\n", "5 5\n"])
+def test_load_without_edges(tmp_path, text):
+    with pytest.raises(ValueError):
+        load_edge_list(edge_list(tmp_path, text))
+
+
+def test_load_disconnected(tmp_path):
+    with pytest.raises(ValueError):
+        load_edge_list(edge_list(tmp_path, "1 2\n3 4\n"))
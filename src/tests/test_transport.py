@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the shared connections (lib/transport.py), on a fake pika
+connection holding its queues in memory : channels of a pool only see their
+own messages, received messages are acknowledged in batches, and
+confirmed publishes do not wait in the I/O thread.
+Run from /src/ with `python -m pytest tests`
+"""
+
+import queue
+import threading
+from collections import deque
+
+import pytest
+
+import lib.transport as transport
+from lib.transport import ConnectionPool, PikaTransport
+
+
+class FakeFrame:
+    def __init__(self, tag):
+        self.delivery_tag = tag
+
+
+class FakeChannel:
+    """
+    Channel of FakeConnection : pushes up to prefetch messages of its
+    consumed queue, and records its acknowledgements
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.is_open = True
+        self.next_tag = 1
+        self.unacked = dict()
+        self.acks = []
+        self.consumer = None
+        self.prefetch = 0
+
+    def queue(self, name):
+        return self.connection.queues.setdefault(name, deque())
+
+    def queue_declare(self, queue, arguments=None):
+        self.queue(queue)
+
+    def queue_delete(self, queue):
+        self.connection.queues.pop(queue, None)
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.connection.publishers.append(threading.current_thread())
+        self.queue(routing_key).append(body)
+        return True
+
+    def basic_qos(self, prefetch_count):
+        self.prefetch = prefetch_count
+
+    def basic_consume(self, callback, queue, no_ack):
+        self.consumer = (callback, queue)
+        return "consumer"
+
+    def basic_cancel(self, consumer_tag):
+        self.consumer = None
+
+    def deliver(self):
+        if self.consumer is None:
+            return
+        callback, name = self.consumer
+        messages = self.queue(name)
+        while messages and len(self.unacked) < self.prefetch:
+            tag, self.next_tag = self.next_tag, self.next_tag + 1
+            self.unacked[tag] = messages[0]
+            callback(self, FakeFrame(tag), None, messages.popleft())
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+        for tag in list(self.unacked):
+            if tag == delivery_tag or multiple and tag < delivery_tag:
+                del self.unacked[tag]
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self.basic_ack(delivery_tag, multiple)
+
+    def basic_get(self, queue):
+        messages = self.queue(queue)
+        if not messages:
+            return None, None, None
+        return FakeFrame(0), None, messages.popleft()
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeConnection:
+    """
+    pika.BlockingConnection with its queues in memory, shared by all the
+    fake connections of a test
+    """
+    queues = dict()
+    publishers = []
+    nb_opened = 0
+
+    def __init__(self, parameters):
+        FakeConnection.nb_opened += 1
+        self.callbacks = queue.Queue()
+        self.channels = []
+
+    def channel(self):
+        channel = FakeChannel(self)
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.put(callback)
+
+    def process_data_events(self, time_limit=0):
+        for channel in self.channels:
+            channel.deliver()
+        try:
+            while True:
+                self.callbacks.get(timeout=min(time_limit or 0, 0.001))()
+        except queue.Empty:
+            pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeConnection.queues = dict()
+    FakeConnection.publishers = []
+    FakeConnection.nb_opened = 0
+    monkeypatch.setattr(transport.pika, "BlockingConnection", FakeConnection,
+                        raising=False)
+    pool = ConnectionPool(size=1, parameters=None)
+    yield pool
+    pool.close()
+
+
+def open_transport(pool):
+    t = pool.transport()
+    t.open()
+    return t
+
+
+def test_channels_only_see_their_queue(pool):
+    a, b, sender = (open_transport(pool) for _ in range(3))
+    assert FakeConnection.nb_opened == 1
+    a.subscribe("a")
+    b.subscribe("b")
+    for i in range(5):
+        sender.publish("a", "to a %s" % i)
+        sender.publish("b", "to b %s" % i)
+
+    assert [a.receive(1) for _ in range(5)] == \
+        ["to a %s" % i for i in range(5)]
+    assert [b.receive(1) for _ in range(5)] == \
+        ["to b %s" % i for i in range(5)]
+    assert a.receive(0) is None and b.receive(0) is None
+    assert a.channel is not b.channel
+
+
+def test_messages_are_acknowledged_in_batches(pool):
+    sender, receiver = open_transport(pool), open_transport(pool)
+    for i in range(10):
+        sender.publish("q", i)
+    receiver.subscribe("q", prefetch=4)
+
+    assert receiver.receive(1) == 0
+    assert receiver.nb_unacked == 1
+    assert receiver.receive(1) == 1
+    # prefetch // 2 messages read : a single frame acknowledges both
+    assert receiver.nb_unacked == 0
+    assert receiver.last_tag == 2
+    for i in range(2, 5):
+        assert receiver.receive(1) == i
+
+    left = receiver.unsubscribe()
+    # the messages pushed but not read are acknowledged and handed back
+    assert left == list(range(5, 5 + len(left)))
+    assert receiver.nb_unacked == 0
+    pool.connections[0].call(lambda: None)      # let the I/O thread ack
+    assert receiver.channel.unacked == dict()
+    assert all(multiple for _, multiple in receiver.channel.acks)
+    assert len(receiver.channel.acks) == 3 + bool(left)
+
+
+def test_confirmed_publishes_leave_the_io_thread(pool, monkeypatch):
+    monkeypatch.setattr(transport, "aio_pika", object())
+    monkeypatch.setattr(PikaTransport, "publish_batch",
+                        transport.Transport.publish_batch)
+    launcher = open_transport(pool)
+    launcher.confirm_delivery()
+    launcher.publish("q", "one")
+    launcher.publish_batch([("q", "two"), ("r", "three")], declare=True)
+
+    io_thread = pool.connections[0].thread
+    assert len(FakeConnection.publishers) == 3
+    assert io_thread not in FakeConnection.publishers
+    assert list(FakeConnection.queues["q"]) == ["one", "two"]
+    launcher.close()
+    assert launcher.confirmed is None
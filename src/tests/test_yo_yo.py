@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Checks the yo-yo election of the nodes (lib/yo_yo.py) against the
+centralized simulator (lib/yo_yo_sim.py) : on the same graph, with the same
+ids, both must elect the same leader, in the same number of rounds, with
+the same number of messages in each phase.
+Run from /src/ with `python -m pytest tests`
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from lib.constants import *
+from lib.topology import Topology
+from lib.yo_yo_sim import simulate_yo_yo
+from simulate import simulate
+
+N = 60
+
+
+def network_topology(nodes):
+    """
+    Returns the Topology of a simulated network, its vertices being the
+    nodes in order, and the array of their ids
+    """
+    index = {x.my_id: i for i, x in enumerate(nodes)}
+    u, v = [], []
+    for i, x in enumerate(nodes):
+        for neighbor in x.neighbors_ids:
+            if i < index[neighbor]:
+                u.append(i)
+                v.append(index[neighbor])
+    ids = np.array([x.my_id for x in nodes], dtype=np.int64)
+    return Topology(len(nodes), np.array(u), np.array(v)), ids
+
+
+@pytest.mark.parametrize("family", [ERDOS_RENYI, BARABASI_ALBERT, GRID,
+                                    SMALL_WORLD])
+@pytest.mark.parametrize("seed", range(4))
+def test_simulator_matches_nodes(family, seed):
+    random.seed(seed)
+    nodes = simulate(N, 2 * N, family, seed)
+    stats = simulate_yo_yo(*network_topology(nodes))
+
+    leader = next(x for x in nodes if x.role == LEADER)
+    assert stats.leader == leader.my_id
+    assert stats.rounds == max(x.yo_yo_rounds for x in nodes)
+    assert sum(stats.yo_messages) == \
+        sum(x.metrics.sent.get(YO_PHASE, 0) for x in nodes)
+    assert sum(stats.oy_messages) == \
+        sum(x.metrics.sent.get(OY_PHASE, 0) for x in nodes)